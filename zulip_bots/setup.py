@@ -47,6 +47,7 @@ setup(
         "console_scripts": [
             "zulip-run-bot=zulip_bots.run:main",
             "zulip-bot-shell=zulip_bots.bot_shell:main",
+            "zulip-bot-replay=zulip_bots.replay:main",
         ],
     },
     install_requires=[
@@ -2,6 +2,7 @@
 import argparse
 import os
 import sys
+from typing import Any
 
 from zulip_bots.finder import import_module_from_source, resolve_bot_path
 from zulip_bots.simple_lib import MockMessageServer, TerminalBotHandler
@@ -61,6 +62,11 @@ def main() -> None:
     if hasattr(message_handler, "initialize") and callable(message_handler.initialize):
         message_handler.initialize(bot_handler)
 
+    def run_scheduled_job(method_name: str, data: Any) -> None:
+        getattr(message_handler, method_name)(data, bot_handler)
+
+    bot_handler.scheduler.start(run_scheduled_job)
+
     sender_email = "foo_sender@zulip.com"
 
     try:
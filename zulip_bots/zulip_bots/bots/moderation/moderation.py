@@ -1,35 +1,28 @@
 #!/usr/bin/env python3
 
 import zulip
-import re
 from typing import Dict, Any
 import json
 import os
 import requests
 import random
 
+from zulip_bots.command_router import CommandRouter, Dispatch
+
 NOTES_FILE = "notes.json"
 LOCKDOWN_FILE = "lockdown.json"
 # NOTE: The members group ID (1066759) is specific to this Zulip instance.
 MEMBERS_GROUP_ID = 1066759
 
+def moderator_only(bot: "ModerationBot", message: Dict[str, Any], bot_handler: Any) -> bool:
+    return bot.is_moderator(message)
+
 class ModerationBot(object):
     """
     A moderation bot to help manage larger communities.
     """
 
-    # Pre-compile regexes for efficiency
-    RESOLVE_COMMAND = re.compile(r"resolve$")
-    UNRESOLVE_COMMAND = re.compile(r"unresolve$")
-    PURGE_COMMAND = re.compile(r"purge\s+(\d+)$")
-    PURGE_USER_COMMAND = re.compile(r"purge\s+([^\s]+)\s+(\d+)$")
-    PURGE_USER_ALL_COMMAND = re.compile(r"purge\s+([^\s@]+@[^\s]+)$")
-    MUTE_COMMAND = re.compile(r"mute\s+([^\s@]+@[^\s]+)$")
-    UNMUTE_COMMAND = re.compile(r"unmute\s+([^\s@]+@[^\s]+)$")
-    GET_NOTES_COMMAND = re.compile(r"getnotes\s+([^\s@]+@[^\s]+)$")
-    ADD_NOTE_COMMAND = re.compile(r"addnote\s+([^\s@]+@[^\s]+)\s+(.+)$")
-    LOCKDOWN_START_COMMAND = re.compile(r"lockdown start$")
-    LOCKDOWN_END_COMMAND = re.compile(r"lockdown end$")
+    router = CommandRouter()
 
     def usage(self) -> str:
         """
@@ -44,115 +37,105 @@ class ModerationBot(object):
         Handles incoming messages, deletes the command message, and processes the command.
         """
         self.client.delete_message(message["id"])
-        self.process_command(message)
+        self.process_command(message, bot_handler)
 
-    def process_command(self, message: Dict[str, Any]) -> None:
+    def process_command(self, message: Dict[str, Any], bot_handler: Any = None) -> None:
         """
         Parses and processes bot commands from a message.
         """
         content = message["content"].strip()
-        stream_name = message.get("display_recipient", "")
-        topic_name = message.get("subject", "")
         self.track_event({
             'type': 'pageview',
             'user_id': str(random.randint(1, 100000)),
             'pathname': '/msg',
-        })
+        }, bot_handler)
         try:
             # Handle help and empty commands
             if content in ("", "help"):
                 self.send_help_message(message)
-
-                return
-
-            # User commands (available to all users)
-            # Handle "resolve" command
-            if self.RESOLVE_COMMAND.match(content):
-                self.resolve_topic(message)
-                return
-
-            # Handle "unresolve" command
-            if self.UNRESOLVE_COMMAND.match(content):
-                self.unresolve_topic(message)
                 return
 
-            # Moderation commands (restricted to moderators)
-            if not self.is_moderator(message):
+            result = self.router.dispatch(message, bot_handler, owner=self, content=content)
+            if result is Dispatch.DENIED:
                 self.send_response(message, "Unauthorized to use moderation commands.")
-                return
-
-            # Handle "purge N" command
-            purge_match = self.PURGE_COMMAND.match(content)
-            if purge_match:
-                count = int(purge_match.group(1))
-                self.purge_messages(stream_name, topic_name, count, message)
-                return
-
-            # Handle "purge email@example.com N" command
-            purge_user_match = self.PURGE_USER_COMMAND.match(content)
-            if purge_user_match:
-                user_email = purge_user_match.group(1)
-                count = int(purge_user_match.group(2))
-                self.purge_user_messages(stream_name, topic_name, user_email, count, message)
-                return
-
-            # Handle "purge email@example.com" command (all messages from user)
-            purge_user_all_match = self.PURGE_USER_ALL_COMMAND.match(content)
-            if purge_user_all_match:
-                user_email = purge_user_all_match.group(1)
-                self.purge_user_messages(stream_name, topic_name, user_email, 1000, message)
-                return
-
-            # Handle "clean" command (delete all bot messages in stream)
-            if content.strip() == "clean":
-                self.purge_user_messages(stream_name, topic_name, "hasd-bot@hasd.zulipchat.com", 1000, message)
-                return
-
-            # Handle "mute" command
-            mute_match = self.MUTE_COMMAND.match(content)
-            if mute_match:
-                user_email = mute_match.group(1)
-                self.mute_user(user_email, message)
-                return
-
-            # Handle "unmute" command
-            unmute_match = self.UNMUTE_COMMAND.match(content)
-            if unmute_match:
-                user_email = unmute_match.group(1)
-                self.unmute_user(user_email, message)
-                return
-
-            # Handle "getnotes" command
-            get_notes_match = self.GET_NOTES_COMMAND.match(content)
-            if get_notes_match:
-                user_email = get_notes_match.group(1)
-                author_id = message["sender_id"]
-                self.get_notes(user_email, author_id, message)
-                return
-
-            # Handle "addnote" command
-            add_note_match = self.ADD_NOTE_COMMAND.match(content)
-            if add_note_match:
-                user_email = add_note_match.group(1)
-                note = add_note_match.group(2)
-                self.add_note(user_email, note, message)
-                return
-
-            # Lockdown commands
-            if self.LOCKDOWN_START_COMMAND.match(content):
-                self.lockdown_start(message)
-                return
-
-            if self.LOCKDOWN_END_COMMAND.match(content):
-                self.lockdown_end(message)
-                return
-
-            # If no valid command is matched, send an error message.
-            self.send_error_message(message)
+            elif result is Dispatch.UNKNOWN:
+                # If no valid command is matched, send an error message.
+                self.send_error_message(message)
 
         except Exception as e:
             self.send_response(message, f"Error processing command: {str(e)}")
 
+    # User commands (available to all users)
+    @router.command(r"resolve", help="Mark the current topic as resolved.", group="User Commands")
+    def command_resolve(self, message: Dict[str, Any], bot_handler: Any) -> None:
+        self.resolve_topic(message)
+
+    @router.command(r"unresolve", help="Mark the current topic as unresolved.", group="User Commands")
+    def command_unresolve(self, message: Dict[str, Any], bot_handler: Any) -> None:
+        self.unresolve_topic(message)
+
+    # Moderation commands (restricted to moderators)
+    @router.command(r"purge\s+(\d+)", syntax="purge <N>",
+                    help="Delete the last N messages in the current topic.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_purge(self, message: Dict[str, Any], bot_handler: Any, count: str) -> None:
+        self.purge_messages(message.get("display_recipient", ""), message.get("subject", ""),
+                            int(count), message)
+
+    @router.command(r"purge\s+([^\s]+)\s+(\d+)", syntax="purge <email> <N>",
+                    help="Delete the last N messages from a user in the current topic.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_purge_user(self, message: Dict[str, Any], bot_handler: Any, user_email: str, count: str) -> None:
+        self.purge_user_messages(message.get("display_recipient", ""), message.get("subject", ""),
+                                 user_email, int(count), message)
+
+    @router.command(r"purge\s+([^\s@]+@[^\s]+)", syntax="purge <email>",
+                    help="Delete all messages from a user in the current topic.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_purge_user_all(self, message: Dict[str, Any], bot_handler: Any, user_email: str) -> None:
+        self.purge_user_messages(message.get("display_recipient", ""), message.get("subject", ""),
+                                 user_email, 1000, message)
+
+    @router.command(r"clean", help="Clean up all messages from this bot in the current topic.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_clean(self, message: Dict[str, Any], bot_handler: Any) -> None:
+        self.purge_user_messages(message.get("display_recipient", ""), message.get("subject", ""),
+                                 "hasd-bot@hasd.zulipchat.com", 1000, message)
+
+    @router.command(r"mute\s+([^\s@]+@[^\s]+)", syntax="mute <email>", help="Mute a user.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_mute(self, message: Dict[str, Any], bot_handler: Any, user_email: str) -> None:
+        self.mute_user(user_email, message)
+
+    @router.command(r"unmute\s+([^\s@]+@[^\s]+)", syntax="unmute <email>", help="Unmute a user.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_unmute(self, message: Dict[str, Any], bot_handler: Any, user_email: str) -> None:
+        self.unmute_user(user_email, message)
+
+    @router.command(r"getnotes\s+([^\s@]+@[^\s]+)", syntax="getnotes <email>",
+                    help="Get moderation notes for a user.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_get_notes(self, message: Dict[str, Any], bot_handler: Any, user_email: str) -> None:
+        self.get_notes(user_email, message["sender_id"], message)
+
+    @router.command(r"addnote\s+([^\s@]+@[^\s]+)\s+(.+)", syntax="addnote <email> <note>",
+                    help="Add a moderation note for a user.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_add_note(self, message: Dict[str, Any], bot_handler: Any, user_email: str, note: str) -> None:
+        self.add_note(user_email, note, message)
+
+    # Lockdown commands
+    @router.command(r"lockdown start",
+                    help="Remove posting rights from the members group in all channels.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_lockdown_start(self, message: Dict[str, Any], bot_handler: Any) -> None:
+        self.lockdown_start(message)
+
+    @router.command(r"lockdown end", help="Restore posting rights to the members group.",
+                    group="Moderation Commands", permission=moderator_only)
+    def command_lockdown_end(self, message: Dict[str, Any], bot_handler: Any) -> None:
+        self.lockdown_end(message)
+
     def purge_messages(self, stream_name: str, topic_name: str, count: int, original_message: Dict[str, Any]) -> None:
         """Delete the last N messages from a topic."""
         try:
@@ -466,27 +449,9 @@ class ModerationBot(object):
 
     def send_help_message(self, message: Dict[str, Any]) -> None:
         """Sends a help message with available commands based on user role."""
-        help_text = """
-**Available Commands:**
-
-**User Commands:**
-- `@HASD resolve`: Mark the current topic as resolved.
-- `@HASD unresolve`: Mark the current topic as unresolved.
-"""
-        if self.is_moderator(message):
-            help_text += """
-**Moderation Commands:**
-- `@HASD purge <N>`: Delete the last N messages in the current topic.
-- `@HASD purge <email> <N>`: Delete the last N messages from a user in the current topic.
-- `@HASD purge <email>`: Delete all messages from a user in the current topic.
-- `@HASD clean`: Clean up all messages from this bot in the current topic.
-- `@HASD mute <email>`: Mute a user.
-- `@HASD unmute <email>`: Unmute a user.
-- `@HASD getnotes <email>`: Get moderation notes for a user.
-- `@HASD addnote <email> <note>`: Add a moderation note for a user.
-- `@HASD lockdown start`: Remove posting rights from the members group in all channels.
-- `@HASD lockdown end`: Restore posting rights to the members group.
-"""
+        help_text = "**Available Commands:**\n\n" + self.router.help_text(
+            message, None, owner=self, prefix="@HASD "
+        )
         self.send_response(message, help_text)
 
     def is_moderator(self, message: Dict[str, Any]) -> bool:
@@ -495,9 +460,11 @@ class ModerationBot(object):
         # Role > 300 are members and guests.
         return int(author_details["user"]["role"]) <= 300
 
-    def track_event(self, event_data):
+    def track_event(self, event_data, bot_handler=None):
         if os.getenv('RYBBIT_API_KEY'):
-            response = requests.post(
+            # Reuse the bot handler's pooled session, which also adds a timeout.
+            http = bot_handler.http if bot_handler is not None else requests
+            response = http.post(
                 'https://analytics.aamira.me/api/track',
                 headers={'Content-Type': 'application/json'},
                 json={
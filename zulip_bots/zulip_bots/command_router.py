@@ -0,0 +1,188 @@
+import re
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from zulip_bots.lib import AbstractBotHandler
+
+CommandFunc = TypeVar("CommandFunc", bound=Callable[..., Any])
+
+
+class Dispatch(Enum):
+    HANDLED = "handled"
+    DENIED = "denied"
+    UNKNOWN = "unknown"
+
+
+class Command:
+    def __init__(
+        self,
+        pattern: str,
+        func: Callable[..., Any],
+        syntax: Optional[str],
+        help: str,
+        group: str,
+        permission: Optional[Callable[..., bool]],
+    ) -> None:
+        self.pattern = pattern
+        self.func = func
+        self.syntax = syntax
+        self.help = help
+        self.group = group
+        self.permission = permission
+        self.num_groups = re.compile(pattern).groups
+
+
+class CommandRouter:
+    """
+    Maps the commands a bot understands to the functions handling them.
+
+    Commands are registered with the `command` decorator, typically on the
+    methods of a bot's handler class:
+
+        class MyBotHandler:
+            router = CommandRouter()
+
+            @router.command(r"mute\\s+(\\S+)", syntax="mute <email>",
+                            help="Mute a user.", permission=moderator_only)
+            def mute(self, message, bot_handler, email):
+                ...
+
+            def handle_message(self, message, bot_handler):
+                if self.router.dispatch(message, bot_handler, owner=self) is Dispatch.UNKNOWN:
+                    ...
+
+    All patterns are compiled into one regular expression, so dispatching a
+    message costs a single match no matter how many commands a bot has.
+    A pattern has to match the whole (stripped) message content, and its
+    capturing groups are passed to the handler as positional arguments.
+    When several patterns match, the one registered first wins.
+
+    A permission predicate is called with the message and the bot handler
+    (preceded by `owner`, if one is passed to `dispatch`); commands whose
+    predicate returns False are reported as `Dispatch.DENIED`.
+    """
+
+    def __init__(self, flags: int = 0) -> None:
+        self.flags = flags
+        self.commands: List[Command] = []
+        self._regex: Optional[re.Pattern[str]] = None
+        self._by_group: Dict[int, Command] = {}
+
+    def command(
+        self,
+        pattern: str,
+        syntax: Optional[str] = None,
+        help: str = "",
+        group: str = "",
+        permission: Optional[Callable[..., bool]] = None,
+    ) -> Callable[[CommandFunc], CommandFunc]:
+        def decorator(func: CommandFunc) -> CommandFunc:
+            self.add_command(pattern, func, syntax, help, group, permission)
+            return func
+
+        return decorator
+
+    def add_command(
+        self,
+        pattern: str,
+        func: Callable[..., Any],
+        syntax: Optional[str] = None,
+        help: str = "",
+        group: str = "",
+        permission: Optional[Callable[..., bool]] = None,
+    ) -> None:
+        self.commands.append(Command(pattern, func, syntax, help, group, permission))
+        # Recompile lazily, so that a class body full of decorators only
+        # pays for one compilation.
+        self._regex = None
+
+    def _compile(self) -> re.Pattern[str]:
+        alternatives = []
+        group_index = 1
+        self._by_group = {}
+        for command in self.commands:
+            alternatives.append(f"({command.pattern})")
+            self._by_group[group_index] = command
+            group_index += command.num_groups + 1
+        self._regex = re.compile("|".join(alternatives), self.flags)
+        return self._regex
+
+    def match(self, content: str) -> Optional[Tuple[Command, Tuple[Optional[str], ...]]]:
+        regex = self._regex if self._regex is not None else self._compile()
+        match = regex.fullmatch(content.strip())
+        if match is None:
+            return None
+        # The group wrapping each command's pattern is the last one to close,
+        # so `lastindex` always points at the command that matched.
+        index = match.lastindex
+        assert index is not None
+        command = self._by_group[index]
+        args = match.groups()[index : index + command.num_groups]
+        return command, args
+
+    def is_permitted(
+        self,
+        command: Command,
+        message: Dict[str, Any],
+        bot_handler: Optional[AbstractBotHandler],
+        owner: Optional[Any] = None,
+    ) -> bool:
+        if command.permission is None:
+            return True
+        if owner is not None:
+            return command.permission(owner, message, bot_handler)
+        return command.permission(message, bot_handler)
+
+    def dispatch(
+        self,
+        message: Dict[str, Any],
+        bot_handler: AbstractBotHandler,
+        owner: Optional[Any] = None,
+        content: Optional[str] = None,
+    ) -> Dispatch:
+        result = self.match(message["content"] if content is None else content)
+        if result is None:
+            return Dispatch.UNKNOWN
+        command, args = result
+        if not self.is_permitted(command, message, bot_handler, owner):
+            return Dispatch.DENIED
+        if owner is not None:
+            command.func(owner, message, bot_handler, *args)
+        else:
+            command.func(message, bot_handler, *args)
+        return Dispatch.HANDLED
+
+    def help_text(
+        self,
+        message: Optional[Dict[str, Any]] = None,
+        bot_handler: Optional[AbstractBotHandler] = None,
+        owner: Optional[Any] = None,
+        prefix: str = "",
+    ) -> str:
+        """
+        Lists the commands that have a `help` text, grouped by their `group`.
+        If a message is passed, commands that its sender isn't permitted
+        to use are left out.
+        """
+        permitted: Dict[Callable[..., bool], bool] = {}
+        groups: Dict[str, List[str]] = {}
+        for command in self.commands:
+            if not command.help:
+                continue
+            if command.permission is not None and message is not None:
+                # Permission checks can be expensive (e.g. an API call),
+                # so only ask each predicate once.
+                if command.permission not in permitted:
+                    permitted[command.permission] = self.is_permitted(
+                        command, message, bot_handler, owner
+                    )
+                if not permitted[command.permission]:
+                    continue
+            syntax = command.syntax if command.syntax is not None else command.pattern
+            groups.setdefault(command.group, []).append(f"- `{prefix}{syntax}`: {command.help}")
+
+        sections = []
+        for group, lines in groups.items():
+            header = [f"**{group}:**"] if group else []
+            sections.append("\n".join(header + lines))
+        return "\n\n".join(sections)
@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from zulip_bots.lib import BotStorage, StateHandler
+
+
+def conversation_key(message: Dict[str, Any]) -> str:
+    """
+    Identifies the conversation a message belongs to: its stream and
+    topic, or the set of people in a direct message.
+    """
+    if message["type"] == "stream":
+        stream = message.get("stream_id", message["display_recipient"])
+        return f"stream:{stream}:{message['subject']}"
+    user_ids = sorted(str(recipient["id"]) for recipient in message["display_recipient"])
+    return "dm:" + ",".join(user_ids)
+
+
+class CacheEntry:
+    def __init__(self, value: Any, size: int, last_used: float) -> None:
+        self.value = value
+        self.size = size
+        self.last_used = last_used
+
+
+class ConversationCache:
+    """
+    Keeps a stateful bot's per-conversation context in memory, within
+    bounds, so that a long-running bot's memory doesn't grow with the
+    number of conversations it has seen:
+
+        self.contexts = ConversationCache(bot_handler.storage, max_entries=1000, ttl=3600)
+
+        def handle_message(self, message, bot_handler):
+            key = conversation_key(message)
+            context = self.contexts.get(key, {})
+            ...
+            self.contexts.set(key, context)
+
+    The least recently used conversations are evicted once there are
+    more than `max_entries` of them, or their values take more than
+    `max_bytes`, measured as JSON; conversations not used for `ttl`
+    seconds are evicted too.  Evicted values are passed to `on_evict`, or
+    else saved in `storage`, from where `get` reloads them when their
+    conversation comes up again.  Call `set` again after changing a
+    value in place, so that its size is counted again, and `flush` before
+    stopping, to save the values still in memory.
+    """
+
+    def __init__(
+        self,
+        storage: Optional[BotStorage] = None,
+        max_entries: int = 1000,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        on_evict: Optional[Callable[[str, Any], None]] = None,
+        key_prefix: str = "conversation:",
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.storage = storage
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.key_prefix = key_prefix
+        self.clock = clock
+        self.size = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = dict(hits=0, misses=0, reloads=0, evictions=0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._stats["hits"] += 1
+                entry.last_used = now
+                self._entries.move_to_end(key)
+                return entry.value
+            self._stats["misses"] += 1
+            value = self._reload(key)
+            if value is None:
+                return default
+            self._stats["reloads"] += 1
+            self._insert(key, value, now)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            self._insert(key, value, now)
+
+    def delete(self, key: str) -> None:
+        """Forgets a conversation, both in memory and in storage."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+            if self.storage is not None and self.on_evict is None:
+                # Bot storage can't delete keys; None marks them as deleted.
+                self.storage.put(self.key_prefix + key, None)
+
+    def flush(self) -> None:
+        """Evicts every conversation, saving all the values in memory."""
+        with self._lock:
+            while self._entries:
+                self._evict_oldest()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self.size)
+
+    def _insert(self, key: str, value: Any, now: float) -> None:
+        size = len(json.dumps(value))
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self.size -= old_entry.size
+        self._entries[key] = CacheEntry(value, size, now)
+        self.size += size
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.size > self.max_bytes and len(self._entries) > 1
+        ):
+            self._evict_oldest()
+
+    def _expire(self, now: float) -> None:
+        if self.ttl is None:
+            return
+        # Entries are in order of last use, so the expired ones come first.
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if now - oldest.last_used < self.ttl:
+                break
+            self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        key, entry = self._entries.popitem(last=False)
+        self.size -= entry.size
+        self._stats["evictions"] += 1
+        if self.on_evict is not None:
+            self.on_evict(key, entry.value)
+        elif self.storage is not None:
+            self.storage.put(self.key_prefix + key, entry.value)
+            self._forget(key)
+
+    def _reload(self, key: str) -> Any:
+        if self.storage is None or self.on_evict is not None:
+            return None
+        try:
+            value = self.storage.get(self.key_prefix + key)
+        except KeyError:
+            return None
+        self._forget(key)
+        return value
+
+    def _forget(self, key: str) -> None:
+        # Don't keep a second copy of the value in StateHandler's own cache.
+        if isinstance(self.storage, StateHandler):
+            self.storage.forget(self.key_prefix + key)
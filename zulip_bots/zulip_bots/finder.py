@@ -1,10 +1,14 @@
 import importlib
 import importlib.abc
 import importlib.util
+import json
+import logging
 import os
+import sys
+import threading
 from pathlib import Path
 from types import ModuleType
-from typing import Any, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -23,6 +27,18 @@ def import_module_from_source(path: str, name: str) -> Any:
     return module
 
 
+def reimport_module(module: ModuleType) -> Any:
+    """
+    Imports a bot's module again, e.g. after a new version was deployed.
+    Modules imported by name (or from the registry) are reloaded in place;
+    modules imported from a path get a fresh module object.
+    """
+    if sys.modules.get(module.__name__) is module:
+        return importlib.reload(module)
+    assert module.__file__ is not None
+    return import_module_from_source(module.__file__, module.__name__)
+
+
 def import_module_by_name(name: str) -> Any:
     try:
         return importlib.import_module(name)
@@ -34,9 +50,111 @@ class DuplicateRegisteredBotNameError(Exception):
     pass
 
 
+REGISTRY_GROUP = "zulip_bots.registry"
+
+
+def environment_signature() -> List[Tuple[str, int]]:
+    """
+    The dist-info (and egg-info) directories on sys.path with their
+    modification times; installing, upgrading or removing a package
+    changes it.
+    """
+    signature: List[Tuple[str, int]] = []
+    for path in sys.path:
+        try:
+            entries = list(os.scandir(path or "."))
+        except OSError:
+            continue
+        signature.extend(
+            (entry.path, entry.stat().st_mtime_ns)
+            for entry in entries
+            if entry.name.endswith((".dist-info", ".egg-info"))
+        )
+    signature.sort()
+    return signature
+
+
+class RegistryIndex:
+    """
+    Maps the names of the bots registered in the "zulip_bots.registry"
+    entry point group to their entry points.
+
+    Scanning the entry points of every installed distribution is slow in
+    large environments, so the index is built once per process.  If
+    `cache_file` is set (by default, from the ZULIP_BOTS_REGISTRY_CACHE
+    environment variable), it is also saved there and reused by later
+    processes, until `environment_signature()` changes.
+    """
+
+    def __init__(self, cache_file: Optional[str] = None) -> None:
+        self.cache_file = cache_file
+        self._bots: Optional[Dict[str, List[metadata.EntryPoint]]] = None
+        self._lock = threading.Lock()
+
+    def lookup(self, name: str) -> List[metadata.EntryPoint]:
+        bots = self._bots
+        if bots is None:
+            with self._lock:
+                if self._bots is None:
+                    self._bots = self._load()
+                bots = self._bots
+        return bots.get(name, [])
+
+    def _load(self) -> Dict[str, List[metadata.EntryPoint]]:
+        if self.cache_file is None:
+            return self._scan()
+
+        signature = environment_signature()
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+            if [tuple(item) for item in cached["signature"]] == signature:
+                return {
+                    name: [metadata.EntryPoint(name, value, REGISTRY_GROUP) for value in values]
+                    for name, values in cached["bots"].items()
+                }
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        bots = self._scan()
+        cached = dict(
+            signature=signature,
+            bots={name: [bot.value for bot in entries] for name, entries in bots.items()},
+        )
+        try:
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cached, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logging.warning("Could not save the bot registry index: %s", e)
+        return bots
+
+    def _scan(self) -> Dict[str, List[metadata.EntryPoint]]:
+        bots: Dict[str, List[metadata.EntryPoint]] = {}
+        for bot in metadata.entry_points(group=REGISTRY_GROUP):
+            bots.setdefault(bot.name, []).append(bot)
+        return bots
+
+
+_registry_index: Optional[RegistryIndex] = None
+
+
+def registry_index() -> RegistryIndex:
+    global _registry_index  # noqa: PLW0603
+    if _registry_index is None:
+        _registry_index = RegistryIndex(os.environ.get("ZULIP_BOTS_REGISTRY_CACHE"))
+    return _registry_index
+
+
+def clear_registry_index() -> None:
+    """Forgets the index, e.g. after installing a bot into the running process."""
+    global _registry_index  # noqa: PLW0603
+    _registry_index = None
+
+
 def import_module_from_zulip_bot_registry(name: str) -> Tuple[str, Optional[ModuleType]]:
-    registered_bots = metadata.entry_points(group="zulip_bots.registry")
-    matching_bots = [bot for bot in registered_bots if bot.name == name]
+    matching_bots = registry_index().lookup(name)
 
     if len(matching_bots) == 1:  # Unique matching entrypoint
         """We expect external bots to be registered using entry_points in the
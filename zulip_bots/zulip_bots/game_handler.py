@@ -37,6 +37,10 @@ class GameAdapter:
     GameInstances which run the actual game logic.
     """
 
+    # Kept in the runner's StateSnapshot, so that restarts don't wait
+    # for the user cache.
+    snapshot_storage_keys = ("users",)
+
     def __init__(
         self,
         game_name: str,
@@ -210,6 +214,9 @@ class GameAdapter:
         self.email = self.bot_handler.email
         self.full_name = self.bot_handler.full_name
 
+    def reconcile_snapshot(self, changed_keys: List[str], bot_handler: AbstractBotHandler) -> None:
+        self.get_user_cache()
+
     def handle_message(self, message: Dict[str, Any], bot_handler: AbstractBotHandler) -> None:
         try:
             self.bot_handler = bot_handler
@@ -229,65 +236,62 @@ class GameAdapter:
                 self.add_user_to_cache(message)
                 logging.info("Added %s to user cache", sender)
 
+            # Lowercase once; the command checks below all compare against it.
+            command = content.lower()
+
             if self.is_single_player:
-                if content.lower().startswith("start game with") or content.lower().startswith(
-                    "play game"
-                ):
+                if command.startswith(("start game with", "play game")):
                     self.send_reply(message, self.help_message_single_player())
                     return
                 else:
-                    val = self.manage_command(content.lower(), message)
+                    val = self.manage_command(command, message)
                     if val == 0:
                         return
 
-            if content.lower() == "help" or content == "":
+            if command == "help" or content == "":
                 if self.is_single_player:
                     self.send_reply(message, self.help_message_single_player())
                 else:
                     self.send_reply(message, self.help_message())
                 return
 
-            elif content.lower() == "rules":
+            elif command == "rules":
                 self.send_reply(message, self.rules)
 
-            elif content.lower().startswith("start game with "):
+            elif command.startswith("start game with "):
                 self.command_start_game_with(message, sender, content)
 
-            elif content.lower() == "start game":
+            elif command == "start game":
                 self.command_start_game(message, sender, content)
 
-            elif content.lower().startswith("play game"):
+            elif command.startswith("play game"):
                 self.command_play(message, sender, content)
 
-            elif content.lower() == "accept":
+            elif command == "accept":
                 self.command_accept(message, sender, content)
 
-            elif content.lower() == "decline":
+            elif command == "decline":
                 self.command_decline(message, sender, content)
 
-            elif content.lower() == "quit":
+            elif command == "quit":
                 self.command_quit(message, sender, content)
 
-            elif content.lower() == "register":
+            elif command == "register":
                 self.send_reply(
                     message,
                     "Hello @**{}**. Thanks for registering!".format(message["sender_full_name"]),
                 )
 
-            elif content.lower() == "leaderboard":
+            elif command == "leaderboard":
                 self.command_leaderboard(message, sender, content)
 
-            elif content.lower() == "join":
+            elif command == "join":
                 self.command_join(message, sender, content)
 
             elif self.is_user_in_game(sender) != "":
                 self.parse_message(message)
 
-            elif (
-                self.move_regex.match(content) is not None
-                or content.lower() == "draw"
-                or content.lower() == "forfeit"
-            ):
+            elif self.move_regex.match(content) is not None or command in {"draw", "forfeit"}:
                 self.send_reply(
                     message, "You are not in a game at the moment. Type `help` for help."
                 )
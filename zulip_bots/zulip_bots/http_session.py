@@ -0,0 +1,323 @@
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from typing_extensions import override
+from urllib3.util.retry import Retry
+
+from zulip_bots.profiling import record_call
+
+# (connect, read) timeouts, in seconds, for requests that don't pass their own.
+DEFAULT_TIMEOUT = (5.0, 30.0)
+
+# Requests sending these get responses for their user, which mustn't be cached.
+CREDENTIAL_HEADERS = ["Authorization", "Cookie", "Proxy-Authorization"]
+
+_shared_adapter: Optional[HTTPAdapter] = None
+_shared_adapter_lock = threading.Lock()
+
+
+def shared_adapter() -> HTTPAdapter:
+    """
+    The adapter holding the connection pools used by all the bots in this
+    process, so that bots calling the same service reuse connections.
+    Idempotent requests are retried on connection errors and on 502, 503
+    and 504 responses, with exponential backoff.
+    """
+    global _shared_adapter  # noqa: PLW0603
+    with _shared_adapter_lock:
+        if _shared_adapter is None:
+            retries = Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False,
+            )
+            _shared_adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retries)
+        return _shared_adapter
+
+
+class CachedResponse:
+    def __init__(
+        self,
+        url: str,
+        status_code: int,
+        headers: Dict[str, str],
+        content: bytes,
+        expires: float,
+        *,
+        vary: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.expires = expires
+        # The request headers named in the response's Vary header, which
+        # requests have to send for the response to be served to them.
+        self.vary = vary or {}
+
+    @classmethod
+    def from_response(
+        cls, response: requests.Response, expires: float, vary: Optional[Dict[str, str]] = None
+    ) -> "CachedResponse":
+        return cls(
+            response.url,
+            response.status_code,
+            dict(response.headers),
+            response.content,
+            expires,
+            vary=vary,
+        )
+
+    def is_fresh(self, now: float) -> bool:
+        return now < self.expires
+
+    def matches(self, request_headers: Mapping[str, str]) -> bool:
+        return all(request_headers.get(name, "") == value for name, value in self.vary.items())
+
+    def validators(self) -> Dict[str, str]:
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+    def to_response(self) -> requests.Response:
+        response = requests.Response()
+        response.url = self.url
+        response.status_code = self.status_code
+        response.headers.update(self.headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = self.content  # noqa: SLF001
+        return response
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(
+            url=self.url,
+            status_code=self.status_code,
+            headers=self.headers,
+            content=base64.b64encode(self.content).decode(),
+            expires=self.expires,
+            vary=self.vary,
+        )
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "CachedResponse":
+        return cls(
+            data["url"],
+            data["status_code"],
+            data["headers"],
+            base64.b64decode(data["content"]),
+            data["expires"],
+            vary=data.get("vary"),
+        )
+
+
+class LRUCache:
+    """Keeps the `max_entries` most recently used responses in memory."""
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DiskCache:
+    """
+    Keeps responses as files in `directory`, so that they survive restarts
+    and can be shared by several processes.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            with open(self._path(key)) as f:
+                return CachedResponse.from_json(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set(self, key: str, entry: CachedResponse) -> None:
+        path = self._path(key)
+        # Write to a temporary file first, so that readers never see a
+        # partially written entry.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry.to_json(), f)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(key))
+
+
+HttpCache = Union[LRUCache, DiskCache]
+
+
+def cache_lifetime(headers: Any, now: float) -> Optional[float]:
+    """
+    How long a response may be served from the cache without revalidating
+    it, according to its Cache-Control and Expires headers; None if it
+    must not be cached at all.
+    """
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control or "private" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0.0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    if match:
+        return float(match.group(1))
+    if "Expires" in headers:
+        try:
+            return max(0.0, parsedate_to_datetime(headers["Expires"]).timestamp() - now)
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+
+class BotHttpSession(requests.Session):
+    """
+    The session bots should use to call third-party services, available
+    as `bot_handler.http`:
+
+        response = bot_handler.http.get(url, params=params)
+
+    Compared to calling `requests.get` directly, it reuses connections
+    (the pools are shared by all the bots in the process), applies
+    DEFAULT_TIMEOUT to requests without a timeout, and retries failed
+    idempotent requests.
+
+    If `cache` is set, GET responses are cached as their Cache-Control
+    and Expires headers allow, and stale responses with an ETag or a
+    Last-Modified date are revalidated with a conditional request.  A
+    cached response is only served to requests sending the same headers
+    it varies on, and requests with credentials aren't cached at all.
+    """
+
+    def __init__(self, cache: Optional[HttpCache] = None) -> None:
+        super().__init__()
+        self.cache = cache
+        adapter = shared_adapter()
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    @override
+    def close(self) -> None:
+        # The adapter is shared with the other bots' sessions; leave it open.
+        self.adapters.clear()
+
+    @override
+    def request(  # type: ignore[override]
+        self, method: str, url: Union[str, bytes], *args: Any, **kwargs: Any
+    ) -> requests.Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = DEFAULT_TIMEOUT
+        # Counted by host, since URLs can carry ids and API keys.
+        host = urlsplit(url.decode() if isinstance(url, bytes) else url).netloc
+        record_call("http", f"{method.upper()} {host}")
+        if self.cache is None or method.upper() != "GET":
+            return super().request(method, url, *args, **kwargs)
+        return self._cached_get(url, *args, **kwargs)
+
+    def _cached_get(self, url: Union[str, bytes], *args: Any, **kwargs: Any) -> requests.Response:
+        assert self.cache is not None
+        # The request as it will be sent, with the session's headers,
+        # auth and cookies.
+        prepared = self.prepare_request(
+            requests.Request(
+                "GET",
+                url,
+                params=kwargs.get("params"),
+                headers=kwargs.get("headers"),
+                auth=kwargs.get("auth"),
+                cookies=kwargs.get("cookies"),
+            )
+        )
+        if any(header in prepared.headers for header in CREDENTIAL_HEADERS):
+            return super().request("GET", url, *args, **kwargs)
+        key = prepared.url
+        assert key is not None
+        now = time.time()
+        entry = self.cache.get(key)
+        if entry is not None and not entry.matches(prepared.headers):
+            entry = None
+        if entry is not None and entry.is_fresh(now):
+            return entry.to_response()
+
+        if entry is not None:
+            kwargs["headers"] = {**entry.validators(), **(kwargs.get("headers") or {})}
+        response = super().request("GET", url, *args, **kwargs)
+
+        if entry is not None and response.status_code == 304:
+            lifetime = cache_lifetime(response.headers, now) or 0.0
+            for header in ["Cache-Control", "Date", "ETag", "Expires", "Last-Modified"]:
+                if header in response.headers:
+                    entry.headers[header] = response.headers[header]
+            entry.expires = now + lifetime
+            self.cache.set(key, entry)
+            return entry.to_response()
+
+        self._store(key, response, now, prepared.headers)
+        return response
+
+    def _store(
+        self,
+        key: str,
+        response: requests.Response,
+        now: float,
+        request_headers: Mapping[str, str],
+    ) -> None:
+        assert self.cache is not None
+        if response.status_code != 200:
+            return
+        lifetime = cache_lifetime(response.headers, now)
+        vary_names = [
+            name.strip() for name in response.headers.get("Vary", "").split(",") if name.strip()
+        ]
+        if lifetime is None or "*" in vary_names:
+            self.cache.delete(key)
+            return
+        if lifetime == 0 and not (
+            "ETag" in response.headers or "Last-Modified" in response.headers
+        ):
+            # Nothing to revalidate with, so the entry would be useless.
+            return
+        vary = {name: request_headers.get(name, "") for name in vary_names}
+        self.cache.set(key, CachedResponse.from_response(response, now + lifetime, vary))
@@ -1,18 +1,29 @@
+import atexit
 import configparser
+import gzip
 import json
 import logging
 import os
 import re
 import signal
 import sys
+import threading
 import time
+import urllib.parse
+from collections import OrderedDict, deque
 from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
-from typing import IO, Any, Dict, Iterator, List, Optional, Set
+from typing import IO, Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-from typing_extensions import Protocol
+import requests
+from typing_extensions import Protocol, override
 
 from zulip import Client, ZulipError
+from zulip_bots import finder
+from zulip_bots.http_session import BotHttpSession
+from zulip_bots.profiling import Profiler, record_call
+from zulip_bots.scheduler import JobCallback, Scheduler
 
 
 class NoBotConfigError(Exception):
@@ -54,24 +65,271 @@ class RateLimit:
     def __init__(self, message_limit: int, interval_limit: int) -> None:
         self.message_limit = message_limit
         self.interval_limit = interval_limit
-        self.message_list: List[float] = []
+        self.message_list: Deque[float] = deque(maxlen=message_limit)
         self.error_message = "-----> !*!*!*MESSAGE RATE LIMIT REACHED, EXITING*!*!*! <-----\n"
         "Is your bot trapped in an infinite loop by reacting to its own messages?"
 
+    def wait_time(self, now: Optional[float] = None) -> float:
+        # Seconds until another message fits in the window; 0 if it can go out now.
+        if len(self.message_list) < self.message_limit:
+            return 0.0
+        if now is None:
+            now = time.time()
+        return max(0.0, self.message_list[0] + self.interval_limit - now)
+
+    def record(self, now: Optional[float] = None) -> None:
+        self.message_list.append(time.time() if now is None else now)
+
     def is_legal(self) -> bool:
-        self.message_list.append(time.time())
-        if len(self.message_list) > self.message_limit:
-            self.message_list.pop(0)
-            time_diff = self.message_list[-1] - self.message_list[0]
-            return time_diff >= self.interval_limit
-        else:
-            return True
+        legal = self.wait_time() == 0
+        self.record()
+        return legal
 
     def show_error_and_exit(self) -> None:
         logging.error(self.error_message)
         sys.exit(1)
 
 
+# Returned for an edit that was held back, to be sent later.
+DEFERRED_EDIT: Dict[str, Any] = dict(
+    result="deferred", msg="The edit was held back, and will be sent later."
+)
+
+
+class OutboundScheduler:
+    """
+    Paces a bot's outbound API calls so that they stay within a RateLimit.
+
+    Calls over the limit wait for the next free slot instead of killing
+    the bot, and repeated edits of the same message are coalesced while
+    they wait, so that only the latest content is sent.  The process is
+    only stopped when the bot keeps answering its own messages, which is
+    a sign of a self-reply loop rather than of a legitimate burst.
+
+    A call waiting for its slot doesn't hold up the bot's other threads:
+    the slot is reserved under the lock, and the wait happens outside it.
+    An edit that is held back returns a result of "deferred", rather than
+    "success", since nothing was sent yet.
+    """
+
+    def __init__(
+        self,
+        rate_limit: RateLimit,
+        loop_limit: Optional[int] = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.rate_limit = rate_limit
+        self.loop_limit = loop_limit if loop_limit is not None else rate_limit.message_limit
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.RLock()
+        self._pending_updates: OrderedDict[Any, Dict[str, Any]] = OrderedDict()
+        self._update_call: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None
+        self._waiting = 0
+        # Whether the message each thread is handling is the bot's own.
+        self._local = threading.local()
+        self._self_replies = 0
+        self.calls_sent = 0
+        self.calls_delayed = 0
+        self.updates_coalesced = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+    def begin_message(self, is_own_message: bool) -> None:
+        # Called by the runners before a message is handed to the bot.
+        self._local.handling_own_message = is_own_message
+        with self._lock:
+            if not is_own_message:
+                self._self_replies = 0
+
+    def submit(self, call: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        with self._lock:
+            self._check_for_loop()
+        self._flush_pending_updates()
+        with self._lock:
+            delay = self._reserve_slot()
+        self._wait(delay)
+        return call()
+
+    def submit_update(
+        self, message: Dict[str, Any], call: Callable[[Dict[str, Any]], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        with self._lock:
+            message_id = message.get("message_id")
+            if message_id in self._pending_updates:
+                self.updates_coalesced += 1
+                self._pending_updates[message_id] = message
+                return dict(DEFERRED_EDIT)
+            if self.rate_limit.wait_time(self._clock()) > 0:
+                self._pending_updates[message_id] = message
+                self._update_call = call
+                return dict(DEFERRED_EDIT)
+            delay = self._reserve_slot()
+        self._wait(delay)
+        return call(message)
+
+    def flush(self) -> None:
+        # Sends the edits that were held back while the bot was throttled.
+        self._flush_pending_updates()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending_updates) + self._waiting
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(
+                queue_depth=self.queue_depth,
+                calls_sent=self.calls_sent,
+                calls_delayed=self.calls_delayed,
+                updates_coalesced=self.updates_coalesced,
+                total_delay=self.total_delay,
+                max_delay=self.max_delay,
+            )
+
+    def _flush_pending_updates(self) -> None:
+        while True:
+            with self._lock:
+                if not self._pending_updates:
+                    return
+                _, message = self._pending_updates.popitem(last=False)
+                update_call = self._update_call
+                assert update_call is not None
+                delay = self._reserve_slot()
+            self._wait(delay)
+            update_call(message)
+
+    def _reserve_slot(self) -> float:
+        # Called with the lock held.  Records the call at the time it will
+        # go out, so that the callers waiting meanwhile queue up behind it;
+        # returns how long the caller has to wait, without the lock.
+        now = self._clock()
+        delay = self.rate_limit.wait_time(now)
+        if delay > 0:
+            self.calls_delayed += 1
+            self.total_delay += delay
+            self.max_delay = max(self.max_delay, delay)
+            logging.info("Outbound rate limit reached, delaying by %.2f seconds", delay)
+            self._waiting += 1
+        self.rate_limit.record(now + delay)
+        self.calls_sent += 1
+        return delay
+
+    def _wait(self, delay: float) -> None:
+        if delay <= 0:
+            return
+        try:
+            self._sleep(delay)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def _check_for_loop(self) -> None:
+        # Pacing keeps any burst within the rate limit, so a loop is
+        # recognized by the bot sending many messages in a row while
+        # handling its own messages, with nobody else in between.
+        if not getattr(self._local, "handling_own_message", False):
+            return
+        self._self_replies += 1
+        if self._self_replies >= self.loop_limit:
+            self.rate_limit.show_error_and_exit()
+
+
+class EditDebouncer:
+    """
+    Coalesces repeated edits of the same message, for bots that show
+    progress or live state by editing a message over and over.
+
+    The first edit of a message is sent right away.  Later edits within
+    `min_interval` seconds of the last one sent are held back, only the
+    latest content is kept, and it is sent once the interval is over.
+    An edit with `final=True` is sent immediately, replacing any edit
+    held back.  An edit held back returns a result of "deferred".
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Dict[str, Any]], Dict[str, Any]],
+        scheduler: Scheduler,
+        min_interval: float = 1.0,
+    ) -> None:
+        self.send = send
+        self.scheduler = scheduler
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._last_sent: Dict[Any, float] = {}
+        self._pending: Dict[Any, Dict[str, Any]] = {}
+        self._jobs: Dict[Any, str] = {}
+        self.edits_sent = 0
+        self.edits_coalesced = 0
+
+    def update(self, message: Dict[str, Any], final: bool = False) -> Dict[str, Any]:
+        message_id = message["message_id"]
+        with self._lock:
+            now = self.scheduler.clock()
+            if final or not self.scheduler.running:
+                self._pending.pop(message_id, None)
+                job_id = self._jobs.pop(message_id, None)
+                if job_id is not None:
+                    self.scheduler.cancel(job_id)
+                self._last_sent.pop(message_id, None)
+            elif message_id in self._pending:
+                self.edits_coalesced += 1
+                self._pending[message_id] = message
+                return dict(DEFERRED_EDIT)
+            else:
+                last_sent = self._last_sent.get(message_id)
+                if last_sent is not None and now - last_sent < self.min_interval:
+                    self._pending[message_id] = message
+                    self._jobs[message_id] = self.scheduler.schedule_at(
+                        last_sent + self.min_interval, self._send_pending, message_id
+                    )
+                    return dict(DEFERRED_EDIT)
+                self._forget_old_edits(now)
+                self._last_sent[message_id] = now
+            self.edits_sent += 1
+        return self.send(message)
+
+    def _send_pending(self, message_id: Any) -> None:
+        with self._lock:
+            self._jobs.pop(message_id, None)
+            message = self._pending.pop(message_id, None)
+            if message is None:
+                return
+            self._last_sent[message_id] = self.scheduler.clock()
+            self.edits_sent += 1
+        self.send(message)
+
+    def _forget_old_edits(self, now: float) -> None:
+        # Edits older than the interval no longer hold anything back.
+        if len(self._last_sent) > 1000:
+            self._last_sent = {
+                message_id: sent
+                for message_id, sent in self._last_sent.items()
+                if now - sent < self.min_interval or message_id in self._pending
+            }
+
+
+class InlineReply:
+    """The reply to a Botserver webhook, returned in its HTTP response; see capture_reply."""
+
+    def __init__(self, message: Dict[str, Any]) -> None:
+        self.message = message
+        self.content: Optional[str] = None
+        self.widget_content: Optional[str] = None
+        self.captured = False
+        # Cleared once a reply went through the API, so that later
+        # replies keep their order.
+        self.open = True
+
+    def response(self) -> Dict[str, Any]:
+        response: Dict[str, Any] = dict(content=self.content)
+        if self.widget_content is not None:
+            response["widget_content"] = self.widget_content
+        return response
+
+
 class BotIdentity:
     def __init__(self, name: str, email: str) -> None:
         self.name = name
@@ -143,12 +401,14 @@ class StateHandler:
         self.state_: Dict[str, Any] = dict()
 
     def put(self, key: str, value: Any) -> None:
+        record_call("storage", "put")
         self.state_[key] = self.marshal(value)
         response = self._client.update_storage({"storage": {key: self.state_[key]}})
         if response["result"] != "success":
             raise StateHandlerError(f"Error updating state: {response}")
 
     def get(self, key: str) -> Any:
+        record_call("storage", "get")
         if key in self.state_:
             return self.demarshal(self.state_[key])
 
@@ -161,8 +421,63 @@ class StateHandler:
         return self.demarshal(marshalled_value)
 
     def contains(self, key: str) -> bool:
+        record_call("storage", "contains")
         return key in self.state_
 
+    def remove(self, key: str) -> None:
+        record_call("storage", "remove")
+        self.state_.pop(key, None)
+        response = self._client.call_endpoint(
+            url="bot_storage", method="DELETE", request={"keys": [key]}
+        )
+        # The server refuses to remove a key it doesn't have, which is fine.
+        if (
+            response["result"] != "success"
+            and self._client.get_storage({"keys": [key]})["result"] == "success"
+        ):
+            raise StateHandlerError(f"Error removing state: {response}")
+
+    def list_keys(self) -> List[str]:
+        """Fetches the whole storage from the server, and returns its keys."""
+        record_call("storage", "list_keys")
+        response = self._client.get_storage()
+        if response["result"] != "success":
+            raise StateHandlerError(f"Error fetching state: {response}")
+        self.state_.update(response["storage"])
+        return list(response["storage"])
+
+    def forget(self, key: str) -> None:
+        """Drops the local copy of a value; the next `get` fetches it again."""
+        self.state_.pop(key, None)
+
+    def preload(self, marshalled_values: Dict[str, str]) -> None:
+        """Fills the local copy of the storage, e.g. from a StateSnapshot."""
+        self.state_.update(marshalled_values)
+
+    def refresh(self, keys: List[str]) -> List[str]:
+        """
+        Fetches `keys` from the server again, replacing their local copies,
+        and returns the keys whose values changed.
+        """
+        response = self._client.get_storage({"keys": keys})
+        if response["result"] != "success":
+            # The server refuses the whole request if any of the keys is
+            # missing, so fetch all of the storage; the keys not in it were
+            # removed.
+            response = self._client.get_storage()
+            if response["result"] != "success":
+                raise StateHandlerError(f"Error fetching state: {response}")
+        changed = []
+        for key in keys:
+            value = response["storage"].get(key)
+            if value != self.state_.get(key):
+                changed.append(key)
+                if value is None:
+                    del self.state_[key]
+                else:
+                    self.state_[key] = value
+        return changed
+
 
 @contextmanager
 def use_storage(storage: BotStorage, keys: List[str]) -> Iterator[BotStorage]:
@@ -185,6 +500,10 @@ class AbstractBotHandler(Protocol):
     def storage(self) -> BotStorage:
         ...
 
+    @property
+    def http(self) -> requests.Session:
+        ...
+
     def identity(self) -> BotIdentity:
         ...
 
@@ -202,6 +521,33 @@ class AbstractBotHandler(Protocol):
     def update_message(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         ...
 
+    def update_message_debounced(
+        self, message: Dict[str, Any], final: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        ...
+
+    def schedule_at(
+        self,
+        when: Union[float, datetime],
+        callback: JobCallback,
+        data: Any = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        ...
+
+    def schedule_every(
+        self,
+        interval: float,
+        callback: JobCallback,
+        data: Any = None,
+        start: Optional[Union[float, datetime]] = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        ...
+
+    def cancel(self, job_id: str) -> bool:
+        ...
+
     def get_config_info(self, bot_name: str, optional: bool = False) -> Dict[str, str]:
         ...
 
@@ -242,12 +588,23 @@ class ExternalBotHandler:
             sys.exit(1)
 
         self._rate_limit = RateLimit(20, 5)
+        self.outbound = OutboundScheduler(self._rate_limit)
         self._client = client
         self._root_dir = root_dir
         self.bot_details = bot_details
         self.bot_config_file = bot_config_file
         self._bot_config_parser = bot_config_parser
+        self._bot_config: Optional[configparser.ConfigParser] = None
+        self._bot_config_version: Tuple[int, int, int, int] = (0, 0, 0, 0)
+        self._bot_config_error: Optional[str] = None
+        self._config_reload_callbacks: List[Callable[[], None]] = []
         self._storage = StateHandler(client)
+        # For calls to third-party services; see BotHttpSession.
+        self.http = BotHttpSession()
+        # Started by the bot's runner; see Scheduler.
+        self.scheduler = Scheduler(self._storage)
+        self.edits = EditDebouncer(self.update_message, self.scheduler)
+        self._inline_replies = threading.local()
         try:
             self.user_id = user_profile["user_id"]
             self.full_name = user_profile["full_name"]
@@ -272,15 +629,47 @@ class ExternalBotHandler:
         )
 
     def send_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
-        if not self._rate_limit.is_legal():
-            self._rate_limit.show_error_and_exit()
-        resp = self._client.send_message(message)
+        resp = self.outbound.submit(lambda: self._client.send_message(message))
         if resp.get("result") == "error":
             print("ERROR!: " + str(resp))
         return resp
 
     def send_reply(
         self, message: Dict[str, Any], response: str, widget_content: Optional[str] = None
+    ) -> Dict[str, Any]:
+        inline_reply: Optional[InlineReply] = getattr(self._inline_replies, "reply", None)
+        if inline_reply is not None and inline_reply.message is message:
+            if inline_reply.open and not inline_reply.captured:
+                inline_reply.content = response
+                inline_reply.widget_content = widget_content
+                inline_reply.captured = True
+                return dict(result="success", msg="")
+            if inline_reply.captured:
+                # A second reply: send the first one now, so that they
+                # are posted in order.
+                inline_reply.captured = False
+                self._send_reply(message, inline_reply.content or "", inline_reply.widget_content)
+            inline_reply.open = False
+        return self._send_reply(message, response, widget_content)
+
+    @contextmanager
+    def capture_reply(self, message: Dict[str, Any]) -> Iterator[InlineReply]:
+        """
+        Used by the Botserver to return a bot's reply in the response to
+        Zulip's outgoing webhook, instead of sending it through the API.
+        While in the context, the bot's first send_reply to `message` is
+        captured, and doesn't return a message id.  Any other messages are
+        sent as usual.
+        """
+        inline_reply = InlineReply(message)
+        self._inline_replies.reply = inline_reply
+        try:
+            yield inline_reply
+        finally:
+            self._inline_replies.reply = None
+
+    def _send_reply(
+        self, message: Dict[str, Any], response: str, widget_content: Optional[str]
     ) -> Dict[str, Any]:
         if message["type"] == "private":
             return self.send_message(
@@ -303,9 +692,40 @@ class ExternalBotHandler:
             )
 
     def update_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
-        if not self._rate_limit.is_legal():
-            self._rate_limit.show_error_and_exit()
-        return self._client.update_message(message)
+        return self.outbound.submit_update(message, self._client.update_message)
+
+    def update_message_debounced(
+        self, message: Dict[str, Any], final: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Like update_message, for a message that is edited over and over:
+        edits are sent at most once per `self.edits.min_interval` seconds,
+        with the latest content.  Pass `final=True` for the last edit, so
+        that it is sent right away.
+        """
+        return self.edits.update(message, final)
+
+    def schedule_at(
+        self,
+        when: Union[float, datetime],
+        callback: JobCallback,
+        data: Any = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        return self.scheduler.schedule_at(when, callback, data, job_id)
+
+    def schedule_every(
+        self,
+        interval: float,
+        callback: JobCallback,
+        data: Any = None,
+        start: Optional[Union[float, datetime]] = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        return self.scheduler.schedule_every(interval, callback, data, start, job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        return self.scheduler.cancel(job_id)
 
     def get_config_info(self, bot_name: str, optional: bool = False) -> Dict[str, str]:
         if self._bot_config_parser is not None:
@@ -322,7 +742,7 @@ class ExternalBotHandler:
                 # to specify the file in the command line.
                 raise NoBotConfigError(bot_name)
 
-            if bot_name not in self.bot_config_file:
+            if self._bot_config is None and bot_name not in self.bot_config_file:
                 print(
                     f"""
                     WARNING!
@@ -338,6 +758,39 @@ class ExternalBotHandler:
                     """
                 )
 
+            config_parser = self._read_bot_config()
+
+        return dict(config_parser.items(bot_name))
+
+    def on_config_reload(self, callback: Callable[[], None]) -> None:
+        """
+        Registers a callback that is called after the bot config file
+        changed on disk and has been parsed again.
+        """
+        self._config_reload_callbacks.append(callback)
+
+    def reload_config_if_changed(self) -> bool:
+        """
+        Re-parses the bot config file if it changed since it was last read,
+        which costs a single `stat` call if it didn't.  Returns whether the
+        config was reloaded.
+        """
+        if self._bot_config is None or self.bot_config_file is None:
+            return False
+        config = self._bot_config
+        return self._read_bot_config() is not config
+
+    def _read_bot_config(self) -> configparser.ConfigParser:
+        # The parsed config file is cached, and only parsed again if the
+        # file was replaced or modified, so that bots can call
+        # get_config_info while handling each message.
+        assert self.bot_config_file is not None
+        try:
+            stat = os.stat(self.bot_config_file)
+            version = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if self._bot_config is not None and version == self._bot_config_version:
+                return self._bot_config
+
             # We expect the caller to pass in None if the user does
             # not specify a bot_config_file.  If they pass in a bogus
             # filename, we'll let an IOError happen here.  Callers
@@ -345,22 +798,39 @@ class ExternalBotHandler:
             # for the existence of the file.
             config_parser = configparser.ConfigParser()
             with open(self.bot_config_file) as conf:
-                try:
-                    config_parser.read_file(conf)
-                except configparser.Error as e:
+                config_parser.read_file(conf)
+        except (OSError, UnicodeDecodeError, configparser.Error) as e:
+            if self._bot_config is None:
+                if isinstance(e, configparser.Error):
                     display_config_file_errors(str(e), self.bot_config_file)
                     sys.exit(1)
-
-        return dict(config_parser.items(bot_name))
+                raise
+            if not isinstance(e, OSError):
+                # Not parsed again until the file changes.
+                self._bot_config_version = version
+            # Don't take a running bot down because of a half-written or
+            # missing file; keep the last good config until the file is fixed.
+            if str(e) != self._bot_config_error:
+                logging.error("Ignoring broken bot config file %s: %s", self.bot_config_file, e)
+                self._bot_config_error = str(e)
+            return self._bot_config
+
+        self._bot_config_error = None
+        is_reload = self._bot_config is not None
+        self._bot_config = config_parser
+        self._bot_config_version = version
+        if is_reload:
+            logging.info("Reloaded bot config file %s", self.bot_config_file)
+            for callback in self._config_reload_callbacks:
+                callback()
+        return config_parser
 
     def upload_file_from_path(self, file_path: str) -> Dict[str, Any]:
         with open(file_path, "rb") as file:
             return self.upload_file(file)
 
     def upload_file(self, file: IO[Any]) -> Dict[str, Any]:
-        if not self._rate_limit.is_legal():
-            self._rate_limit.show_error_and_exit()
-        return self._client.upload_file(file)
+        return self.outbound.submit(lambda: self._client.upload_file(file))
 
     def open(self, filepath: str) -> IO[str]:
         assert self._root_dir is not None
@@ -418,6 +888,120 @@ def is_private_message_but_not_group_pm(
     return len(recipients) == 1 and not is_message_from_self
 
 
+class MessagePipeline:
+    """
+    Decides whether a bot should handle a message, and prepares the message
+    for its handler, as the runner and the Botserver both do before
+    dispatching.  It is built once per bot identity, so that the mention
+    patterns are compiled once, instead of for every message like
+    extract_query_without_mention does.
+
+    Filters are cheap checks that run first; a message is dropped if any
+    of them returns True.  The built-in ones are enabled by the arguments:
+
+    * ignore_own_messages: drop messages the bot sent itself.
+    * ignore_streams: drop messages sent to these streams.
+    * dedupe_window: drop messages whose id was among the last
+      `dedupe_window` ids seen, e.g. when an event is redelivered.
+      Off by default.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        full_name: str,
+        email: str,
+        ignore_own_messages: bool = False,
+        ignore_streams: Optional[List[str]] = None,
+        dedupe_window: int = 0,
+    ) -> None:
+        self.user_id = user_id
+        self.email = email
+        self.mention = f"@**{full_name}**"
+        self.extended_mention_regex = re.compile(r"^@\*\*.*\|" + re.escape(str(user_id)) + r"\*\*")
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        if ignore_own_messages:
+            self.filters.append(self.is_own_message)
+        if ignore_streams:
+            self.ignored_streams = set(ignore_streams)
+            self.filters.append(self.is_in_ignored_stream)
+        if dedupe_window > 0:
+            self.dedupe_window = dedupe_window
+            self._seen_ids: Set[Any] = set()
+            self._seen_order: Deque[Any] = deque()
+            self._seen_lock = threading.Lock()
+            self.filters.append(self.is_duplicate)
+
+    @classmethod
+    def for_bot_handler(cls, bot_handler: AbstractBotHandler, **kwargs: Any) -> "MessagePipeline":
+        return cls(bot_handler.user_id, bot_handler.full_name, bot_handler.email, **kwargs)
+
+    def add_filter(self, message_filter: Callable[[Dict[str, Any]], bool]) -> None:
+        self.filters.append(message_filter)
+
+    def is_own_message(self, message: Dict[str, Any]) -> bool:
+        return message.get("sender_id") == self.user_id
+
+    def is_in_ignored_stream(self, message: Dict[str, Any]) -> bool:
+        return (
+            message.get("type") == "stream" and message["display_recipient"] in self.ignored_streams
+        )
+
+    def is_duplicate(self, message: Dict[str, Any]) -> bool:
+        message_id = message.get("id")
+        if message_id is None:
+            return False
+        with self._seen_lock:
+            if message_id in self._seen_ids:
+                return True
+            self._seen_ids.add(message_id)
+            self._seen_order.append(message_id)
+            if len(self._seen_order) > self.dedupe_window:
+                self._seen_ids.discard(self._seen_order.popleft())
+        return False
+
+    def extract_query(self, content: str) -> Optional[str]:
+        """Like extract_query_without_mention."""
+        extended_mention_match = self.extended_mention_regex.match(content)
+        if extended_mention_match:
+            return content[extended_mention_match.end() :].lstrip()
+        if content.startswith(self.mention):
+            return content[len(self.mention) :].lstrip()
+        return None
+
+    def is_private_message(self, message: Dict[str, Any]) -> bool:
+        """Like is_private_message_but_not_group_pm."""
+        if message["type"] != "private" or message["sender_id"] == self.user_id:
+            return False
+        other_recipients = 0
+        for recipient in message["display_recipient"]:
+            if recipient["email"] != self.email:
+                other_recipients += 1
+                if other_recipients > 1:
+                    return False
+        return other_recipients == 1
+
+    def prepare(self, message: Dict[str, Any], is_mentioned: bool, is_private: bool) -> bool:
+        """
+        Returns whether the bot should handle the message.  If it should,
+        the message's content is stripped of the bot's @-mention, and the
+        original content is kept as `full_content`.
+        """
+        if not (is_mentioned or is_private):
+            return False
+        for message_filter in self.filters:
+            if message_filter(message):
+                return False
+        message["full_content"] = message["content"]
+        if is_mentioned:
+            # message['content'] will be None when the bot's @-mention is not at the beginning.
+            # In that case, the message shall not be handled.
+            message["content"] = self.extract_query(message["content"])
+            if message["content"] is None:
+                return False
+        return True
+
+
 def display_config_file_errors(error_msg: str, config_file: str) -> None:
     file_contents = Path(config_file).read_text()
     print(f"\nERROR: {config_file} seems to be broken:\n\n{file_contents}")
@@ -434,6 +1018,360 @@ def prepare_message_handler(bot: str, bot_handler: AbstractBotHandler, bot_lib_m
     return message_handler
 
 
+class StateSnapshot:
+    """
+    Saves a bot's hot state to a local file, so that a restarted bot
+    answers as fast as a warmed-up one, instead of fetching its state
+    from the server one storage key at a time.
+
+    A message handler declares its hot state with class attributes:
+
+        class MyBotHandler:
+            # Attributes of the handler; their values must be JSON-serializable.
+            snapshot_attributes = ("user_cache",)
+            # Keys of the bot's storage.
+            snapshot_storage_keys = ("users",)
+
+    The runner loads the snapshot before initializing the handler, so
+    that `initialize` reads the storage keys locally, and restores the
+    attributes afterwards.  It then fetches the storage keys from the
+    server in the background; if some have changed since the snapshot
+    was written, the server's values replace the local ones, and the
+    handler's `reconcile_snapshot(changed_keys, bot_handler)` is called,
+    if it has one.  The snapshot is written every `interval` seconds and
+    when the bot exits.
+    """
+
+    def __init__(self, path: str, interval: float = 60.0) -> None:
+        self.path = path
+        self.interval = interval
+
+    @classmethod
+    def for_bot(cls, directory: str, name: str, interval: float = 60.0) -> "StateSnapshot":
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, f"{name}.snapshot.json.gz"), interval)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with gzip.open(self.path, "rt") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            logging.warning("Ignoring unreadable snapshot %s", self.path)
+            return None
+        logging.info("Loaded snapshot %s from %s", self.path, time.ctime(snapshot["time"]))
+        return snapshot
+
+    def write(self, message_handler: Any, storage: StateHandler) -> None:
+        attributes = {}
+        for name in getattr(message_handler, "snapshot_attributes", []):
+            if hasattr(message_handler, name):
+                attributes[name] = getattr(message_handler, name)
+        storage_keys = getattr(message_handler, "snapshot_storage_keys", [])
+        snapshot = dict(
+            time=time.time(),
+            attributes=attributes,
+            storage={key: storage.state_[key] for key in storage_keys if key in storage.state_},
+        )
+        # Write to a temporary file first, so that a crash while writing
+        # leaves the previous snapshot in place.
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError):
+            logging.exception("Could not write snapshot %s", self.path)
+
+
+class BotRunner:
+    """
+    Sets up a bot's message handler on top of a connected Client, and
+    feeds it the events that the Client receives from its event queue.
+
+    lib_module is of type Any, since it can contain any bot's
+    handler class. Eventually, we want bot's handler classes to
+    inherit from a common prototype specifying the handle_message
+    function.
+
+    `reload_handler` swaps in a new version of the bot's code while the
+    bot is running; see `HandlerReloader`.
+    """
+
+    def __init__(
+        self,
+        lib_module: Any,
+        client: Client,
+        bot_config_file: Optional[str],
+        bot_name: str,
+        bot_source: str,
+        quiet: bool = True,
+        profiler: Optional[Profiler] = None,
+        pipeline_options: Optional[Dict[str, Any]] = None,
+        snapshot: Optional[StateSnapshot] = None,
+        profile_name: Optional[str] = None,
+    ) -> None:
+        self.lib_module = lib_module
+        self.client = client
+        self.bot_name = bot_name
+        self.profiler = profiler
+        # The name the profiler's stats are kept under; several runners
+        # can run the same bot.
+        self.profile_name = profile_name if profile_name is not None else bot_name
+        if profiler is not None:
+            profiler.instrument_client(client)
+
+        # Set default bot_details, then override from class, if provided
+        self.bot_details = {
+            "name": bot_name.capitalize(),
+            "description": "",
+        }
+        self.bot_details.update(getattr(lib_module.handler_class, "META", {}))
+
+        bot_dir = os.path.dirname(lib_module.__file__)
+        self.bot_handler = ExternalBotHandler(client, bot_dir, self.bot_details, bot_config_file)
+        self.snapshot = snapshot
+        restored = snapshot.load() if snapshot is not None else None
+        if restored is not None:
+            self.bot_handler.storage.preload(restored["storage"])
+        self.message_handler = prepare_message_handler(bot_name, self.bot_handler, lib_module)
+        if restored is not None:
+            for name, value in restored["attributes"].items():
+                setattr(self.message_handler, name, value)
+        self.pipeline = MessagePipeline.for_bot_handler(
+            self.bot_handler, **(pipeline_options or {})
+        )
+        self.bot_handler.on_config_reload(self.handle_config_reload)
+        # Held while handling an event, so that a reload never swaps the
+        # message handler out from under a message.
+        self._lock = threading.Lock()
+        self._source_version = self.source_version()
+        self.bot_handler.scheduler.start(self.run_scheduled_job, self._lock)
+        if snapshot is not None:
+            self.bot_handler.scheduler.schedule_every(
+                snapshot.interval, lambda data: self.write_snapshot()
+            )
+        if restored is not None and restored["storage"]:
+            threading.Thread(
+                target=self.reconcile_snapshot,
+                args=(list(restored["storage"]),),
+                name=f"snapshot-{bot_name}",
+                daemon=True,
+            ).start()
+
+        if not quiet:
+            print("Running {} Bot (from {}):".format(self.bot_details["name"], bot_source))
+            if self.bot_details["description"] != "":
+                print("\n\t{}".format(self.bot_details["description"]))
+            if hasattr(self.message_handler, "usage"):
+                print(self.message_handler.usage())
+            else:
+                print(f"WARNING: {bot_name} is missing usage handler, please add one eventually")
+
+    def handle_config_reload(self) -> None:
+        # Bots that implement handle_config_reload pick up changes to their
+        # config file (e.g. a rotated API key) without being restarted.
+        if not hasattr(self.message_handler, "handle_config_reload"):
+            return
+        config_data = self.bot_handler.get_config_info(self.bot_name)
+        if hasattr(self.lib_module.handler_class, "validate_config"):
+            try:
+                self.lib_module.handler_class.validate_config(config_data)
+            except Exception:
+                logging.exception("Reloaded config for %s is invalid, ignoring it", self.bot_name)
+                return
+        self.message_handler.handle_config_reload(config_data, self.bot_handler)
+
+    def handle_message(self, message: Dict[str, Any], flags: List[str]) -> None:
+        logging.info("waiting for next message")
+        self.bot_handler.reload_config_if_changed()
+        # `mentioned` will be in `flags` if the bot is mentioned at ANY position
+        # (not necessarily the first @mention in the message).
+        is_mentioned = "mentioned" in flags
+        is_private_message = self.pipeline.is_private_message(message)
+
+        if self.pipeline.prepare(message, is_mentioned, is_private_message):
+            self.bot_handler.outbound.begin_message(
+                message.get("sender_id") == self.bot_handler.user_id
+            )
+            if self.profiler is not None:
+                with self.profiler.message(self.profile_name, message):
+                    self._handle_message(message)
+            else:
+                self._handle_message(message)
+
+    def _handle_message(self, message: Dict[str, Any]) -> None:
+        try:
+            self.message_handler.handle_message(message=message, bot_handler=self.bot_handler)
+        finally:
+            # Sends the edits held back, even if the bot raised.
+            self.bot_handler.outbound.flush()
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        if event["type"] == "message":
+            with self._lock:
+                self.handle_message(event["message"], event["flags"])
+
+    def run_scheduled_job(self, method_name: str, data: Any) -> None:
+        getattr(self.message_handler, method_name)(data, self.bot_handler)
+
+    def write_snapshot(self) -> None:
+        assert self.snapshot is not None
+        self.snapshot.write(self.message_handler, self.bot_handler.storage)
+
+    def reconcile_snapshot(self, keys: List[str]) -> None:
+        # Under the lock, so that a value the bot puts meanwhile isn't
+        # replaced by the one fetched before.
+        with self._lock:
+            try:
+                changed = self.bot_handler.storage.refresh(keys)
+            except Exception:
+                logging.exception("Could not reconcile the snapshot of %s", self.bot_name)
+                return
+            if not changed:
+                return
+            logging.info("Storage changed since the snapshot of %s: %s", self.bot_name, changed)
+            if hasattr(self.message_handler, "reconcile_snapshot"):
+                self.message_handler.reconcile_snapshot(changed, self.bot_handler)
+
+    def source_version(self) -> Tuple[int, ...]:
+        """
+        The modification times of the Python files in the bot's directory,
+        which change whenever a new version of the bot is deployed.
+        """
+        bot_dir = Path(self.lib_module.__file__).parent
+        return tuple(path.stat().st_mtime_ns for path in sorted(bot_dir.glob("*.py")))
+
+    def source_changed(self) -> bool:
+        return self.source_version() != self._source_version
+
+    def _load_handler(self) -> Tuple[Any, Any]:
+        lib_module = finder.reimport_module(self.lib_module)
+        if lib_module is None:
+            raise ImportError(f"Could not import {self.lib_module.__file__}")
+        return lib_module, prepare_message_handler(self.bot_name, self.bot_handler, lib_module)
+
+    def reload_handler(self) -> bool:
+        """
+        Re-imports the bot's module and replaces the message handler with a
+        new instance of its handler class.  The Client, and with it the
+        event queue, and the bot handler, with its storage cache, are kept;
+        events that arrive meanwhile wait until the new handler is in place.
+
+        If the new handler class has a `handle_reload(previous_handler,
+        bot_handler)` method, it is called before the swap, to carry over
+        whatever state the previous handler kept in memory.
+
+        If the new code fails to import or initialize, the bot keeps
+        running its current version.  Returns whether the handler was
+        replaced.
+        """
+        self._source_version = self.source_version()
+        try:
+            lib_module, message_handler = self._load_handler()
+        # Catch SystemExit too: a broken deploy must not stop a running bot.
+        except (Exception, SystemExit):
+            logging.exception("Reloading %s failed, keeping the running version", self.bot_name)
+            return False
+
+        with self._lock:
+            if hasattr(message_handler, "handle_reload"):
+                try:
+                    message_handler.handle_reload(self.message_handler, self.bot_handler)
+                except Exception:
+                    logging.exception(
+                        "Reloading %s failed, keeping the running version", self.bot_name
+                    )
+                    return False
+            self.lib_module = lib_module
+            self.message_handler = message_handler
+        logging.info("Reloaded %s from %s", self.bot_name, lib_module.__file__)
+        return True
+
+
+class HandlerReloader(threading.Thread):
+    """
+    Reloads the code of running bots in the background, so that a new
+    version of a bot can be deployed without restarting it.  In "sighup"
+    mode, all bots are reloaded when the process receives SIGHUP; in
+    "watch" mode, a bot is reloaded when one of its source files changes.
+
+    Only the bot's main module is re-imported; helper modules it imports
+    keep their current version.
+    """
+
+    MODES = ("sighup", "watch")
+
+    def __init__(self, mode: str, interval: float = 2.0) -> None:
+        super().__init__(name="handler-reloader", daemon=True)
+        assert mode in self.MODES
+        self.mode = mode
+        self.interval = interval
+        self.runners: List[BotRunner] = []
+        self._requested = threading.Event()
+
+    def add(self, runner: BotRunner) -> None:
+        self.runners.append(runner)
+
+    def install(self) -> None:
+        # Signal handlers can only be set from the main thread.
+        if self.mode == "sighup":
+            signal.signal(signal.SIGHUP, self.request_reload)
+        self.start()
+
+    def request_reload(self, signum: Optional[int] = None, frame: Optional[Any] = None) -> None:
+        self._requested.set()
+
+    @override
+    def run(self) -> None:
+        while True:
+            if self.mode == "sighup":
+                self._requested.wait()
+                self._requested.clear()
+                logging.info("SIGHUP received, reloading bots...")
+                for runner in list(self.runners):
+                    runner.reload_handler()
+            else:
+                time.sleep(self.interval)
+                for runner in list(self.runners):
+                    if runner.source_changed():
+                        runner.reload_handler()
+
+
+class SharedConnectionPools:
+    """
+    Lets the Clients of several bots on the same Zulip site share one
+    pool of HTTP connections, instead of each Client keeping its own.
+    Each bot's long-polling request still holds a connection while it
+    waits, so `pool_maxsize` should be at least the number of bots.
+    """
+
+    def __init__(self, pool_maxsize: int = 10) -> None:
+        self.pool_maxsize = pool_maxsize
+        self._adapters: Dict[str, requests.adapters.HTTPAdapter] = {}
+        self._lock = threading.Lock()
+
+    def share(self, client: Client) -> None:
+        client.ensure_session()
+        assert client.session is not None
+        url = urllib.parse.urlsplit(client.base_url)
+        prefix = f"{url.scheme}://{url.netloc}/"
+        with self._lock:
+            adapter = self._adapters.get(prefix)
+            if adapter is None:
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_maxsize
+                )
+                self._adapters[prefix] = adapter
+        # Close the connection that the Client opened while connecting.
+        client.session.get_adapter(prefix).close()
+        client.session.mount(prefix, adapter)
+
+    def sites(self) -> List[str]:
+        return list(self._adapters)
+
+
 def run_message_handler_for_bot(
     lib_module: Any,
     quiet: bool,
@@ -441,20 +1379,13 @@ def run_message_handler_for_bot(
     bot_config_file: Optional[str],
     bot_name: str,
     bot_source: str,
+    reload: Optional[str] = None,
+    profiler: Optional[Profiler] = None,
+    pipeline_options: Optional[Dict[str, Any]] = None,
+    record_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+    record_profile: Optional[Callable[[Dict[str, Any]], None]] = None,
+    snapshot: Optional[StateSnapshot] = None,
 ) -> Any:
-    """
-    lib_module is of type Any, since it can contain any bot's
-    handler class. Eventually, we want bot's handler classes to
-    inherit from a common prototype specifying the handle_message
-    function.
-
-    Set default bot_details, then override from class, if provided
-    """
-    bot_details = {
-        "name": bot_name.capitalize(),
-        "description": "",
-    }
-    bot_details.update(getattr(lib_module.handler_class, "META", {}))
     # Make sure you set up your ~/.zuliprc
 
     client_name = f"Zulip{bot_name.capitalize()}Bot"
@@ -466,48 +1397,44 @@ def run_message_handler_for_bot(
         display_config_file_errors(str(e), config_file)
         sys.exit(1)
 
-    bot_dir = os.path.dirname(lib_module.__file__)
-    restricted_client = ExternalBotHandler(client, bot_dir, bot_details, bot_config_file)
-
-    message_handler = prepare_message_handler(bot_name, restricted_client, lib_module)
-
-    if not quiet:
-        print("Running {} Bot (from {}):".format(bot_details["name"], bot_source))
-        if bot_details["description"] != "":
-            print("\n\t{}".format(bot_details["description"]))
-        if hasattr(message_handler, "usage"):
-            print(message_handler.usage())
-        else:
-            print(f"WARNING: {bot_name} is missing usage handler, please add one eventually")
-
-    def handle_message(message: Dict[str, Any], flags: List[str]) -> None:
-        logging.info("waiting for next message")
-        # `mentioned` will be in `flags` if the bot is mentioned at ANY position
-        # (not necessarily the first @mention in the message).
-        is_mentioned = "mentioned" in flags
-        is_private_message = is_private_message_but_not_group_pm(message, restricted_client)
-
-        # Provide bots with a way to access the full, unstripped message
-        message["full_content"] = message["content"]
-        # Strip at-mention botname from the message
-        if is_mentioned:
-            # message['content'] will be None when the bot's @-mention is not at the beginning.
-            # In that case, the message shall not be handled.
-            message["content"] = extract_query_without_mention(
-                message=message, client=restricted_client
+    runner = BotRunner(
+        lib_module,
+        client,
+        bot_config_file,
+        bot_name,
+        bot_source,
+        quiet,
+        profiler=profiler,
+        pipeline_options=pipeline_options,
+        snapshot=snapshot,
+    )
+    if snapshot is not None:
+        # exit_gracefully exits through sys.exit, which runs this.
+        atexit.register(runner.write_snapshot)
+    if record_profile is not None:
+        bot_handler = runner.bot_handler
+        record_profile(
+            dict(
+                user_id=bot_handler.user_id,
+                full_name=bot_handler.full_name,
+                email=bot_handler.email,
             )
-            if message["content"] is None:
-                return
-
-        if is_private_message or is_mentioned:
-            message_handler.handle_message(message=message, bot_handler=restricted_client)
+        )
 
     signal.signal(signal.SIGINT, exit_gracefully)
+    if profiler is not None:
+        profiler.install_signal_handler()
+
+    if reload is not None:
+        reloader = HandlerReloader(reload)
+        reloader.add(runner)
+        reloader.install()
 
     logging.info("starting message handling...")
 
-    def event_callback(event: Dict[str, Any]) -> None:
-        if event["type"] == "message":
-            handle_message(event["message"], event["flags"])
+    def handle_event(event: Dict[str, Any]) -> None:
+        if record_event is not None:
+            record_event(event)
+        runner.handle_event(event)
 
-    client.call_on_each_event(event_callback, ["message"])
+    client.call_on_each_event(handle_event, ["message"])
@@ -0,0 +1,233 @@
+import atexit
+import configparser
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from typing_extensions import override
+
+from zulip import Client
+from zulip_bots.lib import (
+    BotRunner,
+    HandlerReloader,
+    SharedConnectionPools,
+    StateSnapshot,
+    display_config_file_errors,
+    exit_gracefully,
+)
+from zulip_bots.profiling import Profiler
+
+
+def read_bot_manifest(manifest_file: str) -> Dict[str, Dict[str, str]]:
+    """
+    Reads a manifest of bots to run in one process.  Each section of
+    the manifest describes one bot:
+
+        [giphy]
+        # The name or path of the bot; defaults to the section name.
+        bot = giphy
+        config-file = ~/zuliprc-giphy
+        bot-config-file = ~/giphy.conf
+        # Load the bot from the zulip_bots registry.
+        registry = false
+
+    Missing file options are returned as empty strings.
+    """
+    parser = configparser.ConfigParser()
+    with open(manifest_file) as f:
+        try:
+            parser.read_file(f)
+        except configparser.Error as e:
+            display_config_file_errors(str(e), manifest_file)
+            sys.exit(1)
+
+    manifest: Dict[str, Dict[str, str]] = {}
+    for section in parser.sections():
+        entry = {"bot": parser.get(section, "bot", fallback=section)}
+        for option in ["config-file", "bot-config-file"]:
+            path = parser.get(section, option, fallback="")
+            entry[option] = os.path.expanduser(path) if path else ""
+        registry = parser.getboolean(section, "registry", fallback=False)
+        entry["registry"] = "true" if registry else "false"
+        manifest[section] = entry
+    return manifest
+
+
+class BotSpec:
+    def __init__(
+        self,
+        *,
+        name: str,
+        lib_module: Any,
+        bot_name: str,
+        bot_source: str,
+        config_file: Optional[str],
+        bot_config_file: Optional[str],
+    ) -> None:
+        self.name = name
+        self.lib_module = lib_module
+        self.bot_name = bot_name
+        self.bot_source = bot_source
+        self.config_file = config_file
+        self.bot_config_file = bot_config_file
+
+
+class BotMetrics:
+    def __init__(self) -> None:
+        self.state = "starting"
+        self.events = 0
+        self.errors = 0
+        self.handler_seconds = 0.0
+        self.max_handler_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.events += 1
+        self.handler_seconds += seconds
+        self.max_handler_seconds = max(self.max_handler_seconds, seconds)
+
+
+class BotThread(threading.Thread):
+    """
+    Runs one bot's event loop.  Exceptions raised by the bot's handler,
+    including `SystemExit` from `bot_handler.quit()`, are contained in
+    this thread, so a crashing bot doesn't affect the others.
+    """
+
+    def __init__(
+        self,
+        spec: BotSpec,
+        pools: SharedConnectionPools,
+        quiet: bool,
+        reloader: Optional[HandlerReloader] = None,
+        profiler: Optional[Profiler] = None,
+        pipeline_options: Optional[Dict[str, Any]] = None,
+        snapshot: Optional[StateSnapshot] = None,
+    ) -> None:
+        super().__init__(name=f"bot-{spec.name}", daemon=True)
+        self.spec = spec
+        self.pools = pools
+        self.quiet = quiet
+        self.reloader = reloader
+        self.profiler = profiler
+        self.pipeline_options = pipeline_options
+        self.snapshot = snapshot
+        self.metrics = BotMetrics()
+        self.runner: Optional[BotRunner] = None
+
+    @override
+    def run(self) -> None:
+        spec = self.spec
+        try:
+            client = Client(
+                config_file=spec.config_file, client=f"Zulip{spec.bot_name.capitalize()}Bot"
+            )
+            self.pools.share(client)
+            self.runner = BotRunner(
+                spec.lib_module,
+                client,
+                spec.bot_config_file,
+                spec.bot_name,
+                spec.bot_source,
+                self.quiet,
+                profiler=self.profiler,
+                pipeline_options=self.pipeline_options,
+                snapshot=self.snapshot,
+                profile_name=spec.name,
+            )
+            if self.snapshot is not None:
+                atexit.register(self.runner.write_snapshot)
+            if self.reloader is not None:
+                self.reloader.add(self.runner)
+            self.metrics.state = "running"
+            client.call_on_each_event(self.handle_event, ["message"])
+        except SystemExit as e:
+            logging.error("Bot %s stopped: %s", spec.name, e)
+        except Exception:
+            logging.exception("Bot %s crashed", spec.name)
+        self.metrics.state = "stopped"
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        assert self.runner is not None
+        start = time.monotonic()
+        try:
+            self.runner.handle_event(event)
+        except Exception:
+            # Keep the bot running; the next event may well succeed.
+            self.metrics.errors += 1
+            logging.exception("Bot %s failed to handle an event", self.spec.name)
+        finally:
+            self.metrics.record(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(
+            state=self.metrics.state,
+            events=self.metrics.events,
+            errors=self.metrics.errors,
+            handler_seconds=round(self.metrics.handler_seconds, 3),
+            max_handler_seconds=round(self.metrics.max_handler_seconds, 3),
+        )
+        if self.runner is not None:
+            stats.update(self.runner.bot_handler.outbound.stats())
+        if self.profiler is not None:
+            stats.update(self.profiler.stats().get(self.spec.name, {}))
+        return stats
+
+
+def report_metrics(threads: List[BotThread]) -> None:
+    for thread in threads:
+        stats = " ".join(f"{key}={value}" for key, value in thread.stats().items())
+        logging.info("bot %s: %s", thread.spec.name, stats)
+
+
+def run_bots(
+    bots: List[BotSpec],
+    quiet: bool = False,
+    metrics_interval: float = 60,
+    reload: Optional[str] = None,
+    profiler: Optional[Profiler] = None,
+    pipeline_options: Optional[Dict[str, Any]] = None,
+    snapshot_dir: Optional[str] = None,
+    snapshot_interval: float = 60,
+) -> None:
+    """
+    Runs several bots in this process, one thread per bot.  The bots
+    share the interpreter and imported modules, and bots on the same
+    Zulip site share a pool of HTTP connections.
+    """
+    pools = SharedConnectionPools(pool_maxsize=len(bots) + 1)
+    reloader = HandlerReloader(reload) if reload is not None else None
+    threads = []
+    for spec in bots:
+        snapshot = None
+        if snapshot_dir is not None:
+            snapshot = StateSnapshot.for_bot(snapshot_dir, spec.name, snapshot_interval)
+        threads.append(
+            BotThread(spec, pools, quiet, reloader, profiler, pipeline_options, snapshot)
+        )
+
+    signal.signal(signal.SIGINT, exit_gracefully)
+    if profiler is not None:
+        profiler.install_signal_handler()
+    if reloader is not None:
+        reloader.install()
+    logging.info("starting %d bots...", len(threads))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while any(thread.is_alive() for thread in threads):
+            # Joining the bots that stopped returns at once, so wait for
+            # the others until a common deadline.
+            deadline = time.monotonic() + metrics_interval
+            for thread in threads:
+                thread.join(timeout=max(0.0, deadline - time.monotonic()))
+            report_metrics(threads)
+    finally:
+        report_metrics(threads)
+
+    logging.error("All bots have stopped.")
+    sys.exit(1)
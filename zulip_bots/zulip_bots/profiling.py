@@ -0,0 +1,254 @@
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from types import FrameType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from zulip import Client
+
+_current = threading.local()
+
+
+def record_call(kind: str, name: str) -> None:
+    """
+    Attributes a Zulip API call ("api"), a request to another service
+    ("http") or a storage operation to the message that the current
+    thread is handling, if any.  Cheap enough to call everywhere.
+    """
+    record: Optional[MessageRecord] = getattr(_current, "record", None)
+    if record is not None:
+        if kind == "api":
+            counts = record.api_calls
+        elif kind == "http":
+            counts = record.http_calls
+        else:
+            counts = record.storage_ops
+        counts[name] += 1
+
+
+class MessageRecord:
+    def __init__(self, bot_name: str, message_id: Optional[int]) -> None:
+        self.bot_name = bot_name
+        self.message_id = message_id
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.api_calls: Counter[str] = Counter()
+        self.http_calls: Counter[str] = Counter()
+        self.storage_ops: Counter[str] = Counter()
+        # A sample of the handler's stack, taken once it has run for longer
+        # than the slow-message threshold.
+        self.stack: Optional[str] = None
+
+    def summary(self) -> str:
+        api_calls = ", ".join(f"{name}={count}" for name, count in self.api_calls.items())
+        http_calls = ", ".join(f"{name}={count}" for name, count in self.http_calls.items())
+        storage_ops = ", ".join(f"{name}={count}" for name, count in self.storage_ops.items())
+        return (
+            f"bot={self.bot_name} message={self.message_id} "
+            f"wall={self.wall * 1000:.1f}ms cpu={self.cpu * 1000:.1f}ms "
+            f"api_calls=[{api_calls}] http_calls=[{http_calls}] storage_ops=[{storage_ops}]"
+        )
+
+
+class BotProfile:
+    def __init__(self) -> None:
+        self.messages = 0
+        self.slow_messages = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.max_wall = 0.0
+        self.api_calls = 0
+        self.http_calls = 0
+        self.storage_ops = 0
+
+    def add(self, record: MessageRecord, slow: bool) -> None:
+        self.messages += 1
+        self.slow_messages += slow
+        self.wall += record.wall
+        self.cpu += record.cpu
+        self.max_wall = max(self.max_wall, record.wall)
+        self.api_calls += sum(record.api_calls.values())
+        self.http_calls += sum(record.http_calls.values())
+        self.storage_ops += sum(record.storage_ops.values())
+
+
+class Profiler:
+    """
+    Instruments the handling of messages by bots:
+
+    * Every message handled inside `profiler.message(...)` is timed (wall
+      clock and the CPU time of the handling thread), and the Zulip API
+      calls, requests to other services and storage operations it makes
+      are counted.  Per-message
+      numbers are logged at DEBUG level; `stats()` has totals per bot.
+    * Messages taking longer than `slow_threshold` seconds are logged as
+      warnings, along with a sample of the handler's stack taken while
+      it was still running.
+    * `toggle_sampling()`, bound to SIGUSR1 by `install_signal_handler`,
+      starts a sampling profiler over the threads handling messages.
+      Toggling it off writes the collected stacks to `profile_dir`, in the
+      "folded" format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(
+        self,
+        slow_threshold: Optional[float] = None,
+        profile_dir: str = ".",
+        sample_interval: float = 0.005,
+    ) -> None:
+        self.slow_threshold = slow_threshold
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.bots: Dict[str, BotProfile] = {}
+        self._active: Dict[int, MessageRecord] = {}
+        self._lock = threading.Lock()
+        self._samples: Counter[str] = Counter()
+        self._sampling = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._watchdog: Optional[threading.Thread] = None
+
+    def instrument_client(self, client: Client) -> None:
+        # Every Client method goes through call_endpoint, so wrapping it on
+        # this instance catches all API calls made while handling a message.
+        call_endpoint = client.call_endpoint
+
+        def counted_call_endpoint(url: Optional[str] = None, *args: Any, **kwargs: Any) -> Any:
+            record_call("api", url or "")
+            return call_endpoint(url, *args, **kwargs)
+
+        client.call_endpoint = counted_call_endpoint  # type: ignore[method-assign]
+
+    @contextmanager
+    def message(self, bot_name: str, message: Dict[str, Any]) -> Iterator[MessageRecord]:
+        record = MessageRecord(bot_name, message.get("id"))
+        previous = getattr(_current, "record", None)
+        _current.record = record
+        with self._lock:
+            self._active[record.thread_id] = record
+        if self.slow_threshold is not None and self._watchdog is None:
+            self._watchdog = self._start_thread("profiler-watchdog", self._watch)
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - record.start
+            record.cpu = time.thread_time() - record.cpu_start
+            _current.record = previous
+            slow = self.slow_threshold is not None and record.wall > self.slow_threshold
+            with self._lock:
+                del self._active[record.thread_id]
+                self.bots.setdefault(bot_name, BotProfile()).add(record, slow)
+            if slow:
+                logging.warning(
+                    "Slow message: %s\n%s",
+                    record.summary(),
+                    record.stack or "(finished before its stack could be sampled)",
+                )
+            else:
+                logging.debug("Handled message: %s", record.summary())
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                bot_name: dict(
+                    messages=profile.messages,
+                    slow_messages=profile.slow_messages,
+                    wall_seconds=round(profile.wall, 3),
+                    cpu_seconds=round(profile.cpu, 3),
+                    max_wall_seconds=round(profile.max_wall, 3),
+                    api_calls=profile.api_calls,
+                    http_calls=profile.http_calls,
+                    storage_ops=profile.storage_ops,
+                )
+                for bot_name, profile in self.bots.items()
+            }
+
+    def install_signal_handler(self, signum: Optional[int] = None) -> None:
+        if signum is None:
+            if not hasattr(signal, "SIGUSR1"):
+                logging.warning("The sampling profiler needs SIGUSR1, which this platform lacks")
+                return
+            signum = signal.SIGUSR1
+        # Signal handlers can only be set from the main thread.
+        signal.signal(signum, self.toggle_sampling)
+
+    def toggle_sampling(
+        self, signum: Optional[int] = None, frame: Optional[FrameType] = None
+    ) -> None:
+        if self._sampling.is_set():
+            self._sampling.clear()
+            # The sampler thread writes the profile once it notices.
+        else:
+            self._samples = Counter()
+            self._sampling.set()
+            self._sampler = self._start_thread("profiler-sampler", self._sample)
+            logging.info("Sampling profiler started")
+
+    def write_profile(self) -> str:
+        path = os.path.join(
+            self.profile_dir,
+            "zulip-bots-{}-{}.folded".format(os.getpid(), time.strftime("%Y%m%d-%H%M%S")),
+        )
+        with open(path, "w") as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info("Sampling profiler stopped; wrote %s", path)
+        return path
+
+    def _start_thread(self, name: str, target: Callable[[], None]) -> threading.Thread:
+        thread = threading.Thread(name=name, target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def _active_frames(self) -> List[Tuple[MessageRecord, FrameType]]:
+        # The only way to sample other threads' stacks without a debugger.
+        frames = sys._current_frames()  # noqa: SLF001
+        with self._lock:
+            return [
+                (record, frames[thread_id])
+                for thread_id, record in self._active.items()
+                if thread_id in frames
+            ]
+
+    def _watch(self) -> None:
+        assert self.slow_threshold is not None
+        while True:
+            time.sleep(self.slow_threshold / 2)
+            now = time.perf_counter()
+            for record, frame in self._active_frames():
+                if record.stack is None and now - record.start > self.slow_threshold:
+                    record.stack = "".join(traceback.format_stack(frame))
+
+    def _sample(self) -> None:
+        while self._sampling.is_set():
+            for record, frame in self._active_frames():
+                self._samples[folded_stack(record.bot_name, frame)] += 1
+            time.sleep(self.sample_interval)
+        self.write_profile()
+
+
+def make_profiler(
+    slow_threshold: Optional[float], profile_dir: Optional[str]
+) -> Optional[Profiler]:
+    """The profiler asked for on the command line, if any."""
+    if slow_threshold is None and profile_dir is None:
+        return None
+    return Profiler(slow_threshold, profile_dir if profile_dir is not None else ".")
+
+
+def folded_stack(root: str, frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(root)
+    return ";".join(reversed(names))
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import gzip
+import json
+import re
+import resource
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from typing_extensions import override
+
+from zulip import API_VERSTRING, Client
+from zulip_bots.lib import BotRunner, OutboundScheduler, RateLimit
+from zulip_bots.run import load_bot_lib_module
+
+
+class ReplayFinishedError(Exception):
+    pass
+
+
+class UnlimitedRateLimit(RateLimit):
+    """Lets every call through at once, without keeping track of them."""
+
+    def __init__(self) -> None:
+        super().__init__(sys.maxsize, 1)
+
+    @override
+    def wait_time(self, now: Optional[float] = None) -> float:
+        return 0.0
+
+    @override
+    def record(self, now: Optional[float] = None) -> None:
+        pass
+
+
+class StubZulipServer:
+    """
+    An in-memory stand-in for the parts of the Zulip API that bots use.
+    The event queue serves the messages of a transcript, followed by a
+    "replay_end" event.
+    """
+
+    def __init__(
+        self,
+        events: Iterable[Dict[str, Any]],
+        batch_size: int = 100,
+        full_name: str = "Replay Bot",
+        email: str = "replay-bot@example.com",
+        user_id: int = 1,
+    ) -> None:
+        self.events = iter(events)
+        self.batch_size = batch_size
+        self.full_name = full_name
+        self.email = email
+        self.user_id = user_id
+        self.next_event_id = 0
+        self.next_message_id = 1000000
+        self.storage: Dict[str, str] = {}
+        self.calls: Counter[str] = Counter()
+
+    def handle(self, method: str, url: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        # Collapse ids, so that e.g. all message edits are counted together.
+        endpoint = re.sub(r"/\d+", "/:id", url)
+        self.calls[f"{method} {endpoint}"] += 1
+        response: Dict[str, Any] = dict(result="success", msg="")
+
+        if endpoint == "server_settings":
+            response.update(zulip_version="9.0", zulip_feature_level=237)
+        elif endpoint == "users/me":
+            response.update(user_id=self.user_id, full_name=self.full_name, email=self.email)
+        elif endpoint == "users/:id":
+            response.update(user=dict(user_id=int(url.rsplit("/", 1)[-1]), role=400))
+        elif endpoint == "register":
+            response.update(queue_id="replay", last_event_id=-1)
+        elif endpoint == "events":
+            response.update(events=self._next_events())
+        elif endpoint == "messages" and method == "POST":
+            self.next_message_id += 1
+            response.update(id=self.next_message_id)
+        elif endpoint == "bot_storage" and method == "PUT":
+            self.storage.update(request["storage"])
+        elif endpoint == "bot_storage":
+            keys = request.get("keys", list(self.storage))
+            if any(key not in self.storage for key in keys):
+                # Like Zulip, which refuses the whole request.
+                response.update(result="error", msg="Key does not exist.")
+            elif method == "DELETE":
+                for key in keys:
+                    del self.storage[key]
+            else:
+                response.update(storage={key: self.storage[key] for key in keys})
+        elif endpoint == "user_uploads":
+            response.update(uri=f"/user_uploads/replay/{self.calls[url]}")
+        return response
+
+    def _next_events(self) -> List[Dict[str, Any]]:
+        events = []
+        for event in self.events:
+            events.append(dict(event, id=self.next_event_id))
+            self.next_event_id += 1
+            if len(events) == self.batch_size:
+                return events
+        if not events:
+            events.append(dict(type="replay_end", id=self.next_event_id))
+        return events
+
+
+class StubClient(Client):
+    """A Client whose API calls are served by a StubZulipServer."""
+
+    def __init__(self, server: StubZulipServer) -> None:
+        self.server = server
+        super().__init__(
+            email=server.email, api_key="replay", site="http://replay.invalid", client="Replay"
+        )
+
+    @override
+    def do_api_query(
+        self,
+        orig_request: Any,
+        url: str,
+        method: str = "POST",
+        longpolling: bool = False,
+        files: Optional[List[IO[Any]]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        return self.server.handle(method, url[len(API_VERSTRING) :], dict(orig_request))
+
+
+def read_transcript(transcript: IO[str]) -> List[Dict[str, Any]]:
+    """
+    Reads a JSONL transcript, with one message event per line.  A line
+    can be a full event ({"type": "message", "message": ..., "flags":
+    ...}) or just the message, which is then treated as a direct message
+    to the bot, or a mention if it has `"flags": ["mentioned"]`.
+    """
+    events = []
+    for line in transcript:
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        if "message" not in data:
+            flags = data.pop("flags", [])
+            data = dict(type="message", message=data, flags=flags)
+        events.append(data)
+    return events
+
+
+class EventRecorder:
+    """
+    Writes the raw events a bot receives to a JSONL file, one `{"time":
+    ..., "event": ...}` object per line, for `zulip-run-bot
+    --replay-events`.  The file starts with the bot's profile, as a
+    `{"profile": ...}` line, so that the replay serves the bot as itself.
+    """
+
+    def __init__(self, file: IO[str]) -> None:
+        self.file = file
+
+    def record_profile(self, profile: Dict[str, Any]) -> None:
+        self.file.write(json.dumps(dict(profile=profile)) + "\n")
+
+    def record(self, event: Dict[str, Any]) -> None:
+        self.file.write(json.dumps(dict(time=time.time(), event=event)) + "\n")
+
+
+@contextlib.contextmanager
+def record_events(path: str) -> Iterator[EventRecorder]:
+    """
+    An EventRecorder writing to a gzipped file at `path`, which is closed,
+    completing the gzip stream, on the way out; zulip-run-bot exits
+    through sys.exit, which does so.
+    """
+    with gzip.open(path, "wt") as f:
+        yield EventRecorder(f)
+
+
+def read_recorded_events(
+    path: str,
+) -> Tuple[List[Dict[str, Any]], List[float], Optional[Dict[str, Any]]]:
+    """
+    Reads a file written by EventRecorder, returning the message events,
+    the times they were received, and the bot's profile, if recorded.  A
+    file whose end is missing, because the bot was killed, is read up to
+    where it stops.
+    """
+    events = []
+    times = []
+    profile = None
+    with gzip.open(path, "rt") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                data = json.loads(line)
+                if "profile" in data:
+                    profile = data["profile"]
+                elif data["event"]["type"] == "message":
+                    events.append(data["event"])
+                    times.append(data["time"])
+        except EOFError:
+            pass
+    return events, times, profile
+
+
+def parse_speed(speed: str) -> Optional[float]:
+    """Parses `--speed`: "max", or a factor like "10x"; None means "max"."""
+    if speed == "max":
+        return None
+    try:
+        factor = float(speed.removesuffix("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid speed: {speed} (try 10x or max)") from None
+    if factor <= 0:
+        raise argparse.ArgumentTypeError(f"invalid speed: {speed} (try 10x or max)")
+    return factor
+
+
+def synthetic_transcript(
+    count: int, contents: List[str], server: StubZulipServer
+) -> List[Dict[str, Any]]:
+    """`count` messages mentioning the bot in a stream, cycling through `contents`."""
+    return [
+        dict(
+            type="message",
+            flags=["mentioned"],
+            message=dict(
+                id=i + 1,
+                type="stream",
+                display_recipient="replay",
+                subject="replay",
+                sender_id=100 + i % 10,
+                sender_email=f"user{i % 10}@example.com",
+                sender_full_name=f"User {i % 10}",
+                content=f"@**{server.full_name}** {contents[i % len(contents)]}",
+            ),
+        )
+        for i in range(count)
+    ]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def replay(
+    lib_module: Any,
+    bot_name: str,
+    events: List[Dict[str, Any]],
+    bot_config_file: Optional[str] = None,
+    server: Optional[StubZulipServer] = None,
+    trace_memory: bool = False,
+    times: Optional[List[float]] = None,
+    speed: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Replays `events` against the bot through the same BotRunner dispatch
+    path and Client event loop as `zulip-run-bot`, and reports how fast
+    the bot handled them.  Outgoing messages aren't paced, so that the
+    numbers reflect the bot's own cost.
+
+    If `times` and `speed` are given, the events are handed to the bot
+    `speed` times faster than they were received at `times`; otherwise,
+    as fast as the bot handles them.
+    """
+    if server is None:
+        server = StubZulipServer(events)
+    else:
+        server.events = iter(events)
+    client = StubClient(server)
+    runner = BotRunner(lib_module, client, bot_config_file, bot_name, "replay")
+    runner.bot_handler.outbound = OutboundScheduler(UnlimitedRateLimit())
+    setup_calls = Counter(server.calls)
+
+    latencies: List[float] = []
+
+    def handle_event(event: Dict[str, Any]) -> None:
+        if event["type"] == "replay_end":
+            raise ReplayFinishedError
+        if times is not None and speed is not None:
+            index = len(latencies)
+            delay = (times[index] - times[0]) / speed - (time.perf_counter() - start_replay)
+            if delay > 0:
+                time.sleep(delay)
+        start = time.perf_counter()
+        runner.handle_event(event)
+        latencies.append(time.perf_counter() - start)
+
+    if trace_memory:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_replay = time.perf_counter()
+    with contextlib.suppress(ReplayFinishedError):
+        client.call_on_each_event(handle_event, ["message"])
+    elapsed = time.perf_counter() - start_replay
+
+    report: Dict[str, Any] = dict(
+        messages=len(latencies),
+        seconds=round(elapsed, 3),
+        messages_per_second=round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    )
+    latencies.sort()
+    for name, fraction in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)]:
+        report[f"latency_{name}_ms"] = round(percentile(latencies, fraction) * 1000, 3)
+
+    # The event queue's own register/events calls aren't the bot's doing.
+    bot_calls = server.calls - setup_calls
+    for endpoint in ["POST register", "GET events"]:
+        del bot_calls[endpoint]
+    report["api_calls_per_message"] = round(sum(bot_calls.values()) / max(1, len(latencies)), 3)
+    report["api_calls"] = dict(bot_calls.most_common())
+
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS.
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report["max_rss_growth_bytes"] = (rss_after - rss_before) * rss_unit
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report["traced_memory_bytes"] = current
+        report["traced_memory_peak_bytes"] = peak
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    description = """
+        Replays a transcript of messages against a bot, with no Zulip server,
+        and reports its throughput, latency, API calls and memory growth.
+
+        Examples:   %(prog)s helloworld --transcript messages.jsonl
+                    %(prog)s helloworld --synthetic 10000 --content "hello"
+        """
+
+    parser = argparse.ArgumentParser(
+        description=description, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("bot", action="store", help="the name or path an existing bot to run")
+    parser.add_argument(
+        "--bot-config-file",
+        "-b",
+        action="store",
+        help="optional third party config file (e.g. ~/giphy.conf)",
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--transcript", "-t", action="store", help="JSONL file with one message per line"
+    )
+    source.add_argument(
+        "--synthetic", "-n", action="store", type=int, help="replay this many generated messages"
+    )
+    parser.add_argument(
+        "--content",
+        action="append",
+        help="content of the generated messages; may be repeated (default: help)",
+    )
+    parser.add_argument(
+        "--registry", "-r", action="store_true", help="run the bot from the bots registry"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="also measure Python allocations with tracemalloc (slows the bot down)",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    lib_module, bot_name, _ = load_bot_lib_module(args.bot, registry=args.registry)
+
+    server = StubZulipServer([])
+    if args.transcript:
+        with open(args.transcript) as f:
+            events = read_transcript(f)
+    else:
+        events = synthetic_transcript(args.synthetic, args.content or ["help"], server)
+
+    report = replay(lib_module, bot_name, events, args.bot_config_file, server, args.trace_memory)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
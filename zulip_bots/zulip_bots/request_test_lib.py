@@ -6,6 +6,8 @@ from unittest.mock import patch
 import requests
 from requests.utils import get_encoding_from_headers
 
+from zulip_bots.http_session import BotHttpSession
+
 
 @contextmanager
 def mock_http_conversation(http_data: Dict[str, Any]) -> Any:
@@ -63,33 +65,20 @@ def mock_http_conversation(http_data: Dict[str, Any]) -> Any:
     is_raw_response = meta.get("is_raw_response", False)
 
     http_method = http_request.get("method", "GET")
-
+    method_name = http_method.lower() if http_method in ["GET", "PATCH", "PUT"] else "post"
     if http_method == "GET":
-        with patch("requests.get") as mock_get:
-            mock_get.return_value = get_response(http_response, http_headers, is_raw_response)
-            yield
-            assert_called_with_fields(mock_get, http_request, ["params", "headers"], meta)
-    elif http_method == "PATCH":
-        with patch("requests.patch") as mock_patch:
-            mock_patch.return_value = get_response(http_response, http_headers, is_raw_response)
-            yield
-            assert_called_with_fields(
-                mock_patch, http_request, ["params", "headers", "json", "data"], meta
-            )
-    elif http_method == "PUT":
-        with patch("requests.put") as mock_post:
-            mock_post.return_value = get_response(http_response, http_headers, is_raw_response)
-            yield
-            assert_called_with_fields(
-                mock_post, http_request, ["params", "headers", "json", "data"], meta
-            )
+        fields = ["params", "headers"]
     else:
-        with patch("requests.post") as mock_post:
-            mock_post.return_value = get_response(http_response, http_headers, is_raw_response)
-            yield
-            assert_called_with_fields(
-                mock_post, http_request, ["params", "headers", "json", "data"], meta
-            )
+        fields = ["params", "headers", "json", "data"]
+
+    # Bots may call the API through `requests` directly or through their
+    # bot handler's `http` session; both end up in the same mock.
+    with patch(f"requests.{method_name}") as mock_method, patch.object(
+        BotHttpSession, method_name, new=mock_method
+    ):
+        mock_method.return_value = get_response(http_response, http_headers, is_raw_response)
+        yield
+        assert_called_with_fields(mock_method, http_request, fields, meta)
 
 
 @contextmanager
@@ -97,7 +86,7 @@ def mock_request_exception() -> Any:
     def assert_mock_called(mock_result: Any) -> None:
         assert mock_result.called
 
-    with patch("requests.get") as mock_get:
+    with patch("requests.get") as mock_get, patch.object(BotHttpSession, "get", new=mock_get):
         mock_get.return_value = True
         mock_get.side_effect = requests.exceptions.RequestException
         yield
@@ -1,17 +1,24 @@
 #!/usr/bin/env python3
 
 import argparse
+import contextlib
+import json
 import logging
 import os
+import signal
 import sys
-from typing import Optional
+from typing import Any, ContextManager, Dict, Optional, Tuple
 
 from zulip_bots import finder
 from zulip_bots.lib import (
+    HandlerReloader,
     NoBotConfigError,
+    StateSnapshot,
     run_message_handler_for_bot,
     zulip_env_vars_are_present,
 )
+from zulip_bots.multi_runner import BotSpec, read_bot_manifest, run_bots
+from zulip_bots.profiling import make_profiler
 from zulip_bots.provision import provision_bot
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -20,11 +27,14 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 def parse_args() -> argparse.Namespace:
     usage = """
         zulip-run-bot <bot_name> --config-file ~/zuliprc
+        zulip-run-bot --manifest ~/bots.conf
         zulip-run-bot --help
         """
 
     parser = argparse.ArgumentParser(usage=usage)
-    parser.add_argument("bot", action="store", help="the name or path of an existing bot to run")
+    parser.add_argument(
+        "bot", action="store", nargs="?", help="the name or path of an existing bot to run"
+    )
 
     parser.add_argument("--quiet", "-q", action="store_true", help="turn off logging output")
 
@@ -57,7 +67,104 @@ def parse_args() -> argparse.Namespace:
 
     parser.add_argument("--provision", action="store_true", help="install dependencies for the bot")
 
+    parser.add_argument(
+        "--reload",
+        action="store",
+        choices=HandlerReloader.MODES,
+        help="reload the bot's code without restarting, on SIGHUP or when its files change",
+    )
+
+    parser.add_argument(
+        "--slow-threshold",
+        action="store",
+        type=float,
+        help="log messages that take the bot longer than this many seconds, with a stack sample",
+    )
+
+    parser.add_argument(
+        "--profile-dir",
+        action="store",
+        help="profile the bot, writing profiles here; send the process SIGUSR1 to start and "
+        "stop profiling",
+    )
+
+    parser.add_argument(
+        "--ignore-own-messages",
+        action="store_true",
+        help="don't pass the bot messages that it sent itself",
+    )
+
+    parser.add_argument(
+        "--ignore-stream",
+        action="append",
+        dest="ignore_streams",
+        metavar="STREAM",
+        help="don't pass the bot messages sent to this stream; may be repeated",
+    )
+
+    parser.add_argument(
+        "--dedupe-window",
+        action="store",
+        type=int,
+        default=0,
+        metavar="N",
+        help="don't pass the bot a message again if its id was among the last N seen "
+        "(default: off)",
+    )
+
+    parser.add_argument(
+        "--snapshot-dir",
+        metavar="DIR",
+        help="keep a snapshot of the bot's hot state in DIR, to restart faster",
+    )
+
+    parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        default=60,
+        help="seconds between snapshots (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--record-events",
+        metavar="FILE",
+        help="write the events the bot receives to FILE (gzipped JSONL), for --replay-events",
+    )
+
+    parser.add_argument(
+        "--replay-events",
+        metavar="FILE",
+        help="instead of connecting to Zulip, replay the events recorded in FILE "
+        "and report the bot's throughput and latency",
+    )
+
+    parser.add_argument(
+        "--speed",
+        default="max",
+        help="with --replay-events: replay Nx faster than recorded (e.g. 10x), "
+        "or as fast as possible (max, the default)",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        "-m",
+        action="store",
+        help="run all the bots listed in this file in one process, instead of a single bot",
+    )
+
+    parser.add_argument(
+        "--metrics-interval",
+        action="store",
+        type=float,
+        default=60,
+        help="with --manifest, seconds between per-bot metrics reports (default: %(default)s)",
+    )
+
     args = parser.parse_args()
+    if args.bot is None and args.manifest is None:
+        parser.error("either a bot or --manifest is required")
+    if args.reload == "sighup" and not hasattr(signal, "SIGHUP"):
+        parser.error("--reload sighup needs SIGHUP, which this platform lacks; use --reload watch")
     return args
 
 
@@ -111,28 +218,33 @@ def exit_gracefully_if_bot_config_file_does_not_exist(bot_config_file: Optional[
         sys.exit(1)
 
 
-def main() -> None:
-    args = parse_args()
-
-    if args.registry:
+def load_bot_lib_module(
+    bot: str, registry: bool = False, provision: bool = False, force: bool = False
+) -> Tuple[Any, str, str]:
+    """
+    Finds and imports the module of the bot named (or located at) `bot`,
+    returning it along with the bot's name and where it was loaded from.
+    Exits if the bot can't be loaded.
+    """
+    bot_name = bot
+    bot_source = ""
+    if registry:
         try:
-            bot_source, lib_module = finder.import_module_from_zulip_bot_registry(args.bot)
+            bot_source, lib_module = finder.import_module_from_zulip_bot_registry(bot)
         except finder.DuplicateRegisteredBotNameError as error:
             print(
                 f'ERROR: Found duplicate entries for "{error}" in zulip bots registry.\n'
                 "Make sure that you don't install bots using the same entry point. Exiting now."
             )
             sys.exit(1)
-        if lib_module:
-            bot_name = args.bot
     else:
-        result = finder.resolve_bot_path(args.bot)
+        result = finder.resolve_bot_path(bot)
         if result:
             bot_path, bot_name = result
             sys.path.insert(0, os.path.dirname(bot_path))
 
-            if args.provision:
-                provision_bot(os.path.dirname(bot_path), args.force)
+            if provision:
+                provision_bot(os.path.dirname(bot_path), force)
 
             try:
                 lib_module = finder.import_module_from_source(bot_path.as_posix(), bot_name)
@@ -151,11 +263,11 @@ def main() -> None:
                 sys.exit(1)
             bot_source = "source"
         else:
-            lib_module = finder.import_module_by_name(args.bot)
+            lib_module = finder.import_module_by_name(bot)
             if lib_module:
                 bot_name = lib_module.__name__
                 bot_source = "named module"
-                if args.provision:
+                if provision:
                     print("ERROR: Could not load bot's module for '{}'. Exiting now.")
                     sys.exit(1)
 
@@ -163,9 +275,113 @@ def main() -> None:
         print("ERROR: Could not load bot module. Exiting now.")
         sys.exit(1)
 
+    return lib_module, bot_name, bot_source
+
+
+def pipeline_options(args: argparse.Namespace) -> Dict[str, Any]:
+    return dict(
+        ignore_own_messages=args.ignore_own_messages,
+        ignore_streams=args.ignore_streams,
+        dedupe_window=args.dedupe_window,
+    )
+
+
+def replay_events(args: argparse.Namespace, lib_module: Any, bot_name: str) -> None:
+    # zulip_bots.replay imports this module.
+    from zulip_bots.replay import StubZulipServer, parse_speed, read_recorded_events, replay
+
+    try:
+        speed = parse_speed(args.speed)
+    except argparse.ArgumentTypeError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    if not os.path.exists(args.replay_events):
+        print(f"ERROR: {args.replay_events} does not exist.")
+        sys.exit(1)
+    exit_gracefully_if_bot_config_file_does_not_exist(args.bot_config_file)
+
+    events, times, profile = read_recorded_events(args.replay_events)
+    server = None
+    if profile is not None:
+        # Serve the bot as the one that was recorded, e.g. for its mentions.
+        server = StubZulipServer(
+            [], full_name=profile["full_name"], email=profile["email"], user_id=profile["user_id"]
+        )
+    report = replay(
+        lib_module, bot_name, events, args.bot_config_file, server, times=times, speed=speed
+    )
+    print(json.dumps(report, indent=2))
+
+
+def run_bots_from_manifest(args: argparse.Namespace) -> None:
+    if not os.path.exists(args.manifest):
+        print(f"ERROR: {args.manifest} does not exist.")
+        sys.exit(1)
+    manifest = read_bot_manifest(args.manifest)
+
+    bots = []
+    for name, entry in manifest.items():
+        lib_module, bot_name, bot_source = load_bot_lib_module(
+            entry["bot"], registry=entry["registry"] == "true"
+        )
+        config_file = entry["config-file"] or None
+        bot_config_file = entry["bot-config-file"] or None
+        exit_gracefully_if_zulip_config_is_missing(config_file)
+        exit_gracefully_if_bot_config_file_does_not_exist(bot_config_file)
+        bots.append(
+            BotSpec(
+                name=name,
+                lib_module=lib_module,
+                bot_name=bot_name,
+                bot_source=bot_source,
+                config_file=config_file,
+                bot_config_file=bot_config_file,
+            )
+        )
+
     if not args.quiet:
         logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
+    run_bots(
+        bots,
+        quiet=args.quiet,
+        metrics_interval=args.metrics_interval,
+        reload=args.reload,
+        profiler=make_profiler(args.slow_threshold, args.profile_dir),
+        pipeline_options=pipeline_options(args),
+        snapshot_dir=args.snapshot_dir,
+        snapshot_interval=args.snapshot_interval,
+    )
+
+
+def main() -> None:
+    args = parse_args()
+
+    if args.manifest:
+        run_bots_from_manifest(args)
+        return
+
+    lib_module, bot_name, bot_source = load_bot_lib_module(
+        args.bot, registry=args.registry, provision=args.provision, force=args.force
+    )
+
+    if args.replay_events:
+        replay_events(args, lib_module, bot_name)
+        return
+
+    if not args.quiet:
+        logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    recording: ContextManager[Any] = contextlib.nullcontext()
+    if args.record_events:
+        from zulip_bots.replay import record_events
+
+        recording = record_events(args.record_events)
+
+    snapshot = None
+    if args.snapshot_dir:
+        snapshot = StateSnapshot.for_bot(args.snapshot_dir, bot_name, args.snapshot_interval)
+
     # It's a bit unfortunate that we have two config files, but the
     # alternative would be way worse for people running multiple bots
     # or testing against multiple Zulip servers.
@@ -173,14 +389,21 @@ def main() -> None:
     exit_gracefully_if_bot_config_file_does_not_exist(args.bot_config_file)
 
     try:
-        run_message_handler_for_bot(
-            lib_module=lib_module,
-            config_file=args.config_file,
-            bot_config_file=args.bot_config_file,
-            quiet=args.quiet,
-            bot_name=bot_name,
-            bot_source=bot_source,
-        )
+        with recording as recorder:
+            run_message_handler_for_bot(
+                lib_module=lib_module,
+                config_file=args.config_file,
+                bot_config_file=args.bot_config_file,
+                quiet=args.quiet,
+                bot_name=bot_name,
+                bot_source=bot_source,
+                reload=args.reload,
+                profiler=make_profiler(args.slow_threshold, args.profile_dir),
+                pipeline_options=pipeline_options(args),
+                record_event=recorder.record if recorder is not None else None,
+                record_profile=recorder.record_profile if recorder is not None else None,
+                snapshot=snapshot,
+            )
     except NoBotConfigError:
         print(
             """
@@ -0,0 +1,458 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Set, Tuple, Union
+
+from typing_extensions import Protocol
+
+# Pending jobs are saved in the bot's storage, each under this prefix
+# followed by its id.
+JOB_KEY_PREFIX = "__zulip_bots_scheduled_job__:"
+# Changed whenever a process sharing the bot's storage saves its jobs,
+# so that the process running them knows to load them again.
+VERSION_KEY = "__zulip_bots_scheduled_jobs_version__"
+
+JobCallback = Union[str, Callable[[Any], None]]
+
+
+class SchedulerStorage(Protocol):
+    def put(self, key: str, value: Any) -> None:
+        ...
+
+    def get(self, key: str) -> Any:
+        ...
+
+    def remove(self, key: str) -> None:
+        ...
+
+    def contains(self, key: str) -> bool:
+        ...
+
+    def list_keys(self) -> List[str]:
+        ...
+
+    def refresh(self, keys: List[str]) -> List[str]:
+        ...
+
+
+class ScheduledJob:
+    def __init__(
+        self,
+        job_id: str,
+        when: float,
+        callback: JobCallback,
+        data: Any = None,
+        interval: Optional[float] = None,
+    ) -> None:
+        self.job_id = job_id
+        self.when = when
+        self.callback = callback
+        self.data = data
+        self.interval = interval
+
+    def is_persistent(self) -> bool:
+        # Only jobs naming a handler method can be restored after a restart.
+        return isinstance(self.callback, str)
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(when=self.when, callback=self.callback, data=self.data, interval=self.interval)
+
+    @classmethod
+    def from_json(cls, job_id: str, data: Dict[str, Any]) -> "ScheduledJob":
+        return cls(job_id, data["when"], data["callback"], data["data"], data["interval"])
+
+
+def timestamp(when: Union[float, datetime]) -> float:
+    if isinstance(when, datetime):
+        return when.timestamp()
+    return when
+
+
+class Scheduler:
+    """
+    Runs a bot's delayed and periodic jobs, available through
+    `bot_handler.schedule_at`, `bot_handler.schedule_every` and
+    `bot_handler.cancel`:
+
+        def initialize(self, bot_handler):
+            bot_handler.schedule_every(24 * 60 * 60, "send_digest", job_id="digest")
+
+        def send_digest(self, data, bot_handler):
+            ...
+
+    A job's callback is either the name of a method of the bot's message
+    handler, called as `method(data, bot_handler)`, or a function, called
+    as `function(data)`.  Jobs with a method name are saved in the bot's
+    storage, and so survive restarts; jobs with a function are lost when
+    the bot stops.  `data` must be JSON-serializable.
+
+    Scheduling a job with the `job_id` of a pending job replaces it, so
+    that a recurring job scheduled on startup isn't duplicated by the
+    copy restored from storage.
+
+    Pending jobs are kept in a heap, so scheduling a job is O(log n);
+    cancelling one is O(1), since cancelled jobs are only skipped when
+    they come due.  All the jobs run on a single thread, one at a time,
+    started by `start`.  Each saved job has a storage key of its own, so
+    that saving the jobs only writes the ones that changed.
+
+    When several processes run the same bot, such as the workers of a
+    Botserver, only one of them runs the saved jobs; see `start`.
+    """
+
+    def __init__(
+        self,
+        storage: Optional[SchedulerStorage] = None,
+        persist_interval: float = 1.0,
+        clock: Callable[[], float] = time.time,
+        sync_interval: float = 5.0,
+        dispatch: Optional[Callable[[str, Any], None]] = None,
+    ) -> None:
+        self.storage = storage
+        self.persist_interval = persist_interval
+        self.clock = clock
+        self.sync_interval = sync_interval
+        self._jobs: Dict[str, ScheduledJob] = {}
+        # (when, sequence number, job), where the sequence number keeps
+        # jobs due at the same time in the order they were scheduled.
+        self._heap: List[Tuple[float, int, ScheduledJob]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # The ids of the saved jobs that changed since they were saved.
+        self._dirty: Set[str] = set()
+        # The jobs as they are saved in storage, by id.
+        self._saved: Dict[str, Dict[str, Any]] = {}
+        self._last_persist = 0.0
+        self._shared = False
+        self._following = False
+        self._version: Optional[str] = None
+        self._last_sync = 0.0
+        self._dispatch = dispatch
+        self._lock: Optional[ContextManager[Any]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def schedule_at(
+        self,
+        when: Union[float, datetime],
+        callback: JobCallback,
+        data: Any = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        """Runs `callback` once at `when`, a datetime or a Unix timestamp."""
+        return self._add(timestamp(when), callback, data, None, job_id)
+
+    def schedule_every(
+        self,
+        interval: float,
+        callback: JobCallback,
+        data: Any = None,
+        start: Optional[Union[float, datetime]] = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        """
+        Runs `callback` every `interval` seconds, starting at `start`, or
+        `interval` seconds from now.  Runs missed while the bot was busy or
+        stopped are skipped, rather than run back to back.
+        """
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        when = timestamp(start) if start is not None else self.clock() + interval
+        return self._add(when, callback, data, interval, job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a pending job; returns whether there was one.  A process
+        that doesn't run the saved jobs can't tell whether the process
+        running them has the job, and cancels it there in any case.
+        """
+        with self._condition:
+            job = self._jobs.pop(job_id, None)
+            if job is None and not self._following:
+                return False
+            if job is None or job.is_persistent():
+                self._dirty.add(job_id)
+            self._condition.notify()
+            return True
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    def next_run(self) -> Optional[float]:
+        with self._condition:
+            self._discard_cancelled()
+            return self._heap[0][0] if self._heap else None
+
+    def _add(
+        self,
+        when: float,
+        callback: JobCallback,
+        data: Any,
+        interval: Optional[float],
+        job_id: Optional[str],
+    ) -> str:
+        with self._condition:
+            if job_id is None:
+                # Random, so that it can't clash with the ids of saved jobs.
+                job_id = uuid.uuid4().hex
+            job = ScheduledJob(job_id, when, callback, data, interval)
+            replaced = self._jobs.get(job_id)
+            self._jobs[job_id] = job
+            if job.is_persistent() or (replaced is not None and replaced.is_persistent()):
+                self._dirty.add(job_id)
+            # A process that doesn't run the saved jobs only saves them.
+            if not (self._following and job.is_persistent()):
+                self._push(job)
+            self._condition.notify()
+        return job_id
+
+    def _push(self, job: ScheduledJob) -> None:
+        heapq.heappush(self._heap, (job.when, next(self._sequence), job))
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            # Drop the entries of cancelled and replaced jobs, so that a bot
+            # rescheduling the same timeouts over and over doesn't leak.
+            self._heap = [
+                entry for entry in self._heap if self._jobs.get(entry[2].job_id) is entry[2]
+            ]
+            heapq.heapify(self._heap)
+
+    def _discard_cancelled(self) -> None:
+        # A job is live only while it is the one registered under its id.
+        while self._heap and self._jobs.get(self._heap[0][2].job_id) is not self._heap[0][2]:
+            heapq.heappop(self._heap)
+
+    def load(self) -> None:
+        """Restores the jobs saved in storage, unless they were rescheduled since."""
+        storage = self.storage
+        if storage is None:
+            return
+        try:
+            job_keys = [key for key in storage.list_keys() if key.startswith(JOB_KEY_PREFIX)]
+            saved = {key[len(JOB_KEY_PREFIX) :]: storage.get(key) for key in job_keys}
+        except Exception:
+            logging.exception("Could not load the scheduled jobs")
+            return
+        with self._condition:
+            for job_id, job_data in saved.items():
+                # Changed here since; saved again on the next persist.
+                if job_id in self._dirty:
+                    continue
+                if job_id in self._jobs and self._saved.get(job_id) == job_data:
+                    continue
+                job = ScheduledJob.from_json(job_id, job_data)
+                self._jobs[job_id] = job
+                if not self._following:
+                    self._push(job)
+                self._saved[job_id] = job_data
+            # Cancelled, or run, by another process.
+            for job_id in [job_id for job_id in self._saved if job_id not in saved]:
+                del self._saved[job_id]
+                local_job = self._jobs.get(job_id)
+                if (
+                    job_id not in self._dirty
+                    and local_job is not None
+                    and local_job.is_persistent()
+                ):
+                    del self._jobs[job_id]
+            self._condition.notify()
+
+    def sync(self, force: bool = False) -> None:
+        """Loads the saved jobs again, if another process saved some since."""
+        storage = self.storage
+        if storage is None:
+            return
+        self._last_sync = time.monotonic()
+        try:
+            storage.refresh([VERSION_KEY])
+            # Missing until a process first saves its jobs.
+            version = storage.get(VERSION_KEY) if storage.contains(VERSION_KEY) else None
+        except Exception:
+            logging.exception("Could not check for new scheduled jobs")
+            if not force:
+                return
+            version = None
+        if force or version != self._version:
+            self._version = version
+            self.load()
+
+    def persist(self) -> None:
+        """Saves the jobs that changed since the last save."""
+        with self._condition:
+            storage = self.storage
+            if storage is None or not self._dirty:
+                self._dirty.clear()
+                return
+            changes: Dict[str, Optional[ScheduledJob]] = {}
+            for job_id in self._dirty:
+                job = self._jobs.get(job_id)
+                changes[job_id] = job if job is not None and job.is_persistent() else None
+            saved = {job_id: job.to_json() for job_id, job in changes.items() if job is not None}
+            removed = [
+                job_id
+                for job_id, job in changes.items()
+                if job is None and (job_id in self._saved or self._following)
+            ]
+            self._dirty.clear()
+            self._last_persist = time.monotonic()
+            following = self._following
+
+        failed = set()
+        for job_id, job_data in saved.items():
+            try:
+                storage.put(JOB_KEY_PREFIX + job_id, job_data)
+            except Exception:
+                failed.add(job_id)
+        for job_id in removed:
+            try:
+                storage.remove(JOB_KEY_PREFIX + job_id)
+            except Exception:
+                failed.add(job_id)
+        if failed:
+            logging.error("Could not save %d scheduled jobs; retrying later", len(failed))
+        if following and len(failed) < len(saved) + len(removed):
+            # Tells the process running the jobs to load them again.
+            try:
+                storage.put(VERSION_KEY, uuid.uuid4().hex)
+            except Exception:
+                logging.exception("Could not save the scheduled jobs' version")
+
+        with self._condition:
+            for job_id, job in changes.items():
+                if job_id in failed:
+                    self._dirty.add(job_id)
+                elif job is None:
+                    self._saved.pop(job_id, None)
+                else:
+                    self._saved[job_id] = saved[job_id]
+                    if self._following and self._jobs.get(job_id) is job:
+                        # Run by another process, which loads it from storage.
+                        del self._jobs[job_id]
+
+    def run_pending(self, now: Optional[float] = None) -> int:
+        """Runs the jobs due at `now`, and returns how many ran."""
+        if now is None:
+            now = self.clock()
+        count = 0
+        while True:
+            with self._condition:
+                self._discard_cancelled()
+                if not self._heap or self._heap[0][0] > now:
+                    return count
+                _, _, job = heapq.heappop(self._heap)
+                if job.interval is not None:
+                    # Skip the runs that were missed, rather than catching up.
+                    job.when += job.interval * (int((now - job.when) // job.interval) + 1)
+                    self._push(job)
+                else:
+                    del self._jobs[job.job_id]
+                if job.is_persistent():
+                    self._dirty.add(job.job_id)
+            self._run(job)
+            count += 1
+
+    def _run(self, job: ScheduledJob) -> None:
+        lock = self._lock if self._lock is not None else nullcontext()
+        try:
+            with lock:
+                if callable(job.callback):
+                    job.callback(job.data)
+                elif self._dispatch is not None:
+                    self._dispatch(job.callback, job.data)
+                else:
+                    logging.error("No handler to run scheduled job %s", job.job_id)
+        except Exception:
+            logging.exception("Scheduled job %s failed", job.job_id)
+
+    def start(
+        self,
+        dispatch: Optional[Callable[[str, Any], None]] = None,
+        lock: Optional[ContextManager[Any]] = None,
+        shared: bool = False,
+        run_saved_jobs: bool = True,
+    ) -> None:
+        """
+        Restores the saved jobs and starts running jobs as they come due.
+        Jobs naming a method are run through `dispatch`, or the one given
+        to the constructor; all jobs run while holding `lock`, if given, so
+        that they don't run concurrently with the bot's message handling.
+
+        `shared` means that other processes run the same bot, with the
+        same storage; only one of them should run the saved jobs.  The
+        others pass `run_saved_jobs=False`: they save the jobs naming a
+        method for it, and only run the ones with a function, until
+        `lead` is called.  The process running the saved jobs loads them
+        again every `sync_interval` seconds, if another process saved some.
+        """
+        if dispatch is not None:
+            self._dispatch = dispatch
+        self._lock = lock
+        with self._condition:
+            self._shared = shared
+            self._following = not run_saved_jobs
+        if run_saved_jobs and shared:
+            self.sync(force=True)
+        elif run_saved_jobs:
+            self.load()
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name="bot-scheduler", daemon=True)
+            self._thread.start()
+
+    def lead(self) -> None:
+        """Starts running the saved jobs, e.g. once the process that did has exited."""
+        with self._condition:
+            if not self._following:
+                return
+            self._following = False
+            # The jobs naming a method that weren't saved yet are still here.
+            for job in self._jobs.values():
+                if job.is_persistent():
+                    self._push(job)
+        self.sync(force=True)
+
+    def stop(self) -> None:
+        """Stops the scheduler thread, and saves the pending jobs."""
+        with self._condition:
+            thread = self._thread
+            self._stopping = True
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
+        self._thread = None
+        self.persist()
+
+    def _loop(self) -> None:
+        while True:
+            with self._condition:
+                self._discard_cancelled()
+                timeout = None
+                if self._heap:
+                    timeout = max(0.0, self._heap[0][0] - self.clock())
+                if self._dirty:
+                    persist_in = self._last_persist + self.persist_interval - time.monotonic()
+                    timeout = max(0.0, persist_in if timeout is None else min(timeout, persist_in))
+                syncing = self._shared and not self._following
+                if syncing:
+                    sync_in = self._last_sync + self.sync_interval - time.monotonic()
+                    timeout = max(0.0, sync_in if timeout is None else min(timeout, sync_in))
+                if not self._stopping and (timeout is None or timeout > 0):
+                    self._condition.wait(timeout)
+                stopping = self._stopping
+            if stopping:
+                return
+            self.run_pending()
+            if time.monotonic() - self._last_persist >= self.persist_interval:
+                self.persist()
+            if syncing and time.monotonic() - self._last_sync >= self.sync_interval:
+                self.sync()
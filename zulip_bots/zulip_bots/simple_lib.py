@@ -1,9 +1,12 @@
 import configparser
 import sys
-from typing import IO, Any, Dict, Optional
+from datetime import datetime
+from typing import IO, Any, Dict, List, Optional, Union
 from uuid import uuid4
 
+from zulip_bots.http_session import BotHttpSession
 from zulip_bots.lib import BotIdentity
+from zulip_bots.scheduler import JobCallback, Scheduler
 
 
 class SimpleStorage:
@@ -19,6 +22,15 @@ class SimpleStorage:
     def get(self, key: str) -> Any:
         return self.data[key]
 
+    def remove(self, key: str) -> None:
+        self.data.pop(key, None)
+
+    def list_keys(self) -> List[str]:
+        return list(self.data)
+
+    def refresh(self, keys: List[str]) -> List[str]:
+        return []
+
 
 class MockMessageServer:
     # This class is needed for the incrementor bot, which
@@ -48,6 +60,8 @@ class TerminalBotHandler:
         self.bot_config_file = bot_config_file
         self._storage = SimpleStorage()
         self.message_server = message_server
+        self.http = BotHttpSession()
+        self.scheduler = Scheduler(self._storage)
 
     @property
     def storage(self) -> SimpleStorage:
@@ -112,6 +126,31 @@ class TerminalBotHandler:
             """.format(message["message_id"], message["content"])
         )
 
+    def update_message_debounced(self, message: Dict[str, Any], final: bool = False) -> None:
+        self.update_message(message)
+
+    def schedule_at(
+        self,
+        when: Union[float, datetime],
+        callback: JobCallback,
+        data: Any = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        return self.scheduler.schedule_at(when, callback, data, job_id)
+
+    def schedule_every(
+        self,
+        interval: float,
+        callback: JobCallback,
+        data: Any = None,
+        start: Optional[Union[float, datetime]] = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        return self.scheduler.schedule_every(interval, callback, data, start, job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        return self.scheduler.cancel(job_id)
+
     def upload_file_from_path(self, file_path: str) -> Dict[str, Any]:
         with open(file_path) as file:
             return self.upload_file(file)
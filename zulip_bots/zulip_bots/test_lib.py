@@ -1,9 +1,12 @@
 import unittest
-from typing import IO, Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
 
 from zulip_bots.custom_exceptions import ConfigValidationError
+from zulip_bots.http_session import BotHttpSession
 from zulip_bots.lib import BotIdentity
 from zulip_bots.request_test_lib import mock_http_conversation, mock_request_exception
+from zulip_bots.scheduler import JobCallback, Scheduler
 from zulip_bots.simple_lib import MockMessageServer, SimpleStorage
 from zulip_bots.test_file_utils import get_bot_message_handler, read_bot_fixture_data
 
@@ -15,6 +18,8 @@ class StubBotHandler:
         self.email = "test-bot@example.com"
         self.user_id = 0
         self.message_server = MockMessageServer()
+        self.http = BotHttpSession()
+        self.scheduler = Scheduler(self.storage)
         self.reset_transcript()
 
     def reset_transcript(self) -> None:
@@ -40,6 +45,31 @@ class StubBotHandler:
     def update_message(self, message: Dict[str, Any]) -> None:
         self.message_server.update(message)
 
+    def update_message_debounced(self, message: Dict[str, Any], final: bool = False) -> None:
+        self.update_message(message)
+
+    def schedule_at(
+        self,
+        when: Union[float, datetime],
+        callback: JobCallback,
+        data: Any = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        return self.scheduler.schedule_at(when, callback, data, job_id)
+
+    def schedule_every(
+        self,
+        interval: float,
+        callback: JobCallback,
+        data: Any = None,
+        start: Optional[Union[float, datetime]] = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        return self.scheduler.schedule_every(interval, callback, data, start, job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        return self.scheduler.cancel(job_id)
+
     def upload_file_from_path(self, file_path: str) -> Dict[str, Any]:
         with open(file_path, "rb") as file:
             return self.message_server.upload_file(file)
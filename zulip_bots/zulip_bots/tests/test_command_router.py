@@ -0,0 +1,104 @@
+import re
+from typing import Any, Dict, List, Tuple
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from zulip_bots.command_router import CommandRouter, Dispatch
+
+
+def is_moderator(bot: "FakeModerationBot", message: Dict[str, Any], bot_handler: Any) -> bool:
+    return message["sender_email"] in bot.moderators
+
+
+class FakeModerationBot:
+    router = CommandRouter()
+
+    def __init__(self) -> None:
+        self.moderators = ["mod@example.com"]
+        self.calls: List[Tuple[Any, ...]] = []
+
+    @router.command(r"resolve", help="Mark the current topic as resolved.", group="User Commands")
+    def resolve(self, message: Dict[str, Any], bot_handler: Any) -> None:
+        self.calls.append(("resolve",))
+
+    @router.command(
+        r"purge\s+(\d+)",
+        syntax="purge <N>",
+        help="Delete the last N messages.",
+        group="Moderation Commands",
+        permission=is_moderator,
+    )
+    def purge(self, message: Dict[str, Any], bot_handler: Any, count: str) -> None:
+        self.calls.append(("purge", count))
+
+    @router.command(
+        r"purge\s+(\S+@\S+)\s+(\d+)",
+        syntax="purge <email> <N>",
+        help="Delete the last N messages from a user.",
+        group="Moderation Commands",
+        permission=is_moderator,
+    )
+    def purge_user(self, message: Dict[str, Any], bot_handler: Any, email: str, count: str) -> None:
+        self.calls.append(("purge_user", email, count))
+
+
+class CommandRouterTest(TestCase):
+    def make_message(self, content: str, sender_email: str = "mod@example.com") -> Dict[str, Any]:
+        return dict(content=content, sender_email=sender_email)
+
+    def test_dispatch_passes_groups_to_the_matching_command(self) -> None:
+        bot = FakeModerationBot()
+        bot_handler = MagicMock()
+        for content in ["resolve", "  purge 5 ", "purge bob@example.com 3"]:
+            result = bot.router.dispatch(self.make_message(content), bot_handler, owner=bot)
+            self.assertEqual(result, Dispatch.HANDLED)
+        self.assertEqual(
+            bot.calls, [("resolve",), ("purge", "5"), ("purge_user", "bob@example.com", "3")]
+        )
+
+    def test_dispatch_requires_a_full_match(self) -> None:
+        bot = FakeModerationBot()
+        for content in ["resolved", "please resolve", "purge five"]:
+            result = bot.router.dispatch(self.make_message(content), MagicMock(), owner=bot)
+            self.assertEqual(result, Dispatch.UNKNOWN)
+        self.assertEqual(bot.calls, [])
+
+    def test_dispatch_checks_permissions(self) -> None:
+        bot = FakeModerationBot()
+        message = self.make_message("purge 5", sender_email="user@example.com")
+        self.assertEqual(bot.router.dispatch(message, MagicMock(), owner=bot), Dispatch.DENIED)
+        self.assertEqual(bot.calls, [])
+
+        message = self.make_message("resolve", sender_email="user@example.com")
+        self.assertEqual(bot.router.dispatch(message, MagicMock(), owner=bot), Dispatch.HANDLED)
+
+    def test_plain_functions_and_flags(self) -> None:
+        router = CommandRouter(flags=re.IGNORECASE)
+        handler = MagicMock()
+        router.add_command(r"start game with (.+)", handler)
+        bot_handler = MagicMock()
+        message = dict(content="Start Game with @**Alice**")
+
+        self.assertEqual(router.dispatch(message, bot_handler), Dispatch.HANDLED)
+        handler.assert_called_once_with(message, bot_handler, "@**Alice**")
+
+    def test_help_text(self) -> None:
+        bot = FakeModerationBot()
+        moderator_help = bot.router.help_text(
+            self.make_message("help"), MagicMock(), owner=bot, prefix="@bot "
+        )
+        self.assertEqual(
+            moderator_help,
+            "**User Commands:**\n"
+            "- `@bot resolve`: Mark the current topic as resolved.\n\n"
+            "**Moderation Commands:**\n"
+            "- `@bot purge <N>`: Delete the last N messages.\n"
+            "- `@bot purge <email> <N>`: Delete the last N messages from a user.",
+        )
+
+        user_help = bot.router.help_text(
+            self.make_message("help", sender_email="user@example.com"), MagicMock(), owner=bot
+        )
+        self.assertEqual(
+            user_help, "**User Commands:**\n- `resolve`: Mark the current topic as resolved."
+        )
@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Tuple
+from unittest import TestCase
+
+from typing_extensions import override
+
+from zulip_bots.conversation_cache import ConversationCache, conversation_key
+from zulip_bots.simple_lib import SimpleStorage
+
+
+class ConversationCacheTest(TestCase):
+    @override
+    def setUp(self) -> None:
+        self.now = 0.0
+
+    def _clock(self) -> float:
+        return self.now
+
+    def test_conversation_key(self) -> None:
+        stream_message: Dict[str, Any] = dict(
+            type="stream", stream_id=3, display_recipient="games", subject="chess"
+        )
+        self.assertEqual(conversation_key(stream_message), "stream:3:chess")
+        direct_message: Dict[str, Any] = dict(
+            type="private", display_recipient=[dict(id=9), dict(id=10)]
+        )
+        self.assertEqual(conversation_key(direct_message), "dm:10,9")
+
+    def test_lru_eviction_spills_to_storage(self) -> None:
+        storage = SimpleStorage()
+        cache = ConversationCache(storage, max_entries=2, clock=self._clock)
+        cache.set("a", {"turn": 1})
+        cache.set("b", {"turn": 2})
+        cache.get("a")
+        cache.set("c", {"turn": 3})
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(storage.get("conversation:b"), {"turn": 2})
+        # "b" is reloaded from storage when it comes up again, evicting "a".
+        self.assertEqual(cache.get("b"), {"turn": 2})
+        self.assertEqual(storage.get("conversation:a"), {"turn": 1})
+        self.assertEqual(cache.get("unknown", {}), {})
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["reloads"]), (1, 2, 1))
+        self.assertEqual(stats["evictions"], 2)
+
+    def test_ttl_and_memory_limits(self) -> None:
+        evicted: List[Tuple[str, Any]] = []
+        cache = ConversationCache(
+            max_bytes=30,
+            ttl=60,
+            on_evict=lambda key, value: evicted.append((key, value)),
+            clock=self._clock,
+        )
+        cache.set("a", "x" * 10)
+        self.now = 30
+        cache.set("b", "y" * 10)
+        self.assertEqual(cache.stats()["bytes"], 24)
+
+        self.now = 70
+        self.assertEqual(cache.get("b"), "y" * 10)
+        self.assertEqual(evicted, [("a", "x" * 10)])
+
+        cache.set("c", "z" * 20)
+        self.assertEqual(evicted[-1], ("b", "y" * 10))
+        self.assertEqual(cache.stats()["bytes"], 22)
+
+    def test_delete_and_flush(self) -> None:
+        storage = SimpleStorage()
+        cache = ConversationCache(storage, clock=self._clock)
+        cache.set("a", [1])
+        cache.set("b", [2])
+        cache.delete("a")
+        cache.flush()
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()["bytes"], 0)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), [2])
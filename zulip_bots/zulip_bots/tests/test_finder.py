@@ -1,5 +1,10 @@
+import os
+import tempfile
 from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
+
+import importlib_metadata as metadata
 
 from zulip_bots import finder
 
@@ -12,3 +17,34 @@ class FinderTestCase(TestCase):
         expected_bot_path_and_name = (expected_bot_path, expected_bot_name)
         actual_bot_path_and_name = finder.resolve_bot_path("helloworld")
         self.assertEqual(expected_bot_path_and_name, actual_bot_path_and_name)
+
+    def test_registry_index_is_built_once(self) -> None:
+        entry_point = metadata.EntryPoint("packaged_bot", "packaged_bot.bot", finder.REGISTRY_GROUP)
+        index = finder.RegistryIndex()
+        with patch(
+            "zulip_bots.finder.metadata.entry_points", return_value=(entry_point,)
+        ) as mock_entry_points:
+            self.assertEqual(index.lookup("packaged_bot"), [entry_point])
+            self.assertEqual(index.lookup("other_bot"), [])
+        mock_entry_points.assert_called_once_with(group=finder.REGISTRY_GROUP)
+
+    def test_registry_index_cache_file(self) -> None:
+        entry_point = metadata.EntryPoint("packaged_bot", "packaged_bot.bot", finder.REGISTRY_GROUP)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_file = os.path.join(tmp_dir, "registry.json")
+            dist_info = os.path.join(tmp_dir, "packaged_bot-1.0.dist-info")
+            os.mkdir(dist_info)
+            with patch("sys.path", [tmp_dir]), patch(
+                "zulip_bots.finder.metadata.entry_points", return_value=(entry_point,)
+            ) as mock_entry_points:
+                finder.RegistryIndex(cache_file).lookup("packaged_bot")
+                # A new process reuses the saved index...
+                self.assertEqual(
+                    finder.RegistryIndex(cache_file).lookup("packaged_bot"), [entry_point]
+                )
+                self.assertEqual(mock_entry_points.call_count, 1)
+
+                # ...until a package changes.
+                os.utime(dist_info, ns=(0, 0))
+                finder.RegistryIndex(cache_file).lookup("packaged_bot")
+                self.assertEqual(mock_entry_points.call_count, 2)
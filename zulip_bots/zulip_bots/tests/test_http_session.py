@@ -0,0 +1,133 @@
+import tempfile
+from typing import Any, Dict, List
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+
+from zulip_bots.http_session import (
+    DEFAULT_TIMEOUT,
+    BotHttpSession,
+    CachedResponse,
+    DiskCache,
+    LRUCache,
+)
+from zulip_bots.profiling import Profiler
+from zulip_bots.request_test_lib import mock_http_conversation
+
+
+def make_response(status_code: int, headers: Dict[str, str], content: bytes = b"") -> Any:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    response._content = content  # noqa: SLF001
+    response.url = "https://example.com/api?q=1"
+    return response
+
+
+class BotHttpSessionTest(TestCase):
+    def _send(self, session: BotHttpSession, responses: List[Any]) -> Any:
+        return patch.object(requests.Session, "request", side_effect=responses)
+
+    def test_default_timeout(self) -> None:
+        session = BotHttpSession()
+        with self._send(session, [make_response(200, {})]) as request:
+            session.post("https://example.com/api", json={})
+        self.assertEqual(request.call_args[1]["timeout"], DEFAULT_TIMEOUT)
+
+        with self._send(session, [make_response(200, {})]) as request:
+            session.post("https://example.com/api", json={}, timeout=1)
+        self.assertEqual(request.call_args[1]["timeout"], 1)
+
+    def test_requests_are_counted_for_the_profiler(self) -> None:
+        session = BotHttpSession()
+        profiler = Profiler()
+        with self._send(session, [make_response(200, {})] * 2):
+            with profiler.message("helloworld", dict(id=1)) as record:
+                session.get("https://example.com/api", params={"key": "secret"})
+                session.post("https://example.com/api")
+        self.assertEqual(dict(record.http_calls), {"GET example.com": 1, "POST example.com": 1})
+
+    def test_fresh_responses_are_served_from_the_cache(self) -> None:
+        session = BotHttpSession(cache=LRUCache())
+        fresh = make_response(200, {"Cache-Control": "max-age=60"}, b"hello")
+        with self._send(session, [fresh]) as request:
+            for _ in range(3):
+                response = session.get("https://example.com/api", params={"q": "1"})
+                self.assertEqual(response.content, b"hello")
+        self.assertEqual(request.call_count, 1)
+
+    def test_stale_responses_are_revalidated(self) -> None:
+        session = BotHttpSession(cache=LRUCache())
+        stale = make_response(200, {"ETag": '"v1"', "Cache-Control": "no-cache"}, b"hello")
+        not_modified = make_response(304, {"ETag": '"v1"'})
+        with self._send(session, [stale, not_modified]) as request:
+            session.get("https://example.com/api", params={"q": "1"})
+            response = session.get("https://example.com/api", params={"q": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"hello")
+        self.assertEqual(request.call_args[1]["headers"], {"If-None-Match": '"v1"'})
+
+    def test_uncacheable_responses(self) -> None:
+        session = BotHttpSession(cache=LRUCache())
+        responses = [
+            make_response(200, {"Cache-Control": "no-store"}),
+            make_response(200, {}),
+            make_response(500, {"Cache-Control": "max-age=60"}),
+            make_response(200, {}),
+        ]
+        with self._send(session, responses) as request:
+            for _ in responses:
+                session.get("https://example.com/api")
+        self.assertEqual(request.call_count, 4)
+
+    def test_responses_are_only_served_to_matching_requests(self) -> None:
+        session = BotHttpSession(cache=LRUCache())
+        english = make_response(200, {"Cache-Control": "max-age=60", "Vary": "Accept-Language"})
+        german = make_response(200, {"Cache-Control": "max-age=60", "Vary": "Accept-Language"})
+        with self._send(session, [english, german]) as request:
+            session.get("https://example.com/api", headers={"Accept-Language": "en"})
+            session.get("https://example.com/api", headers={"Accept-Language": "en"})
+            session.get("https://example.com/api", headers={"Accept-Language": "de"})
+        self.assertEqual(request.call_count, 2)
+
+    def test_requests_with_credentials_are_not_cached(self) -> None:
+        cache = LRUCache()
+        session = BotHttpSession(cache=cache)
+        responses = [make_response(200, {"Cache-Control": "max-age=60"}) for _ in range(3)]
+        with self._send(session, responses) as request:
+            session.get("https://example.com/api", headers={"Authorization": "Bearer alice"})
+            session.get("https://example.com/api", auth=("bob", "secret"))
+            session.get("https://example.com/api", cookies={"session": "carol"})
+        self.assertEqual(request.call_count, 3)
+        self.assertIsNone(cache.get("https://example.com/api"))
+
+    def test_lru_cache_evicts_least_recently_used(self) -> None:
+        cache = LRUCache(max_entries=2)
+        entry = CachedResponse("https://example.com", 200, {}, b"", 0)
+        cache.set("a", entry)
+        cache.set("b", entry)
+        cache.get("a")
+        cache.set("c", entry)
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+    def test_disk_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            entry = CachedResponse("https://example.com", 200, {"ETag": "x"}, b"\x00hi", 42.0)
+            DiskCache(directory).set("key", entry)
+            loaded = DiskCache(directory).get("key")
+            assert loaded is not None
+            self.assertEqual(loaded.to_json(), entry.to_json())
+            DiskCache(directory).delete("key")
+            self.assertIsNone(DiskCache(directory).get("key"))
+
+    def test_mock_http_conversation_covers_the_session(self) -> None:
+        http_data = {
+            "request": {"api_url": "https://example.com/api", "params": {"q": "1"}},
+            "response": {"answer": 42},
+            "response-headers": {"content-type": "application/json"},
+        }
+        with mock_http_conversation(http_data):
+            response = BotHttpSession().get("https://example.com/api", params={"q": "1"})
+        self.assertEqual(response.json(), {"answer": 42})
@@ -1,17 +1,31 @@
+import configparser
 import io
+import os
+import tempfile
+import threading
+import time
 from typing import IO, Any, Callable, Dict, List, Optional, Set, Tuple, cast
 from unittest import TestCase
 from unittest.mock import ANY, MagicMock, create_autospec, patch
 
 from zulip import Client
+from zulip_bots.finder import import_module_from_source
 from zulip_bots.lib import (
     AbstractBotHandler,
+    BotRunner,
+    EditDebouncer,
     ExternalBotHandler,
+    MessagePipeline,
+    OutboundScheduler,
+    RateLimit,
     StateHandler,
+    StateSnapshot,
     extract_query_without_mention,
     is_private_message_but_not_group_pm,
     run_message_handler_for_bot,
 )
+from zulip_bots.replay import StubClient, StubZulipServer
+from zulip_bots.scheduler import Scheduler
 
 
 class FakeClient:
@@ -84,6 +98,22 @@ class LibTest(TestCase):
         val = state_handler.get("key")
         self.assertEqual(val, [1, 2, 3])
 
+    def test_state_handler_refresh_with_a_removed_key(self) -> None:
+        server = StubZulipServer([])
+        state_handler = StateHandler(StubClient(server))
+        state_handler.put("kept", 1)
+        state_handler.put("removed", 2)
+
+        # Another process changes one key and removes the other.
+        server.storage["kept"] = "3"
+        del server.storage["removed"]
+        self.assertEqual(state_handler.refresh(["kept", "removed"]), ["kept", "removed"])
+        self.assertEqual(state_handler.get("kept"), 3)
+        self.assertFalse(state_handler.contains("removed"))
+
+        state_handler.remove("kept")
+        self.assertEqual(server.storage, {})
+
     def test_state_handler_by_mock(self) -> None:
         client = MagicMock()
 
@@ -160,6 +190,34 @@ class LibTest(TestCase):
                 dict(test[1], content=response_text, widget_content=test[2])
             )
 
+    def test_capture_reply(self) -> None:
+        client = cast(Client, FakeClient())
+        handler = ExternalBotHandler(
+            client=client, root_dir=None, bot_details=None, bot_config_file=None
+        )
+        message = {"type": "stream", "display_recipient": "Stream name", "subject": "Topic"}
+        other_message = dict(message, subject="Other topic")
+        client.send_message = MagicMock()  # type: ignore[method-assign]
+
+        with handler.capture_reply(message) as inline_reply:
+            handler.send_reply(other_message, "elsewhere")
+            handler.send_reply(message, "reply", "widget")
+        self.assertTrue(inline_reply.captured)
+        self.assertEqual(inline_reply.response(), dict(content="reply", widget_content="widget"))
+        self.assertEqual(client.send_message.call_count, 1)
+
+        # A second reply sends both through the API, in order.
+        client.send_message.reset_mock()
+        with handler.capture_reply(message) as inline_reply:
+            handler.send_reply(message, "first")
+            handler.send_reply(message, "second")
+            handler.send_reply(message, "third")
+        self.assertFalse(inline_reply.captured)
+        self.assertEqual(
+            [call[0][0]["content"] for call in client.send_message.call_args_list],
+            ["first", "second", "third"],
+        )
+
     def test_content_and_full_content(self) -> None:
         client = cast(Client, FakeClient())
         client.get_profile()
@@ -208,6 +266,105 @@ class LibTest(TestCase):
                 bot_source="bot code location",
             )
 
+    def test_reload_handler(self) -> None:
+        handler_code = """
+class CounterHandler:
+    version = {version}
+
+    def initialize(self, bot_handler):
+        self.count = 0
+
+    def handle_reload(self, previous_handler, bot_handler):
+        self.count = previous_handler.count
+
+    def handle_message(self, message, bot_handler):
+        self.count += 1
+
+handler_class = CounterHandler
+"""
+        with tempfile.TemporaryDirectory() as bot_dir:
+            bot_path = os.path.join(bot_dir, "counter.py")
+            with open(bot_path, "w") as f:
+                f.write(handler_code.format(version=1))
+            lib_module = import_module_from_source(bot_path, "counter")
+            runner = BotRunner(
+                lib_module, cast(Client, FakeClient()), None, "counter", "source", quiet=True
+            )
+            recipients = [dict(email="alice@example.com"), dict(email="bob@example.com")]
+            message = dict(content="hi", type="private", sender_id=7, display_recipient=recipients)
+            event = dict(type="message", flags=[], message=message)
+            runner.handle_event(event)
+            self.assertFalse(runner.source_changed())
+
+            with open(bot_path, "w") as f:
+                f.write(handler_code.format(version=2))
+            os.utime(bot_path, ns=(0, 0))
+            self.assertTrue(runner.source_changed())
+            self.assertTrue(runner.reload_handler())
+            self.assertFalse(runner.source_changed())
+            runner.handle_event(event)
+
+            self.assertEqual(runner.message_handler.version, 2)
+            self.assertEqual(runner.message_handler.count, 2)
+
+            # A broken deploy leaves the running version in place.
+            with open(bot_path, "w") as f:
+                f.write("this is not python")
+            with self.assertLogs(level="ERROR"):
+                self.assertFalse(runner.reload_handler())
+            self.assertEqual(runner.message_handler.version, 2)
+
+    def test_snapshot_warm_start(self) -> None:
+        handler_code = """
+class SnapshotHandler:
+    snapshot_attributes = ["seen"]
+    snapshot_storage_keys = ["greeting"]
+
+    def initialize(self, bot_handler):
+        self.greeting = bot_handler.storage.get("greeting")
+        self.seen = []
+        self.reconciled = None
+
+    def reconcile_snapshot(self, changed_keys, bot_handler):
+        self.reconciled = changed_keys
+        self.greeting = bot_handler.storage.get("greeting")
+
+    def handle_message(self, message, bot_handler):
+        self.seen.append(message["content"])
+
+handler_class = SnapshotHandler
+"""
+        with tempfile.TemporaryDirectory() as bot_dir:
+            bot_path = os.path.join(bot_dir, "snapshot.py")
+            with open(bot_path, "w") as f:
+                f.write(handler_code)
+            lib_module = import_module_from_source(bot_path, "snapshot")
+            snapshot = StateSnapshot.for_bot(os.path.join(bot_dir, "snapshots"), "snapshot")
+
+            client = FakeClient()
+            client.storage["greeting"] = '"hello"'
+            runner = BotRunner(
+                lib_module, cast(Client, client), None, "snapshot", "source", snapshot=snapshot
+            )
+            recipients = [dict(email="alice@example.com"), dict(email="bob@example.com")]
+            message = dict(content="hi", type="private", sender_id=7, display_recipient=recipients)
+            runner.handle_event(dict(type="message", flags=[], message=message))
+            runner.write_snapshot()
+
+            # The storage changed on the server since the snapshot was written.
+            client = FakeClient()
+            client.storage["greeting"] = '"bonjour"'
+            with patch.object(threading.Thread, "start"):
+                runner = BotRunner(
+                    lib_module, cast(Client, client), None, "snapshot", "source", snapshot=snapshot
+                )
+            self.assertEqual(runner.message_handler.seen, ["hi"])
+            self.assertEqual(runner.message_handler.greeting, "hello")
+
+            runner.reconcile_snapshot(["greeting"])
+            self.assertEqual(runner.message_handler.reconciled, ["greeting"])
+            self.assertEqual(runner.message_handler.greeting, "bonjour")
+
     def test_upload_file(self) -> None:
         client, handler = self._create_client_and_handler_for_file_upload()
         file = io.BytesIO(b"binary")
@@ -257,6 +414,268 @@ class LibTest(TestCase):
         message["display_recipient"] = [{"email": "a1@b.com"}, {"email": "a2@b.com"}]
         self.assertFalse(is_private_message_but_not_group_pm(message, handler))
 
+    def test_get_config_info_is_cached_until_file_changes(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file = os.path.join(tmp_dir, "testbot.conf")
+            with open(config_file, "w") as f:
+                f.write("[testbot]\nkey = old\n")
+            handler = ExternalBotHandler(
+                client=cast(Client, FakeClient()),
+                root_dir=None,
+                bot_details=None,
+                bot_config_file=config_file,
+            )
+            callback = MagicMock()
+            handler.on_config_reload(callback)
+
+            with patch("configparser.ConfigParser", wraps=configparser.ConfigParser) as parser:
+                self.assertFalse(handler.reload_config_if_changed())
+                handler.get_config_info("testbot")
+                handler.get_config_info("testbot")
+            parser.assert_called_once_with()
+
+            self.assertEqual(handler.get_config_info("testbot"), {"key": "old"})
+            self.assertFalse(handler.reload_config_if_changed())
+            callback.assert_not_called()
+
+            with open(config_file, "w") as f:
+                f.write("[testbot]\nkey = rotated\n")
+            stat = os.stat(config_file)
+            os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+            self.assertTrue(handler.reload_config_if_changed())
+            callback.assert_called_once_with()
+            self.assertEqual(handler.get_config_info("testbot"), {"key": "rotated"})
+
+            # A broken file doesn't replace the last good config.
+            with open(config_file, "w") as f:
+                f.write("key = broken\n")
+            os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+            with patch("logging.error"):
+                self.assertFalse(handler.reload_config_if_changed())
+            self.assertEqual(handler.get_config_info("testbot"), {"key": "rotated"})
+
+            # Nor does a missing one; the error is logged once.
+            os.remove(config_file)
+            with patch("logging.error") as error:
+                self.assertFalse(handler.reload_config_if_changed())
+                self.assertEqual(handler.get_config_info("testbot"), {"key": "rotated"})
+            error.assert_called_once()
+
+            with open(config_file, "w") as f:
+                f.write("[testbot]\nkey = restored\n")
+            self.assertTrue(handler.reload_config_if_changed())
+            self.assertEqual(handler.get_config_info("testbot"), {"key": "restored"})
+
+    def _create_outbound_scheduler(self) -> Tuple[OutboundScheduler, List[float]]:
+        now = [1000.0]
+        sleeps: List[float] = []
+
+        def sleep(seconds: float) -> None:
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        scheduler = OutboundScheduler(RateLimit(3, 5), clock=lambda: now[0], sleep=sleep)
+        return scheduler, sleeps
+
+    def test_outbound_scheduler_paces_bursts(self) -> None:
+        scheduler, sleeps = self._create_outbound_scheduler()
+        sent = [scheduler.submit(lambda: dict(result="success")) for _ in range(4)]
+
+        self.assertEqual(len(sent), 4)
+        self.assertEqual(sleeps, [5.0])
+        stats = scheduler.stats()
+        self.assertEqual(stats["calls_sent"], 4)
+        self.assertEqual(stats["calls_delayed"], 1)
+        self.assertEqual(stats["max_delay"], 5.0)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    def test_outbound_scheduler_coalesces_updates(self) -> None:
+        scheduler, sleeps = self._create_outbound_scheduler()
+        for _ in range(3):
+            scheduler.submit(lambda: dict(result="success"))
+
+        update_message = MagicMock(return_value=dict(result="success"))
+        for content in ["1", "2", "3"]:
+            result = scheduler.submit_update(dict(message_id=7, content=content), update_message)
+            self.assertEqual(result["result"], "deferred")
+        update_message.assert_not_called()
+        self.assertEqual(scheduler.stats()["queue_depth"], 1)
+        self.assertEqual(scheduler.stats()["updates_coalesced"], 2)
+
+        scheduler.flush()
+        update_message.assert_called_once_with(dict(message_id=7, content="3"))
+        self.assertEqual(sleeps, [5.0])
+        self.assertEqual(scheduler.stats()["queue_depth"], 0)
+
+    def test_outbound_scheduler_waits_without_the_lock(self) -> None:
+        waiting = threading.Event()
+        release = threading.Event()
+
+        def sleep(seconds: float) -> None:
+            waiting.set()
+            release.wait(10)
+
+        scheduler = OutboundScheduler(RateLimit(1, 60), sleep=sleep)
+        scheduler.submit(lambda: dict(result="success"))
+        thread = threading.Thread(target=scheduler.submit, args=(lambda: dict(result="success"),))
+        thread.start()
+        self.assertTrue(waiting.wait(10))
+        # The other threads can still look at, and queue up on, the scheduler.
+        self.assertEqual(scheduler.stats()["queue_depth"], 1)
+        release.set()
+        thread.join(10)
+        self.assertEqual(scheduler.stats()["calls_sent"], 2)
+
+    def test_outbound_scheduler_stops_self_reply_loops(self) -> None:
+        scheduler, _ = self._create_outbound_scheduler()
+        for _ in range(10):
+            scheduler.begin_message(is_own_message=False)
+            scheduler.submit(lambda: dict(result="success"))
+
+        scheduler.begin_message(is_own_message=True)
+        scheduler.submit(lambda: dict(result="success"))
+        scheduler.begin_message(is_own_message=True)
+        scheduler.submit(lambda: dict(result="success"))
+        scheduler.begin_message(is_own_message=True)
+        with patch("logging.error"), self.assertRaises(SystemExit):
+            scheduler.submit(lambda: dict(result="success"))
+
+    def test_outbound_scheduler_tracks_own_messages_per_thread(self) -> None:
+        scheduler, _ = self._create_outbound_scheduler()
+        thread = threading.Thread(target=scheduler.begin_message, args=(True,))
+        thread.start()
+        thread.join()
+        # Another thread handling the bot's own message isn't a loop here.
+        for _ in range(10):
+            scheduler.submit(lambda: dict(result="success"))
+
+    def test_runner_flushes_held_back_edits_when_the_bot_raises(self) -> None:
+        with tempfile.TemporaryDirectory() as bot_dir:
+            bot_path = os.path.join(bot_dir, "failing.py")
+            with open(bot_path, "w") as f:
+                f.write(
+                    "class FailingHandler:\n"
+                    "    def handle_message(self, message, bot_handler):\n"
+                    "        raise RuntimeError('oops')\n"
+                    "\n"
+                    "handler_class = FailingHandler\n"
+                )
+            lib_module = import_module_from_source(bot_path, "failing")
+            runner = BotRunner(
+                lib_module, cast(Client, FakeClient()), None, "failing", "source", quiet=True
+            )
+        runner.bot_handler.outbound = MagicMock()
+        recipients = [dict(email="alice@example.com"), dict(email="bob@example.com")]
+        message = dict(content="hi", type="private", sender_id=7, display_recipient=recipients)
+        with self.assertRaises(RuntimeError):
+            runner.handle_event(dict(type="message", flags=[], message=message))
+        runner.bot_handler.outbound.flush.assert_called_once()
+
+    def test_message_pipeline_matches_lib_helpers(self) -> None:
+        client = cast(Client, FakeClient())
+        handler = ExternalBotHandler(
+            client=client, root_dir=None, bot_details=None, bot_config_file=None
+        )
+        pipeline = MessagePipeline.for_bot_handler(handler)
+        for content in [
+            "@**Alice** Hello World",
+            "@**Alice|alice** Hello World",
+            "@**Alice Renamed|alice** Hello World",
+            "Not at start @**Alice|alice** Hello World",
+            "@**Bob|bob** Hello World",
+        ]:
+            message = {"content": content}
+            self.assertEqual(
+                pipeline.extract_query(content), extract_query_without_mention(message, handler)
+            )
+
+        for sender_id, emails in [
+            (0, ["a1@b.com"]),
+            (handler.user_id, ["a1@b.com"]),
+            (0, ["a1@b.com", handler.email]),
+            (0, ["a1@b.com", "a2@b.com"]),
+            (0, [handler.email]),
+        ]:
+            private_message: Dict[str, Any] = dict(
+                type="private",
+                sender_id=sender_id,
+                display_recipient=[{"email": email} for email in emails],
+            )
+            self.assertEqual(
+                pipeline.is_private_message(private_message),
+                is_private_message_but_not_group_pm(private_message, handler),
+            )
+
+    def test_message_pipeline_prepare(self) -> None:
+        pipeline = MessagePipeline(5, "Alice", "alice@example.com")
+        message: Dict[str, Any] = dict(id=1, content="@**Alice** Hello")
+        self.assertTrue(pipeline.prepare(message, is_mentioned=True, is_private=False))
+        self.assertEqual(message["content"], "Hello")
+        self.assertEqual(message["full_content"], "@**Alice** Hello")
+
+        # Neither mentioned nor private, or mentioned but not at the start.
+        self.assertFalse(pipeline.prepare(dict(id=2, content="Hi"), False, False))
+        self.assertFalse(pipeline.prepare(dict(id=3, content="Hi @**Alice**"), True, False))
+        # Redelivered messages are handled again, unless dedupe_window is set.
+        self.assertTrue(pipeline.prepare(dict(id=1, content="@**Alice** Hello"), True, False))
+
+    def test_message_pipeline_filters(self) -> None:
+        pipeline = MessagePipeline(
+            5,
+            "Alice",
+            "alice@example.com",
+            ignore_own_messages=True,
+            ignore_streams=["logs"],
+            dedupe_window=2,
+        )
+        pipeline.add_filter(lambda message: "spam" in message["content"])
+
+        def prepare(message_id: int, **fields: Any) -> bool:
+            message = {"id": message_id, "type": "private", "sender_id": 7, "content": "Hi"}
+            message.update(fields)
+            return pipeline.prepare(message, is_mentioned=False, is_private=True)
+
+        self.assertFalse(prepare(1, sender_id=5))
+        self.assertFalse(prepare(2, type="stream", display_recipient="logs"))
+        self.assertTrue(prepare(3, type="stream", display_recipient="general"))
+        self.assertFalse(prepare(4, content="spam"))
+        self.assertTrue(prepare(5))
+        self.assertTrue(prepare(6))
+        # Only the last two ids are remembered.
+        self.assertTrue(prepare(3))
+        self.assertFalse(prepare(6))
+
+    def test_edit_debouncer_coalesces_edits(self) -> None:
+        send = MagicMock(return_value=dict(result="success"))
+        scheduler = Scheduler()
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+        debouncer = EditDebouncer(send, scheduler, min_interval=0.1)
+
+        results = [debouncer.update(dict(message_id=7, content=str(i))) for i in range(10)]
+        send.assert_called_once_with(dict(message_id=7, content="0"))
+        self.assertEqual({result["result"] for result in results[1:]}, {"deferred"})
+        self.assertEqual(debouncer.edits_coalesced, 8)
+
+        # The latest content is sent once the interval is over.
+        deadline = time.monotonic() + 5
+        while send.call_count < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(send.call_args[0][0], dict(message_id=7, content="9"))
+
+        debouncer.update(dict(message_id=7, content="waiting"))
+        debouncer.update(dict(message_id=7, content="done"), final=True)
+        self.assertEqual(send.call_args[0][0], dict(message_id=7, content="done"))
+        self.assertEqual(scheduler.pending(), 0)
+
+    def test_edit_debouncer_without_scheduler_sends_every_edit(self) -> None:
+        send = MagicMock(return_value=dict(result="success"))
+        debouncer = EditDebouncer(send, Scheduler(), min_interval=60)
+        for i in range(3):
+            debouncer.update(dict(message_id=7, content=str(i)))
+        self.assertEqual(send.call_count, 3)
+
     def _create_client_and_handler_for_file_upload(self) -> Tuple[Client, ExternalBotHandler]:
         client = cast(Client, FakeClient())
         client.upload_file = MagicMock()  # type: ignore[method-assign]
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import time
+from typing import Any, Dict
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from zulip_bots.profiling import Profiler, record_call
+
+
+class ProfilerTest(TestCase):
+    def test_message_records_calls_and_timings(self) -> None:
+        profiler = Profiler()
+        client = MagicMock()
+        client.call_endpoint.return_value = dict(result="success")
+        profiler.instrument_client(client)
+
+        # Calls made outside of a message aren't attributed to any bot.
+        client.call_endpoint(url="events", method="GET")
+        with profiler.message("helloworld", dict(id=1)) as record:
+            client.call_endpoint(url="messages", method="POST")
+            client.call_endpoint(url="messages", method="POST")
+            record_call("storage", "get")
+            record_call("http", "GET api.example.com")
+
+        self.assertEqual(dict(record.api_calls), {"messages": 2})
+        self.assertEqual(dict(record.http_calls), {"GET api.example.com": 1})
+        self.assertEqual(dict(record.storage_ops), {"get": 1})
+        self.assertGreater(record.wall, 0)
+        stats = profiler.stats()["helloworld"]
+        self.assertEqual(stats["messages"], 1)
+        self.assertEqual(stats["api_calls"], 2)
+        self.assertEqual(stats["http_calls"], 1)
+        self.assertEqual(stats["storage_ops"], 1)
+        self.assertEqual(stats["slow_messages"], 0)
+
+    def test_slow_messages_are_logged_with_a_stack_sample(self) -> None:
+        profiler = Profiler(slow_threshold=0.02)
+
+        def slow_handler(message: Dict[str, Any]) -> None:
+            time.sleep(0.1)
+
+        with self.assertLogs(level="WARNING") as logs:
+            with profiler.message("helloworld", dict(id=7)):
+                slow_handler(dict(id=7))
+
+        self.assertIn("Slow message: bot=helloworld message=7", logs.output[0])
+        self.assertIn("in slow_handler", logs.output[0])
+        self.assertEqual(profiler.stats()["helloworld"]["slow_messages"], 1)
+
+    def test_sampling_profiler_writes_folded_stacks(self) -> None:
+        with tempfile.TemporaryDirectory() as profile_dir:
+            profiler = Profiler(profile_dir=profile_dir, sample_interval=0.001)
+            with self.assertLogs(level="INFO"):
+                profiler.toggle_sampling()
+                with profiler.message("helloworld", dict(id=1)):
+                    time.sleep(0.05)
+                profiler.toggle_sampling()
+                # The profile is written by the sampler thread as it stops.
+                sampler = profiler._sampler  # noqa: SLF001
+                assert sampler is not None
+                sampler.join()
+
+            (profile,) = os.listdir(profile_dir)
+            with open(os.path.join(profile_dir, profile)) as f:
+                lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.startswith("helloworld;") for line in lines))
+        self.assertIn("test_sampling_profiler_writes_folded_stacks", lines[0])
@@ -0,0 +1,152 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from typing_extensions import override
+
+from zulip_bots.finder import import_module_from_source
+from zulip_bots.replay import (
+    StubZulipServer,
+    UnlimitedRateLimit,
+    parse_speed,
+    read_recorded_events,
+    read_transcript,
+    record_events,
+    replay,
+    synthetic_transcript,
+)
+from zulip_bots.run import replay_events
+
+ECHO_BOT = """
+class EchoHandler:
+    def handle_message(self, message, bot_handler):
+        count = bot_handler.storage.get("count") if bot_handler.storage.contains("count") else 0
+        bot_handler.storage.put("count", count + 1)
+        bot_handler.send_reply(message, message["content"])
+
+handler_class = EchoHandler
+"""
+
+
+class ReplayTest(TestCase):
+    @override
+    def setUp(self) -> None:
+        bot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(bot_dir.cleanup)
+        bot_path = os.path.join(bot_dir.name, "echo.py")
+        with open(bot_path, "w") as f:
+            f.write(ECHO_BOT)
+        self.lib_module = import_module_from_source(bot_path, "echo")
+
+    def test_replay_synthetic_transcript(self) -> None:
+        server = StubZulipServer([], batch_size=7)
+        events = synthetic_transcript(20, ["hello", "world"], server)
+        report = replay(self.lib_module, "echo", events, server=server, trace_memory=True)
+
+        self.assertEqual(report["messages"], 20)
+        # One reply and one storage update per message.
+        self.assertEqual(report["api_calls"], {"POST messages": 20, "PUT bot_storage": 20})
+        self.assertEqual(report["api_calls_per_message"], 2)
+        self.assertLessEqual(report["latency_p50_ms"], report["latency_max_ms"])
+        self.assertIn("traced_memory_peak_bytes", report)
+        self.assertEqual(server.storage["count"], "20")
+
+    def test_unlimited_rate_limit_keeps_nothing(self) -> None:
+        rate_limit = UnlimitedRateLimit()
+        for _ in range(1000):
+            rate_limit.record()
+        self.assertEqual(rate_limit.wait_time(), 0)
+        self.assertEqual(len(rate_limit.message_list), 0)
+
+    def test_read_transcript(self) -> None:
+        message = dict(
+            id=1,
+            type="private",
+            content="hi",
+            sender_id=5,
+            sender_email="alice@example.com",
+            display_recipient=[
+                dict(id=5, email="alice@example.com"),
+                dict(id=1, email="replay-bot@example.com"),
+            ],
+        )
+        transcript = io.StringIO(
+            json.dumps(message)
+            + "\n\n"
+            + json.dumps(
+                dict(
+                    type="message",
+                    message=dict(message, id=2, content="@**Replay Bot** hi"),
+                    flags=["mentioned"],
+                )
+            )
+            + "\n"
+        )
+        events = read_transcript(transcript)
+        self.assertEqual([event["flags"] for event in events], [[], ["mentioned"]])
+
+        report = replay(self.lib_module, "echo", events)
+        self.assertEqual(report["messages"], 2)
+        self.assertEqual(report["api_calls"]["POST messages"], 2)
+
+    def test_record_and_replay_events(self) -> None:
+        server = StubZulipServer([])
+        messages = synthetic_transcript(3, ["hello"], server)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "events.jsonl.gz")
+            with record_events(path) as recorder:
+                recorder.record(dict(type="heartbeat", id=0))
+                for event in messages:
+                    recorder.record(event)
+            events, times, profile = read_recorded_events(path)
+
+            # A recording cut short by a killed bot is read up to where it stops.
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(path, "wb") as f:
+                f.write(data[:-8])
+            self.assertEqual(read_recorded_events(path)[0], events)
+
+        self.assertEqual(events, messages)
+        self.assertIsNone(profile)
+        # Replaying at 1x takes as long as the recording did.
+        times = [0.0, 0.05, 0.1]
+        report = replay(self.lib_module, "echo", events, server=server, times=times, speed=1)
+        self.assertEqual(report["messages"], 3)
+        self.assertGreaterEqual(report["seconds"], 0.1)
+
+    def test_replay_serves_the_recorded_bot(self) -> None:
+        profile = dict(user_id=42, full_name="Echo Bot", email="echo-bot@zulip.example.com")
+        messages = synthetic_transcript(2, ["hello"], StubZulipServer([], full_name="Echo Bot"))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "events.jsonl.gz")
+            with record_events(path) as recorder:
+                recorder.record_profile(profile)
+                for event in messages:
+                    recorder.record(event)
+            self.assertEqual(read_recorded_events(path)[2], profile)
+
+            args = argparse.Namespace(replay_events=path, speed="max", bot_config_file=None)
+            with patch(
+                "zulip_bots.replay.replay", wraps=replay
+            ) as mock_replay, contextlib.redirect_stdout(io.StringIO()) as output:
+                replay_events(args, self.lib_module, "echo")
+
+        server = mock_replay.call_args.args[4]
+        self.assertEqual(
+            dict(user_id=server.user_id, full_name=server.full_name, email=server.email), profile
+        )
+        self.assertEqual(json.loads(output.getvalue())["messages"], 2)
+
+    def test_parse_speed(self) -> None:
+        self.assertIsNone(parse_speed("max"))
+        self.assertEqual(parse_speed("10x"), 10)
+        self.assertEqual(parse_speed("0.5"), 0.5)
+        for speed in ["fast", "0x"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_speed(speed)
@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 from pathlib import Path
 from typing import Optional
 from unittest import TestCase, mock
@@ -8,7 +9,9 @@ from unittest.mock import MagicMock, patch
 import importlib_metadata as metadata
 
 import zulip_bots.run
+from zulip_bots import finder
 from zulip_bots.lib import extract_query_without_mention
+from zulip_bots.multi_runner import BotSpec, BotThread
 
 
 class TestDefaultArguments(TestCase):
@@ -34,6 +37,12 @@ class TestDefaultArguments(TestCase):
             lib_module=mock.ANY,
             bot_source="source",
             quiet=False,
+            reload=None,
+            profiler=mock.ANY,
+            pipeline_options=dict(ignore_own_messages=False, ignore_streams=None, dedupe_window=0),
+            record_event=None,
+            record_profile=None,
+            snapshot=None,
         )
 
     @patch("sys.argv", ["zulip-run-bot", path_to_bot, "--config-file", "/foo/bar/baz.conf"])
@@ -51,6 +60,12 @@ class TestDefaultArguments(TestCase):
             lib_module=mock.ANY,
             bot_source="source",
             quiet=False,
+            reload=None,
+            profiler=mock.ANY,
+            pipeline_options=dict(ignore_own_messages=False, ignore_streams=None, dedupe_window=0),
+            record_event=None,
+            record_profile=None,
+            snapshot=None,
         )
 
     @patch(
@@ -60,6 +75,9 @@ class TestDefaultArguments(TestCase):
     def test_argument_parsing_with_zulip_bot_registry(
         self, mock_run_message_handler_for_bot: mock.Mock
     ) -> None:
+        # The registry index is built once per process; rebuild it from the mocks.
+        finder.clear_registry_index()
+        self.addCleanup(finder.clear_registry_index)
         with patch("zulip_bots.run.exit_gracefully_if_zulip_config_is_missing"), patch(
             "zulip_bots.finder.metadata.EntryPoint.load",
             return_value=self.packaged_bot_module,
@@ -76,6 +94,12 @@ class TestDefaultArguments(TestCase):
             lib_module=mock.ANY,
             bot_source="packaged_bot: 1.0.0",
             quiet=False,
+            reload=None,
+            profiler=mock.ANY,
+            pipeline_options=dict(ignore_own_messages=False, ignore_streams=None, dedupe_window=0),
+            record_event=None,
+            record_profile=None,
+            snapshot=None,
         )
 
     def test_adding_bot_parent_dir_to_sys_path_when_bot_name_specified(self) -> None:
@@ -127,6 +151,76 @@ class TestDefaultArguments(TestCase):
                         zulip_bots.run.main()
                         mock_import_module.assert_called_once_with(bot_module_name)
 
+    def test_run_bots_from_manifest(self) -> None:
+        with tempfile.NamedTemporaryFile("w", suffix=".conf") as manifest:
+            manifest.write(
+                "[moderation]\n"
+                "config-file = /path/to/zuliprc\n"
+                "\n"
+                "[other-moderation]\n"
+                "bot = moderation\n"
+                "bot-config-file = /path/to/moderation.conf\n"
+            )
+            manifest.flush()
+            with patch("sys.argv", ["zulip-run-bot", "--manifest", manifest.name]), patch(
+                "zulip_bots.run.run_bots"
+            ) as mock_run_bots, patch(
+                "zulip_bots.run.exit_gracefully_if_zulip_config_is_missing"
+            ), patch("zulip_bots.run.exit_gracefully_if_bot_config_file_does_not_exist"):
+                zulip_bots.run.main()
+
+        bots = mock_run_bots.call_args[0][0]
+        self.assertEqual([bot.name for bot in bots], ["moderation", "other-moderation"])
+        self.assertEqual([bot.bot_name for bot in bots], ["moderation", "moderation"])
+        self.assertEqual([bot.config_file for bot in bots], ["/path/to/zuliprc", None])
+        self.assertEqual([bot.bot_config_file for bot in bots], [None, "/path/to/moderation.conf"])
+
+    @patch("sys.argv", ["zulip-run-bot"])
+    def test_bot_or_manifest_is_required(self) -> None:
+        with patch("sys.stderr"), self.assertRaises(SystemExit):
+            zulip_bots.run.main()
+
+
+class TestMultiRunner(TestCase):
+    def test_failing_bot_is_isolated(self) -> None:
+        spec = BotSpec(
+            name="bot",
+            lib_module=MagicMock(),
+            bot_name="bot",
+            bot_source="source",
+            config_file=None,
+            bot_config_file=None,
+        )
+        thread = BotThread(spec, MagicMock(), quiet=True)
+        thread.runner = MagicMock()
+        thread.runner.handle_event.side_effect = [Exception("boom"), None]
+        thread.runner.bot_handler.outbound.stats.return_value = dict(calls_sent=1)
+
+        with self.assertLogs(level="ERROR"):
+            thread.handle_event(dict(type="message"))
+        thread.handle_event(dict(type="message"))
+
+        stats = thread.stats()
+        self.assertEqual(stats["events"], 2)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["calls_sent"], 1)
+
+    def test_quitting_bot_stops_only_its_thread(self) -> None:
+        spec = BotSpec(
+            name="bot",
+            lib_module=MagicMock(),
+            bot_name="bot",
+            bot_source="source",
+            config_file=None,
+            bot_config_file=None,
+        )
+        thread = BotThread(spec, MagicMock(), quiet=True)
+        with patch("zulip_bots.multi_runner.Client"), patch(
+            "zulip_bots.multi_runner.BotRunner", side_effect=SystemExit(1)
+        ), self.assertLogs(level="ERROR"):
+            thread.run()
+        self.assertEqual(thread.stats()["state"], "stopped")
+
 
 class TestBotLib(TestCase):
     def test_extract_query_without_mention(self) -> None:
@@ -0,0 +1,160 @@
+import threading
+import tracemalloc
+from typing import Any, List, Tuple
+from unittest import TestCase
+from unittest.mock import patch
+
+from zulip_bots.lib import StateHandler
+from zulip_bots.replay import StubClient, StubZulipServer
+from zulip_bots.scheduler import JOB_KEY_PREFIX, Scheduler
+from zulip_bots.simple_lib import SimpleStorage
+
+
+class SchedulerTest(TestCase):
+    def _create_scheduler(self, storage: Any = None) -> Tuple[Scheduler, List[Tuple[str, Any]]]:
+        calls: List[Tuple[str, Any]] = []
+        scheduler = Scheduler(
+            storage,
+            clock=lambda: 1000.0,
+            dispatch=lambda method_name, data: calls.append((method_name, data)),
+        )
+        return scheduler, calls
+
+    def test_jobs_run_in_order_when_due(self) -> None:
+        scheduler, calls = self._create_scheduler()
+        scheduler.schedule_at(1020, "second", 2)
+        scheduler.schedule_at(1010, "first", 1)
+        scheduler.schedule_at(1010, lambda data: calls.append(("function", data)), 3)
+
+        self.assertEqual(scheduler.run_pending(1005), 0)
+        self.assertEqual(scheduler.run_pending(1015), 2)
+        self.assertEqual(calls, [("first", 1), ("function", 3)])
+        self.assertEqual(scheduler.run_pending(1100), 1)
+        self.assertEqual(scheduler.pending(), 0)
+
+    def test_recurring_jobs_skip_missed_runs(self) -> None:
+        scheduler, calls = self._create_scheduler()
+        scheduler.schedule_every(10, "tick", job_id="ticker")
+        self.assertEqual(scheduler.next_run(), 1010)
+
+        scheduler.run_pending(1010)
+        self.assertEqual(scheduler.next_run(), 1020)
+        # The bot was stopped for a while; it runs once, then on schedule.
+        scheduler.run_pending(1055)
+        self.assertEqual(scheduler.next_run(), 1060)
+        self.assertEqual(len(calls), 2)
+
+    def test_cancel_and_replace(self) -> None:
+        scheduler, calls = self._create_scheduler()
+        job_id = scheduler.schedule_at(1010, "expire_mute", "alice")
+        scheduler.schedule_at(1010, "turn_timeout", 1, job_id="game")
+        scheduler.schedule_at(1030, "turn_timeout", 2, job_id="game")
+
+        self.assertTrue(scheduler.cancel(job_id))
+        self.assertFalse(scheduler.cancel(job_id))
+        scheduler.run_pending(1100)
+        self.assertEqual(calls, [("turn_timeout", 2)])
+
+    def test_cancelled_jobs_dont_accumulate(self) -> None:
+        scheduler, calls = self._create_scheduler()
+        tracemalloc.start()
+        try:
+            for i in range(10000):
+                scheduler.schedule_at(2000 + i, "turn_timeout", job_id="game")
+            memory, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # Keeping the replaced jobs would take megabytes.
+        self.assertLess(memory, 500_000)
+        self.assertEqual(scheduler.pending(), 1)
+        self.assertEqual(scheduler.run_pending(20000), 1)
+        self.assertEqual(calls, [("turn_timeout", None)])
+
+    def test_jobs_are_restored_from_storage(self) -> None:
+        storage = SimpleStorage()
+        scheduler, _ = self._create_scheduler(storage)
+        scheduler.schedule_at(1010, "expire_mute", "alice")
+        scheduler.schedule_every(60, "digest", job_id="digest")
+        scheduler.schedule_at(1010, lambda data: None)
+        scheduler.persist()
+        # One key per job; only the jobs that change are saved again.
+        self.assertEqual(len(storage.list_keys()), 2)
+        self.assertIn(JOB_KEY_PREFIX + "digest", storage.data)
+
+        restarted, calls = self._create_scheduler(storage)
+        # Rescheduled on startup; the saved copy is ignored.
+        restarted.schedule_every(120, "digest", job_id="digest")
+        restarted.load()
+        self.assertEqual(restarted.pending(), 2)
+        restarted.run_pending(1200)
+        self.assertEqual(calls, [("expire_mute", "alice"), ("digest", None)])
+        self.assertEqual(restarted.next_run(), 1240)
+
+    def test_thread_runs_jobs_and_saves_them_on_stop(self) -> None:
+        storage = SimpleStorage()
+        scheduler = Scheduler(storage)
+        done = threading.Event()
+        scheduler.start(lambda method_name, data: done.set())
+        scheduler.schedule_at(0, "now")
+        scheduler.schedule_every(3600, "later", job_id="later")
+        self.assertTrue(done.wait(5))
+        scheduler.stop()
+        self.assertEqual(storage.list_keys(), [JOB_KEY_PREFIX + "later"])
+
+    def test_jobs_that_ran_or_were_cancelled_are_removed_from_storage(self) -> None:
+        storage = SimpleStorage()
+        scheduler, calls = self._create_scheduler(storage)
+        scheduler.schedule_at(1010, "expire_mute", "alice", job_id="mute")
+        scheduler.schedule_at(1010, "turn_timeout", job_id="game")
+        scheduler.persist()
+        put = patch.object(storage, "put", wraps=storage.put)
+        with put as mock_put:
+            scheduler.cancel("game")
+            scheduler.run_pending(1010)
+            scheduler.persist()
+        mock_put.assert_not_called()
+        self.assertEqual(storage.data, {})
+        self.assertEqual(calls, [("expire_mute", "alice")])
+
+    def test_syncing_before_any_job_was_saved(self) -> None:
+        server = StubZulipServer([])
+        scheduler, _ = self._create_scheduler(StateHandler(StubClient(server)))
+        with patch("logging.exception") as log_exception:
+            scheduler.sync()
+        log_exception.assert_not_called()
+        self.assertEqual(scheduler.pending(), 0)
+
+    def test_only_one_process_runs_the_saved_jobs(self) -> None:
+        storage = SimpleStorage()
+        leader, leader_calls = self._create_scheduler(storage)
+        follower, follower_calls = self._create_scheduler(storage)
+        leader.start(shared=True)
+        follower.start(shared=True, run_saved_jobs=False)
+        self.addCleanup(leader.stop)
+        self.addCleanup(follower.stop)
+
+        # Both processes schedule the same job on startup.
+        for scheduler in [leader, follower]:
+            scheduler.schedule_every(60, "digest", job_id="digest")
+        follower.schedule_at(1010, "expire_mute", "alice", job_id="mute")
+        follower.schedule_at(1010, lambda data: follower_calls.append(("function", data)), 1)
+        follower.persist()
+        self.assertEqual(follower.pending(), 1)
+
+        leader.persist()
+        leader.sync()
+        self.assertEqual(leader.pending(), 2)
+        follower.cancel("mute")
+        follower.persist()
+        leader.sync()
+        self.assertEqual(leader.pending(), 1)
+
+        leader.run_pending(1100)
+        follower.run_pending(1100)
+        self.assertEqual(leader_calls, [("digest", None)])
+        self.assertEqual(follower_calls, [("function", 1)])
+
+        # The follower takes over once the leader is gone.
+        leader.stop()
+        follower.lead()
+        self.assertEqual(follower.next_run(), 1120)
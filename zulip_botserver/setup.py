@@ -34,6 +34,7 @@ setup(
     entry_points={
         "console_scripts": [
             "zulip-botserver=zulip_botserver.server:main",
+            "zulip-botserver-bench=zulip_botserver.bench:main",
         ],
     },
     test_suite="tests",
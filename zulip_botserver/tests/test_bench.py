@@ -0,0 +1,73 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from werkzeug.serving import make_server
+
+from zulip_bots.finder import import_module_from_source
+from zulip_bots.replay import StubZulipServer, synthetic_transcript
+from zulip_botserver import server
+from zulip_botserver.bench import StandInZulipServer, run_load, wait_for_calls, webhook_payloads
+
+ECHO_BOT = """
+class EchoHandler:
+    def handle_message(self, message, bot_handler):
+        bot_handler.send_reply(message, message["content"])
+
+handler_class = EchoHandler
+"""
+
+
+class BenchTest(TestCase):
+    def test_run_load(self) -> None:
+        stub = StubZulipServer([], email="echo-bot@zulip.com")
+        stand_in = StandInZulipServer(("127.0.0.1", 0), stub)
+        threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+        self.addCleanup(stand_in.server_close)
+        self.addCleanup(stand_in.shutdown)
+
+        bot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(bot_dir.cleanup)
+        bot_path = os.path.join(bot_dir.name, "echo.py")
+        with open(bot_path, "w") as f:
+            f.write(ECHO_BOT)
+        bots_config = {
+            "echo": {
+                "email": "echo-bot@zulip.com",
+                "key": "123456789qwertyuiop",
+                "site": f"http://127.0.0.1:{stand_in.server_address[1]}",
+                "token": "abcd1234",
+            }
+        }
+        loader = server.BotLoader(
+            {"echo": import_module_from_source(bot_path, "echo")}, bots_config
+        )
+        loader.start()
+        loader.wait()
+        self.addCleanup(server.stop_bot, loader.bot_handlers["echo"])
+        server.app.config["BOT_LOADER"] = loader
+        self.addCleanup(server.app.config.pop, "BOT_LOADER")
+        botserver = make_server("127.0.0.1", 0, server.app, threaded=True)
+        threading.Thread(target=botserver.serve_forever, daemon=True).start()
+        self.addCleanup(botserver.shutdown)
+
+        payloads = webhook_payloads(
+            synthetic_transcript(3, ["hello"], stub), "echo-bot@zulip.com", "abcd1234"
+        )
+        calls_before = stand_in.calls()
+        report = run_load(
+            f"http://127.0.0.1:{botserver.server_port}/",
+            payloads,
+            concurrency=2,
+            requests=10,
+            first_id=1000,
+        )
+        wait_for_calls(stand_in, quiet_period=0.1, timeout=5)
+
+        self.assertEqual(report["webhooks"], 10)
+        self.assertEqual(report["statuses"], {"200": 10})
+        self.assertEqual(report["error_rate"], 0.0)
+        self.assertLessEqual(report["latency_p50_ms"], report["latency_max_ms"])
+        # Each message has its own id, so none is skipped as sent again.
+        self.assertEqual(stand_in.calls() - calls_before, {"POST messages": 10})
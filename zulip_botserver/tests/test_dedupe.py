@@ -0,0 +1,53 @@
+import os
+import tempfile
+from typing import List
+from unittest import TestCase
+
+from zulip_botserver.dedupe import DedupeCache, SqliteDedupeCache
+
+
+class DedupeCacheTest(TestCase):
+    def test_window(self) -> None:
+        now: List[float] = [0.0]
+        cache = DedupeCache(window=10, clock=lambda: now[0])
+        self.assertFalse(cache.seen("bot", 1))
+        self.assertFalse(cache.seen("other-bot", 1))
+        self.assertFalse(cache.seen("bot", 2))
+        now[0] = 5
+        self.assertTrue(cache.seen("bot", 1))
+        now[0] = 10
+        self.assertFalse(cache.seen("bot", 1))
+        self.assertFalse(cache.seen("other-bot", 1))
+        self.assertTrue(cache.seen("bot", 1))
+
+    def test_max_entries(self) -> None:
+        cache = DedupeCache(max_entries=2)
+        for message_id in [1, 2, 3]:
+            self.assertFalse(cache.seen("bot", message_id))
+        self.assertFalse(cache.seen("bot", 1))
+        self.assertTrue(cache.seen("bot", 3))
+
+    def test_forget(self) -> None:
+        cache = DedupeCache()
+        self.assertFalse(cache.seen("bot", 1))
+        cache.forget("bot", 1)
+        cache.forget("bot", 2)
+        self.assertFalse(cache.seen("bot", 1))
+        self.assertTrue(cache.seen("bot", 1))
+
+
+class SqliteDedupeCacheTest(TestCase):
+    def test_shared_between_caches(self) -> None:
+        now: List[float] = [1000.0]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dedupe.sqlite3")
+            cache = SqliteDedupeCache(path, window=10, clock=lambda: now[0])
+            other_cache = SqliteDedupeCache(path, window=10, clock=lambda: now[0])
+            self.assertFalse(cache.seen("bot", 1))
+            self.assertTrue(other_cache.seen("bot", 1))
+            self.assertFalse(other_cache.seen("other-bot", 1))
+            now[0] += 10
+            self.assertFalse(other_cache.seen("bot", 1))
+            self.assertTrue(cache.seen("bot", 1))
+            other_cache.forget("bot", 1)
+            self.assertFalse(cache.seen("bot", 1))
@@ -0,0 +1,92 @@
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List
+from unittest import TestCase
+
+from zulip_botserver.isolation import BotHandlerError, BotProcess, BotProcessError
+
+
+# Run in the bots' processes, so they have to be importable there.
+def init_echo_bot() -> Callable[[Any], Any]:
+    def handle(event: Dict[str, Any]) -> Any:
+        if event.get("crash"):
+            os._exit(1)
+        if event.get("fail"):
+            raise ValueError("bad message")
+        time.sleep(event.get("sleep", 0))
+        return dict(pid=os.getpid(), content=event.get("content"))
+
+    return handle
+
+
+def init_broken_bot() -> Callable[[Any], Any]:
+    raise RuntimeError("no such site")
+
+
+class BotProcessTest(TestCase):
+    def start(self, init: Callable[[], Callable[[Any], Any]], **kwargs: Any) -> BotProcess:
+        process = BotProcess("bot", init, restart_delay=0.1, **kwargs)
+        process.start()
+        self.addCleanup(process.stop, 10)
+        return process
+
+    def test_handles_messages_in_another_process(self) -> None:
+        process = self.start(init_echo_bot)
+        self.assertTrue(process.wait())
+        result = process.handle(dict(content="hello"))
+        self.assertEqual(result["content"], "hello")
+        self.assertNotEqual(result["pid"], os.getpid())
+
+        with self.assertRaisesRegex(BotHandlerError, "bad message"):
+            process.handle(dict(fail=True))
+        self.assertEqual(process.handle(dict(content="again"))["pid"], result["pid"])
+
+    def test_concurrency_limit(self) -> None:
+        process = self.start(init_echo_bot, concurrency=2)
+        self.assertTrue(process.wait())
+        results: List[Any] = []
+
+        def handle() -> None:
+            results.append(process.handle(dict(sleep=0.3)))
+
+        threads = [threading.Thread(target=handle) for _ in range(4)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Two at a time: two rounds of 0.3s.
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+        self.assertEqual(len(results), 4)
+
+    def test_restarts_crashed_process(self) -> None:
+        process = self.start(init_echo_bot)
+        self.assertTrue(process.wait())
+        pid = process.handle({})["pid"]
+        with self.assertLogs(level="WARNING"), self.assertRaises(BotProcessError):
+            process.handle(dict(crash=True))
+        # The next message waits for the new process.
+        deadline = time.monotonic() + 30
+        while process.restarts == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertNotEqual(process.handle({})["pid"], pid)
+        self.assertEqual(process.restarts, 1)
+
+    def test_replaces_process_over_memory_limit(self) -> None:
+        process = self.start(init_echo_bot, memory_limit=1)
+        self.assertTrue(process.wait())
+        with self.assertLogs(level="WARNING") as logs:
+            first = process.handle({})["pid"]
+            second = process.handle({})["pid"]
+        self.assertNotEqual(first, second)
+        self.assertIn("over its limit", logs.output[0])
+
+    def test_failing_to_start(self) -> None:
+        with self.assertLogs(level="ERROR"):
+            process = self.start(functools.partial(init_broken_bot))
+            self.assertFalse(process.wait())
+        self.assertTrue(process.failed())
+        with self.assertRaisesRegex(BotProcessError, "no such site"):
+            process.handle({})
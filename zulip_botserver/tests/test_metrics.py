@@ -0,0 +1,36 @@
+from unittest import TestCase, mock
+
+from zulip_botserver.metrics import Metrics
+
+
+class MetricsTest(TestCase):
+    def test_render(self) -> None:
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.count_request("helloworld", "handled")
+        metrics.count_request("helloworld", "handled")
+        metrics.count_request('odd "bot"', "ignored")
+        metrics.observe_message("helloworld", 0.05, failed=False)
+        metrics.observe_message("helloworld", 0.5, failed=True)
+        metrics.observe_message("helloworld", 5, failed=False)
+        bot_handler = mock.Mock()
+        bot_handler.outbound.stats.return_value = dict(calls_sent=3, calls_delayed=1, queue_depth=0)
+
+        text = metrics.render({"helloworld": bot_handler}, dict(queued=2, running=1, dropped=7))
+        lines = text.splitlines()
+        for line in [
+            "# TYPE botserver_webhooks_total counter",
+            'botserver_webhooks_total{bot="helloworld",outcome="handled"} 2',
+            'botserver_webhooks_total{bot="odd \\"bot\\"",outcome="ignored"} 1',
+            'botserver_message_errors_total{bot="helloworld"} 1',
+            "# TYPE botserver_message_seconds histogram",
+            'botserver_message_seconds_bucket{bot="helloworld",le="0.1"} 1',
+            'botserver_message_seconds_bucket{bot="helloworld",le="1"} 2',
+            'botserver_message_seconds_bucket{bot="helloworld",le="+Inf"} 3',
+            'botserver_message_seconds_sum{bot="helloworld"} 5.55',
+            'botserver_message_seconds_count{bot="helloworld"} 3',
+            'botserver_outbound_calls_total{bot="helloworld"} 3',
+            'botserver_queue_messages{state="queued"} 2',
+            "botserver_queue_dropped_total 7",
+        ]:
+            self.assertIn(line, lines)
+        self.assertTrue(text.endswith("\n"))
@@ -0,0 +1,52 @@
+import tempfile
+import threading
+from typing import List
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from zulip_botserver.scheduling import HandlerLock, SchedulerLeases
+
+
+class HandlerLockTest(TestCase):
+    def test_jobs_wait_for_the_messages(self) -> None:
+        lock = HandlerLock()
+        events: List[str] = []
+        job_started = threading.Event()
+
+        def run_job() -> None:
+            job_started.set()
+            with lock:
+                events.append("job")
+
+        with lock.shared(), lock.shared():
+            thread = threading.Thread(target=run_job)
+            thread.start()
+            job_started.wait()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            events.append("messages")
+        thread.join()
+        self.assertEqual(events, ["messages", "job"])
+
+
+class SchedulerLeasesTest(TestCase):
+    def test_one_process_runs_the_jobs(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            leases = SchedulerLeases(directory, interval=0.01)
+            other_leases = SchedulerLeases(directory, interval=0.01)
+            scheduler = MagicMock()
+            other_scheduler = MagicMock()
+            taken_over = threading.Event()
+            other_scheduler.lead.side_effect = taken_over.set
+
+            leases.start_scheduler("bot", scheduler, MagicMock())
+            other_leases.start_scheduler("bot", other_scheduler, MagicMock())
+            self.assertTrue(leases.holds("bot"))
+            self.assertFalse(other_leases.holds("bot"))
+            self.assertTrue(scheduler.start.call_args.kwargs["run_saved_jobs"])
+            self.assertFalse(other_scheduler.start.call_args.kwargs["run_saved_jobs"])
+
+            leases.stop_scheduler(scheduler)
+            self.assertTrue(taken_over.wait(5))
+            self.assertTrue(other_leases.holds("bot"))
+            other_leases.stop_scheduler(other_scheduler)
@@ -1,18 +1,23 @@
 import json
 import os
+import queue
 from collections import OrderedDict
 from importlib import import_module
 from pathlib import Path
 from types import ModuleType
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 from unittest import mock
 
 import importlib_metadata as metadata
 from typing_extensions import override
 
+from zulip_bots import finder, lib
 from zulip_bots.lib import AbstractBotHandler
 from zulip_botserver import server
+from zulip_botserver.dedupe import DedupeCache
 from zulip_botserver.input_parameters import parse_args
+from zulip_botserver.isolation import BotProcessError
+from zulip_botserver.work_queue import WorkQueue
 
 from .server_test_lib import BotServerTestCase
 
@@ -86,6 +91,405 @@ class BotServerTests(BotServerTestCase):
             check_success=True,
         )
 
+    def _set_up_bot(self, bot_handler: Any, message_handler: Any) -> None:
+        server.bots_config = {
+            "helloworld": {
+                "email": "helloworld-bot@zulip.com",
+                "key": "123456789qwertyuiop",
+                "site": "http://localhost",
+                "token": "abcd1234",
+            }
+        }
+        server.app.config["BOTS_LIB_MODULES"] = {"helloworld": mock.Mock()}
+        server.app.config["BOT_HANDLERS"] = {"helloworld": bot_handler}
+        server.app.config["MESSAGE_HANDLERS"] = {"helloworld": message_handler}
+        server.app.config["MESSAGE_PIPELINES"] = {}
+
+    def test_inline_reply(self) -> None:
+        class ReplyingHandler:
+            def handle_message(
+                self, message: Dict[str, Any], bot_handler: AbstractBotHandler
+            ) -> None:
+                bot_handler.send_reply(message, "beep boop")
+
+        client = mock.MagicMock()
+        client.get_profile.return_value = dict(
+            user_id=5, full_name="test", email="helloworld-bot@zulip.com"
+        )
+        bot_handler = lib.ExternalBotHandler(client, None, {}, None)
+        self._set_up_bot(bot_handler, ReplyingHandler())
+        server.app.config["INLINE_REPLIES"] = True
+        self.addCleanup(server.app.config.pop, "INLINE_REPLIES")
+        event = dict(
+            message={
+                "id": 1,
+                "type": "stream",
+                "display_recipient": "general",
+                "subject": "test",
+                "content": "@**test** hello",
+            },
+            bot_email="helloworld-bot@zulip.com",
+            trigger="mention",
+            token="abcd1234",  # noqa: S106
+        )
+
+        response = self.app.post(data=json.dumps(event))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), dict(content="beep boop"))
+        client.send_message.assert_not_called()
+
+    def test_background_handling(self) -> None:
+        handled: queue.Queue[Any] = queue.Queue()
+
+        class BackgroundHandler:
+            def handle_message(
+                self, message: Dict[str, Any], bot_handler: AbstractBotHandler
+            ) -> None:
+                handled.put(message["id"])
+
+        self._set_up_bot(mock.MagicMock(full_name="test"), BackgroundHandler())
+        work_queue = WorkQueue(threads=1, max_queued=1)
+        server.app.config["WORK_QUEUE"] = work_queue
+        self.addCleanup(server.app.config.pop, "WORK_QUEUE")
+        event: Dict[str, Any] = dict(
+            message={"id": 1, "content": "@**test** hello"},
+            bot_email="helloworld-bot@zulip.com",
+            trigger="mention",
+            token="abcd1234",  # noqa: S106
+        )
+
+        response = self.app.post(data=json.dumps(event))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), dict(response_not_required=True))
+        # The queue isn't running yet, so the next message doesn't fit.
+        event["message"] = {"id": 2, "content": "@**test** hello"}
+        with self.assertLogs(level="WARNING"):
+            response = self.app.post(data=json.dumps(event))
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(handled.empty())
+
+        work_queue.start()
+        self.assertEqual(handled.get(timeout=10), 1)
+        # Zulip sends the message turned away again, and it gets handled then.
+        response = self.app.post(data=json.dumps(event))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(handled.get(timeout=10), 2)
+        work_queue.stop()
+        self.assertEqual(work_queue.stats()["dropped"], 1)
+
+    def test_bot_loader(self) -> None:
+        bots_config = {
+            bot: {
+                "email": f"{bot}-bot@zulip.com",
+                "key": "123456789qwertyuiop",
+                "site": "http://localhost",
+                "token": "abcd1234",
+            }
+            for bot in ["helloworld", "help", "broken"]
+        }
+        lib_modules: Dict[str, Any] = {bot: mock.Mock() for bot in bots_config}
+        failures = [RuntimeError("site unreachable")]
+
+        def load_bot_handler(lib_module: Any, bot_config: Dict[str, str], *args: Any) -> Any:
+            if bot_config["email"] == "broken-bot@zulip.com" and failures:
+                error = failures.pop()
+                raise error
+            return mock.MagicMock(full_name="test")
+
+        with mock.patch(
+            "zulip_botserver.server.load_bot_handler", side_effect=load_bot_handler
+        ), mock.patch("zulip_botserver.server.init_message_handler") as init_message_handler:
+            loader = server.BotLoader(lib_modules, bots_config, threads=2, lazy=True)
+            loader.start()
+            loader.wait()
+            self.assertEqual(loader.message_handlers, {})
+
+            loader.load("help")
+            self.assertEqual(list(loader.message_handlers), ["help"])
+            self.assertIn("help", loader.pipelines)
+            init_message_handler.assert_called_once()
+
+            with self.assertLogs(level="ERROR"), self.assertRaises(RuntimeError):
+                loader.load("broken")
+            # Retried on the next webhook.
+            loader.load("broken")
+            self.assertEqual(set(loader.timings), {"help", "broken"})
+
+            loader = server.BotLoader(lib_modules, bots_config, threads=2)
+            loader.start()
+            loader.wait()
+            self.assertEqual(set(loader.bot_handlers), set(bots_config))
+
+    def test_routing_by_url(self) -> None:
+        message_handler = mock.Mock()
+        self._set_up_bot(mock.MagicMock(full_name="test"), message_handler)
+        event = dict(
+            message={"id": 1, "content": "@**test** hello"},
+            bot_email="renamed-bot@zulip.com",
+            trigger="mention",
+            token="abcd1234",  # noqa: S106
+        )
+
+        response = self.app.post("/bots/helloworld", data=json.dumps(event))
+        self.assertEqual(response.status_code, 200)
+        message_handler.handle_message.assert_called_once()
+        self.assertEqual(self.app.post("/bots/other", data=json.dumps(event)).status_code, 400)
+        # The email is only used without the bot's name in the URL.
+        self.assertEqual(self.app.post("/", data=json.dumps(event)).status_code, 400)
+        event["token"] = "abcd123"  # noqa: S105
+        self.assertEqual(self.app.post("/bots/helloworld", data=json.dumps(event)).status_code, 401)
+
+    def test_bot_routes(self) -> None:
+        routes = server.BotRoutes(
+            {
+                "helloworld": {
+                    "email": "helloworld-bot@zulip.com",
+                    "key": "123456789qwertyuiop",
+                    "site": "http://localhost",
+                    "token": "abcd1234",
+                }
+            }
+        )
+        self.assertEqual(routes.find("helloworld-bot@zulip.com"), "helloworld")
+        self.assertIsNone(routes.find("other-bot@zulip.com"))
+        self.assertTrue(routes.check_token("helloworld", "abcd1234"))
+        self.assertFalse(routes.check_token("helloworld", "abcd12345"))
+        self.assertFalse(routes.check_token("helloworld", "ünïcode"))
+
+    def test_reload_bots(self) -> None:
+        def bot_config(bot: str, token: str = "abcd1234") -> Dict[str, str]:  # noqa: S107
+            return {
+                "email": f"{bot}-bot@zulip.com",
+                "key": "123456789qwertyuiop",
+                "site": "http://localhost",
+                "token": token,
+            }
+
+        old_config = {bot: bot_config(bot) for bot in ["kept", "rotated", "moved", "removed"]}
+        new_config = {bot: bot_config(bot) for bot in ["kept", "moved", "added"]}
+        new_config["rotated"] = bot_config("rotated", token="new-token")  # noqa: S106
+        new_config["moved"]["site"] = "http://chat.example.com"
+        lib_modules: Dict[str, Any] = {bot: mock.Mock() for bot in old_config}
+
+        with mock.patch(
+            "zulip_botserver.server.load_bot_handler", side_effect=lambda *args: mock.MagicMock()
+        ), mock.patch("zulip_botserver.server.init_message_handler"), mock.patch(
+            "zulip_botserver.server.load_lib_modules",
+            side_effect=lambda bots: {bot: mock.Mock() for bot in bots},
+        ):
+            old_loader = server.BotLoader(lib_modules, old_config)
+            old_loader.start()
+            old_loader.wait()
+            server.app.config["BOT_LOADER"] = old_loader
+            self.addCleanup(server.app.config.pop, "BOT_LOADER")
+            changes = server.reload_bots(mock.Mock(isolate=[]), new_config)
+
+        self.assertEqual(changes, dict(added=["added"], removed=["removed"], changed=["moved"]))
+        new_loader = server.app.config["BOT_LOADER"]
+        self.assertEqual(set(new_loader.bot_handlers), set(new_config))
+        for bot in ["kept", "rotated"]:
+            self.assertIs(new_loader.bot_handlers[bot], old_loader.bot_handlers[bot])
+        self.assertIsNot(new_loader.bot_handlers["moved"], old_loader.bot_handlers["moved"])
+        old_handlers: Dict[str, Any] = old_loader.bot_handlers
+        for bot in ["moved", "removed"]:
+            old_handlers[bot].scheduler.stop.assert_called_once()
+        old_handlers["kept"].scheduler.stop.assert_not_called()
+        self.assertTrue(new_loader.routes.check_token("rotated", "new-token"))
+        self.assertEqual(new_loader.routes.find("added-bot@zulip.com"), "added")
+
+        with self.assertRaises(server.ReloadError):
+            server.reload_bots(mock.Mock(isolate=[]), {"broken": {"email": "broken-bot@zulip.com"}})
+        self.assertIs(server.app.config["BOT_LOADER"], new_loader)
+
+    def test_reload_endpoint(self) -> None:
+        reload = mock.Mock(return_value=dict(added=[], removed=[], changed=[]))
+        server.app.config["RELOAD"] = reload
+        self.addCleanup(server.app.config.pop, "RELOAD")
+        server.app.config["ADMIN_TOKEN"] = None
+        self.addCleanup(server.app.config.pop, "ADMIN_TOKEN")
+        self.assertEqual(self.app.post("/admin/reload").status_code, 404)
+
+        server.app.config["ADMIN_TOKEN"] = "secret"  # noqa: S105
+        response = self.app.post("/admin/reload", headers={"Authorization": "Bearer wrong"})
+        self.assertEqual(response.status_code, 401)
+        response = self.app.post("/admin/reload", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+        reload.assert_called_once_with(None)
+
+        reload.side_effect = server.ReloadError("bad config")
+        response = self.app.post(
+            "/admin/reload", headers={"Authorization": "Bearer secret"}, json={"bot": {}}
+        )
+        self.assertEqual(response.status_code, 400)
+        reload.assert_called_with({"bot": {}})
+
+    def test_duplicate_webhook(self) -> None:
+        message_handler = mock.Mock()
+        self._set_up_bot(mock.MagicMock(full_name="test"), message_handler)
+        server.app.config["DEDUPE"] = DedupeCache()
+        self.addCleanup(server.app.config.pop, "DEDUPE")
+        event = dict(
+            message={"id": 1, "content": "@**test** hello"},
+            bot_email="helloworld-bot@zulip.com",
+            trigger="mention",
+            token="abcd1234",  # noqa: S106
+        )
+        for _ in range(2):
+            response = self.app.post(data=json.dumps(event))
+            self.assertEqual(json.loads(response.data), dict(response_not_required=True))
+        message_handler.handle_message.assert_called_once()
+        self.assertIn(
+            'botserver_webhooks_total{bot="helloworld",outcome="duplicate"} 1',
+            self.app.get("/metrics").data.decode(),
+        )
+
+    def test_duplicate_webhook_after_error(self) -> None:
+        message_handler = mock.Mock()
+        self._set_up_bot(mock.MagicMock(full_name="test"), message_handler)
+        server.app.config["DEDUPE"] = DedupeCache()
+        self.addCleanup(server.app.config.pop, "DEDUPE")
+        event = dict(
+            message={"id": 1, "content": "@**test** hello"},
+            bot_email="helloworld-bot@zulip.com",
+            trigger="mention",
+            token="abcd1234",  # noqa: S106
+        )
+        full_queue = WorkQueue(threads=1, max_queued=0)
+        with mock.patch.dict(server.app.config, WORK_QUEUE=full_queue), self.assertLogs(
+            level="WARNING"
+        ):
+            response = self.app.post(data=json.dumps(event))
+        self.assertEqual(response.status_code, 503)
+        message_handler.handle_message.assert_not_called()
+
+        # Zulip sends the webhook again, which isn't a duplicate of the
+        # one turned away; one sent after that is.
+        for _ in range(2):
+            response = self.app.post(data=json.dumps(event))
+            self.assertEqual(response.status_code, 200)
+        message_handler.handle_message.assert_called_once()
+
+    def test_isolated_bot(self) -> None:
+        bots_config = {
+            "helloworld": {
+                "email": "helloworld-bot@zulip.com",
+                "key": "123456789qwertyuiop",
+                "site": "http://localhost",
+                "token": "abcd1234",
+            }
+        }
+        process = mock.Mock()
+        process.handle.side_effect = [
+            dict(handled=True, response=dict(content="beep boop")),
+            dict(handled=False),
+            BotProcessError("The process of bot helloworld exited."),
+        ]
+        loader = server.BotLoader(
+            {"helloworld": mock.Mock()}, bots_config, processes={"helloworld": process}
+        )
+        with mock.patch("zulip_botserver.server.load_bot_handler") as load_bot_handler:
+            loader.start()
+        load_bot_handler.assert_not_called()
+        process.start.assert_called_once()
+        server.app.config["BOT_LOADER"] = loader
+        self.addCleanup(server.app.config.pop, "BOT_LOADER")
+        event = dict(
+            message={"id": 1, "content": "@**test** hello"},
+            bot_email="helloworld-bot@zulip.com",
+            trigger="mention",
+            token="abcd1234",  # noqa: S106
+        )
+
+        response = self.app.post(data=json.dumps(event))
+        self.assertEqual(json.loads(response.data), dict(content="beep boop"))
+        process.handle.assert_called_with(
+            dict(message=event["message"], is_mentioned=True, is_direct_message=False)
+        )
+        response = self.app.post(data=json.dumps(event))
+        self.assertEqual(json.loads(response.data), dict(response_not_required=True))
+        self.assertEqual(self.app.post(data=json.dumps(event)).status_code, 503)
+
+    def test_healthz_and_metrics(self) -> None:
+        message_handler = mock.Mock()
+        bot_handler = mock.MagicMock(full_name="test")
+        bot_handler.outbound.stats.return_value = dict(calls_sent=1, calls_delayed=0, queue_depth=0)
+        self._set_up_bot(bot_handler, message_handler)
+        event = dict(
+            message={"id": 1, "content": "@**test** hello"},
+            bot_email="helloworld-bot@zulip.com",
+            trigger="mention",
+            token="abcd1234",  # noqa: S106
+        )
+        self.assertEqual(self.app.post(data=json.dumps(event)).status_code, 200)
+
+        response = self.app.get("/healthz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["status"], "ok")
+
+        response = self.app.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        text = response.data.decode()
+        self.assertIn('botserver_webhooks_total{bot="helloworld",outcome="handled"}', text)
+        self.assertIn('botserver_message_seconds_count{bot="helloworld"}', text)
+        self.assertIn('botserver_outbound_calls_total{bot="helloworld"} 1', text)
+
+        server.app.config["ADMIN_TOKEN"] = "secret"  # noqa: S105
+        self.addCleanup(server.app.config.pop, "ADMIN_TOKEN")
+        self.assertEqual(self.app.get("/metrics").status_code, 401)
+        response = self.app.get("/metrics", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_healthz_degraded(self) -> None:
+        bots_config = {
+            bot: {
+                "email": f"{bot}-bot@zulip.com",
+                "key": "123456789qwertyuiop",
+                "site": "http://localhost",
+                "token": "abcd1234",
+            }
+            for bot in ["helloworld", "broken"]
+        }
+        lib_modules: Dict[str, Any] = {bot: mock.Mock() for bot in bots_config}
+        failures = [RuntimeError("site unreachable")]
+
+        def load_bot_handler(lib_module: Any, bot_config: Dict[str, str], *args: Any) -> Any:
+            if bot_config["email"] == "broken-bot@zulip.com" and failures:
+                error = failures.pop()
+                raise error
+            return mock.MagicMock(full_name="test")
+
+        def get_health() -> Tuple[int, Dict[str, Any]]:
+            response = self.app.get("/healthz")
+            return response.status_code, json.loads(response.data)
+
+        with mock.patch(
+            "zulip_botserver.server.load_bot_handler", side_effect=load_bot_handler
+        ), mock.patch("zulip_botserver.server.init_message_handler"):
+            # No bot is ready before the first webhook with --lazy-init.
+            loader = server.BotLoader(lib_modules, bots_config, lazy=True)
+            server.app.config["BOT_LOADER"] = loader
+            self.addCleanup(server.app.config.pop, "BOT_LOADER")
+            self.assertEqual(
+                get_health(), (200, dict(status="ok", bots=2, bots_ready=0, bots_failed=[]))
+            )
+
+            loader = server.BotLoader(lib_modules, bots_config)
+            server.app.config["BOT_LOADER"] = loader
+            self.assertEqual(get_health()[0], 503)
+            with self.assertLogs(level="ERROR"):
+                loader.start()
+                loader.wait()
+            status, health = get_health()
+            self.assertEqual(status, 503)
+            self.assertEqual(health["status"], "degraded")
+            self.assertEqual(health["bots_failed"], ["broken"])
+
+            loader.load("broken")
+            self.assertEqual(
+                get_health(), (200, dict(status="ok", bots=2, bots_ready=2, bots_failed=[]))
+            )
+
     def test_request_for_unkown_bot(self) -> None:
         bots_config = {
             "helloworld": {
@@ -162,6 +566,15 @@ class BotServerTests(BotServerTestCase):
         assert opts.bot_config_file is None
         assert opts.hostname == "127.0.0.1"
         assert opts.port == 5002
+        assert opts.dedupe_window == 300
+
+    def test_inline_replies_turn_off_dedupe(self) -> None:
+        args = ["zulip-botserver", "--config-file", "/foo/bar/baz.conf", "--inline-replies"]
+        with mock.patch("sys.argv", args):
+            assert parse_args().dedupe_window == 0
+        with mock.patch("sys.argv", [*args, "--dedupe-window", "60"]):
+            with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+                parse_args()
 
     def test_read_config_from_env_vars(self) -> None:
         # We use an OrderedDict so that the order of the entries in
@@ -283,6 +696,9 @@ class BotServerTests(BotServerTestCase):
     @mock.patch("zulip_botserver.server.app")
     @mock.patch("sys.argv", ["zulip-botserver", "--config-file", "/foo/bar/baz.conf"])
     def test_load_from_registry(self, mock_app: mock.Mock) -> None:
+        # The registry index is built once per process; rebuild it from the mocks.
+        finder.clear_registry_index()
+        self.addCleanup(finder.clear_registry_index)
         packaged_bot_module = mock.MagicMock(__version__="1.0.0", __file__="asd")
         packaged_bot_entrypoint = metadata.EntryPoint(
             "packaged_bot", "module_name", "zulip_bots.registry"
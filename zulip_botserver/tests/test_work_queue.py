@@ -0,0 +1,75 @@
+import functools
+import threading
+from typing import List, Tuple
+from unittest import TestCase
+
+from zulip_botserver.work_queue import WorkQueue
+
+
+class WorkQueueTest(TestCase):
+    def test_conversations_keep_their_order(self) -> None:
+        handled: List[Tuple[str, int]] = []
+        lock = threading.Lock()
+
+        def task(conversation: str, number: int) -> None:
+            with lock:
+                handled.append((conversation, number))
+
+        queue = WorkQueue(threads=4, bot_concurrency=4)
+        for number in range(50):
+            for conversation in ["a", "b", "c"]:
+                queue.submit("bot", conversation, functools.partial(task, conversation, number))
+        queue.start()
+        queue.stop(timeout=10)
+
+        self.assertEqual(len(handled), 150)
+        for conversation in ["a", "b", "c"]:
+            numbers = [number for c, number in handled if c == conversation]
+            self.assertEqual(numbers, list(range(50)))
+        self.assertEqual(queue.stats()["handled"], 150)
+
+    def test_bot_concurrency_limit(self) -> None:
+        running = dict(now=0, max=0)
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def slow_task() -> None:
+            with lock:
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+            release.wait(10)
+            with lock:
+                running["now"] -= 1
+
+        queue = WorkQueue(threads=8, bot_concurrency=2)
+        queue.start()
+        for conversation in range(6):
+            queue.submit("slow", str(conversation), slow_task)
+        other_done = threading.Event()
+        # Another bot isn't held up by the slow one.
+        queue.submit("other", "", other_done.set)
+        self.assertTrue(other_done.wait(10))
+        release.set()
+        queue.stop(timeout=10)
+        self.assertEqual(running["max"], 2)
+
+    def test_full_queue_drops_messages(self) -> None:
+        queue = WorkQueue(threads=1, max_queued=2)
+        with self.assertLogs(level="WARNING"):
+            results = [queue.submit("bot", "", lambda: None) for _ in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(queue.stats()["queued"], 2)
+        self.assertEqual(queue.stats()["dropped"], 2)
+
+    def test_failures_are_counted(self) -> None:
+        def fail() -> None:
+            raise RuntimeError("boom")
+
+        queue = WorkQueue(threads=1)
+        queue.submit("bot", "", fail)
+        queue.submit("bot", "", lambda: None)
+        with self.assertLogs(level="ERROR"):
+            queue.start()
+            queue.stop(timeout=10)
+        stats = queue.stats()
+        self.assertEqual((stats["handled"], stats["failed"]), (1, 1))
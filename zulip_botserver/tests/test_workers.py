@@ -0,0 +1,90 @@
+import http.client
+import os
+import signal
+import time
+from typing import Any, Callable, Dict, Iterable, Set
+from unittest import TestCase, skipUnless
+
+from zulip_botserver.workers import InFlightRequests, WorkerPool
+
+
+def pid_app(environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [str(os.getpid()).encode()]
+
+
+@skipUnless(hasattr(os, "fork"), "needs os.fork")
+class WorkerPoolTest(TestCase):
+    def _start_pool(self, workers: int) -> int:
+        pool = WorkerPool(pid_app, "127.0.0.1", 0, workers, init_worker=lambda: None)
+        port = pool.bind()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                pool.run()
+            finally:
+                os._exit(0)
+        assert pool.socket is not None
+        pool.socket.close()
+        self.addCleanup(self._stop_pool, pid)
+        self.master = pid
+        return port
+
+    def _stop_pool(self, pid: int) -> None:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+    def _worker_pids(self, port: int, requests: int = 40) -> Set[str]:
+        pids = set()
+        for _ in range(requests):
+            # The workers are other processes, out of reach of Flask's test client.
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            try:
+                connection.request("GET", "/")
+                pids.add(connection.getresponse().read().decode())
+            finally:
+                connection.close()
+        return pids
+
+    def test_workers_serve_and_reload(self) -> None:
+        port = self._start_pool(2)
+        old_pids = self._worker_pids(port)
+        self.assertNotIn(str(self.master), old_pids)
+
+        os.kill(self.master, signal.SIGHUP)
+        deadline = time.monotonic() + 10
+        new_pids = self._worker_pids(port)
+        while new_pids & old_pids and time.monotonic() < deadline:
+            time.sleep(0.1)
+            new_pids = self._worker_pids(port)
+        self.assertFalse(new_pids & old_pids)
+
+    def test_dead_worker_is_restarted(self) -> None:
+        port = self._start_pool(1)
+        (old_pid,) = self._worker_pids(port, requests=1)
+        os.kill(int(old_pid), signal.SIGKILL)
+        new_pid = old_pid
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                (new_pid,) = self._worker_pids(port, requests=1)
+                if new_pid != old_pid:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.1)
+        self.assertNotEqual(new_pid, old_pid)
+
+
+class InFlightRequestsTest(TestCase):
+    def test_counts_requests(self) -> None:
+        counts = []
+
+        def app(environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+            counts.append(middleware.count)
+            return [b"ok"]
+
+        middleware = InFlightRequests(app)
+        self.assertEqual(middleware({}, lambda *args: None), [b"ok"])
+        self.assertEqual(counts, [1])
+        self.assertTrue(middleware.wait_idle(0))
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+import argparse
+import http.client
+import itertools
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from typing_extensions import override
+
+from zulip_bots.replay import StubZulipServer, percentile, read_transcript, synthetic_transcript
+
+
+def decode_param(value: str) -> Any:
+    # The Zulip client sends lists and dicts as JSON.
+    if value.startswith(("[", "{")):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The requests and responses are small; don't let Nagle's algorithm hold them up.
+    disable_nagle_algorithm = True
+    server: "StandInZulipServer"
+
+    @override
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def handle_api_call(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        request = {
+            name: decode_param(value)
+            for name, value in urllib.parse.parse_qsl(url.query) + urllib.parse.parse_qsl(body)
+        }
+        endpoint = url.path.removeprefix("/api/v1/")
+        data = json.dumps(self.server.api_call(self.command, endpoint, request)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_api_call  # noqa: N815
+
+
+class StandInZulipServer(ThreadingHTTPServer):
+    """
+    Serves a StubZulipServer over HTTP, as the Zulip site of the bots of
+    the Botserver being benchmarked, so that their API calls are
+    answered locally, and counted.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], stub: StubZulipServer) -> None:
+        super().__init__(address, StandInHandler)
+        self.stub = stub
+        self._lock = threading.Lock()
+
+    def api_call(self, method: str, endpoint: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            return self.stub.handle(method, endpoint, request)
+
+    def calls(self) -> "Counter[str]":
+        with self._lock:
+            return Counter(self.stub.calls)
+
+
+def webhook_payloads(
+    events: List[Dict[str, Any]], bot_email: str, token: str
+) -> List[Dict[str, Any]]:
+    """
+    Turns a transcript's lines into outgoing webhook payloads for the
+    bot.  Lines that are already payloads, as captured from Zulip, are
+    only given the bot's email and token.
+    """
+    payloads = []
+    for event in events:
+        if "trigger" in event:
+            payload = dict(event)
+        else:
+            message = event["message"]
+            trigger = "mention" if "mentioned" in event.get("flags", []) else "direct_message"
+            payload = dict(message=message, data=message.get("content", ""), trigger=trigger)
+        payload.update(bot_email=bot_email, token=token)
+        payloads.append(payload)
+    return payloads
+
+
+def wait_for_botserver(url: str, timeout: float) -> bool:
+    parts = urllib.parse.urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while True:
+        conn = http.client.HTTPConnection(parts.netloc, timeout=5)
+        try:
+            conn.request("GET", "/healthz")
+            if conn.getresponse().status == 200:
+                return True
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.2)
+
+
+def run_load(
+    url: str,
+    payloads: List[Dict[str, Any]],
+    concurrency: int = 16,
+    duration: Optional[float] = None,
+    requests: Optional[int] = None,
+    rate: Optional[float] = None,
+    first_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Sends `payloads` to the Botserver at `url`, over and over, from
+    `concurrency` connections, until `duration` seconds have passed or
+    `requests` were sent.  With `rate`, the webhooks are sent at that
+    many per second in total, and their latency counts from when they
+    were due, so that a Botserver falling behind shows in it.
+
+    Each webhook's message gets a new id, counting from `first_id`, so
+    that the Botserver doesn't skip it as sent again; with no
+    `first_id`, the payloads' own ids are kept.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    ids = itertools.count()
+    latencies: List[float] = []
+    statuses: Counter[str] = Counter()
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def send_webhooks() -> None:
+        conn = http.client.HTTPConnection(parts.netloc, timeout=60)
+        while True:
+            with lock:
+                index = next(ids)
+            if requests is not None and index >= requests:
+                break
+            now = time.perf_counter()
+            due = start + index / rate if rate else now
+            if duration is not None and max(now, due) - start >= duration:
+                break
+            if due > now:
+                time.sleep(due - now)
+            payload = payloads[index % len(payloads)]
+            if first_id is not None:
+                payload = dict(payload, message=dict(payload["message"], id=first_id + index))
+            try:
+                conn.request(
+                    "POST", path, json.dumps(payload), {"Content-Type": "application/json"}
+                )
+                response = conn.getresponse()
+                response.read()
+                status = str(response.status)
+            except (OSError, http.client.HTTPException):
+                status = "error"
+                conn.close()
+            latency = time.perf_counter() - due
+            with lock:
+                latencies.append(latency)
+                statuses[status] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=send_webhooks) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+    report: Dict[str, Any] = dict(
+        webhooks=len(latencies),
+        seconds=round(elapsed, 3),
+        webhooks_per_second=round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    )
+    latencies.sort()
+    for name, fraction in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)]:
+        report[f"latency_{name}_ms"] = round(percentile(latencies, fraction) * 1000, 3)
+    report["errors"] = errors
+    report["error_rate"] = round(errors / len(latencies), 4) if latencies else 0.0
+    report["statuses"] = dict(sorted(statuses.items()))
+    return report
+
+
+def wait_for_calls(stand_in: StandInZulipServer, quiet_period: float, timeout: float) -> None:
+    """Waits for the bots to stop making API calls, e.g. for messages handled in the background."""
+    deadline = time.monotonic() + timeout
+    calls = stand_in.calls()
+    while time.monotonic() < deadline:
+        time.sleep(quiet_period)
+        new_calls = stand_in.calls()
+        if new_calls == calls:
+            return
+        calls = new_calls
+
+
+def benchmark(
+    args: argparse.Namespace, stand_in: StandInZulipServer, payloads: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    first_id = None if args.keep_ids else int(time.time() * 1000) * 1000
+    if args.warmup:
+        # Initializes the bots, if the Botserver does so lazily.
+        run_load(args.url, payloads, concurrency=1, requests=args.warmup, first_id=first_id)
+        if first_id is not None:
+            first_id += args.warmup
+        wait_for_calls(stand_in, quiet_period=1.0, timeout=30.0)
+    calls_before = stand_in.calls()
+    duration = args.duration if args.duration is not None or args.requests else 10.0
+    report = run_load(
+        args.url,
+        payloads,
+        concurrency=args.concurrency,
+        duration=duration,
+        requests=args.requests,
+        rate=args.rate,
+        first_id=first_id,
+    )
+    wait_for_calls(stand_in, quiet_period=1.0, timeout=30.0)
+    api_calls = stand_in.calls() - calls_before
+    report["api_calls_per_webhook"] = round(sum(api_calls.values()) / max(1, report["webhooks"]), 3)
+    report["api_calls"] = dict(api_calls.most_common())
+    report["concurrency"] = args.concurrency
+    report["target_rate"] = args.rate
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    description = """
+        Sends outgoing webhooks to a running Botserver, as fast as it takes
+        them or at a given rate, and reports its throughput, latency, error
+        rate and API calls per webhook, as JSON.  The bots' Zulip site is a
+        local stand-in, which this serves: point the `site` of the bots in
+        the Botserver's config file at it.
+
+        Examples:   %(prog)s --bot-email bot@example.com --token abcd1234
+                    %(prog)s --bot-email bot@example.com --token abcd1234 \\
+                        --transcript webhooks.jsonl --rate 200 --duration 60
+        """
+
+    parser = argparse.ArgumentParser(
+        description=description, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--url",
+        action="store",
+        default="http://127.0.0.1:5002/",
+        help="the Botserver's URL (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--bot-email", action="store", required=True, help="the email of the bot to send to"
+    )
+    parser.add_argument(
+        "--token", action="store", required=True, help="the bot's outgoing webhook token"
+    )
+    parser.add_argument(
+        "--transcript",
+        "-t",
+        action="store",
+        help="JSONL file of webhook payloads, message events or messages, as for "
+        "zulip-bot-replay (default: generated messages mentioning the bot)",
+    )
+    parser.add_argument(
+        "--content",
+        action="append",
+        help="content of the generated messages; may be repeated (default: help)",
+    )
+    parser.add_argument(
+        "--keep-ids",
+        action="store_true",
+        help="send the messages with their own ids, which the Botserver skips when "
+        "it has seen them",
+    )
+    parser.add_argument(
+        "--concurrency",
+        "-c",
+        action="store",
+        default=16,
+        type=int,
+        help="number of connections sending webhooks (default: %(default)d)",
+    )
+    parser.add_argument(
+        "--rate",
+        action="store",
+        type=float,
+        help="webhooks per second to send, in total (default: as many as the Botserver takes)",
+    )
+    parser.add_argument(
+        "--duration",
+        "-d",
+        action="store",
+        type=float,
+        help="how long to send webhooks, in seconds (default: 10, unless --requests is given)",
+    )
+    parser.add_argument(
+        "--requests", "-n", action="store", type=int, help="how many webhooks to send"
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store",
+        default=10,
+        type=int,
+        help="webhooks sent first, one at a time, and left out of the report "
+        "(default: %(default)d)",
+    )
+    parser.add_argument(
+        "--stand-in",
+        action="store",
+        default="127.0.0.1:9991",
+        help="address of the stand-in Zulip server (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--wait",
+        action="store",
+        default=30.0,
+        type=float,
+        help="how long to wait for the Botserver to be up, in seconds (default: %(default)s)",
+    )
+    parser.add_argument("--output", "-o", action="store", help="also write the report to this file")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    stub = StubZulipServer([], email=args.bot_email)
+    host, _, port = args.stand_in.rpartition(":")
+    stand_in = StandInZulipServer((host, int(port)), stub)
+    threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+
+    if args.transcript:
+        with open(args.transcript) as f:
+            events = read_transcript(f)
+    else:
+        events = synthetic_transcript(100, args.content or ["help"], stub)
+    payloads = webhook_payloads(events, args.bot_email, args.token)
+
+    if not wait_for_botserver(args.url, args.wait):
+        sys.exit(f"Error: The Botserver at {args.url} isn't up.")
+    report = benchmark(args, stand_in, payloads)
+    stand_in.shutdown()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
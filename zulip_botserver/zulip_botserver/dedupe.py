@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Tuple
+
+
+class DedupeCache:
+    """
+    Remembers the messages each bot got in the last `window` seconds, so
+    that the Botserver can skip the webhooks Zulip sends again when a
+    slow bot makes the first one time out.  At most `max_entries` are
+    kept; the oldest are forgotten first.
+    """
+
+    def __init__(
+        self,
+        window: float = 300.0,
+        max_entries: int = 100000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+        # In the order they were seen, so the expired ones come first.
+        self._seen: OrderedDict[Tuple[str, Any], float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, bot: str, message_id: Any) -> bool:
+        """Returns whether `bot` got this message within the window, and remembers it."""
+        key = (bot, message_id)
+        with self._lock:
+            now = self.clock()
+            while self._seen and next(iter(self._seen.values())) <= now - self.window:
+                self._seen.popitem(last=False)
+            if key in self._seen:
+                return True
+            self._seen[key] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return False
+
+    def forget(self, bot: str, message_id: Any) -> None:
+        """Forgets the message, so that Zulip's retry of its webhook gets through."""
+        with self._lock:
+            self._seen.pop((bot, message_id), None)
+
+
+class SqliteDedupeCache:
+    """
+    A `DedupeCache` kept in an SQLite database, which the Botserver's
+    workers share, so that a webhook sent again is skipped whichever
+    worker gets it, and across restarts.
+    """
+
+    def __init__(
+        self, path: str, window: float = 300.0, clock: Callable[[], float] = time.time
+    ) -> None:
+        self.path = path
+        self.window = window
+        self.clock = clock
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_messages ("
+                "bot TEXT NOT NULL, message_id TEXT NOT NULL, seen_at REAL NOT NULL, "
+                "PRIMARY KEY (bot, message_id))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections can't be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        return conn
+
+    def seen(self, bot: str, message_id: Any) -> bool:
+        """Returns whether `bot` got this message within the window, and remembers it."""
+        now = self.clock()
+        conn = self._connect()
+        # Inserts the message, or refreshes it if it expired; changes
+        # nothing, and so no rows, if it was seen within the window.
+        cursor = conn.execute(
+            "INSERT INTO seen_messages (bot, message_id, seen_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (bot, message_id) DO UPDATE SET seen_at = excluded.seen_at "
+            "WHERE seen_at <= ?",
+            (bot, str(message_id), now, now - self.window),
+        )
+        if now - self._last_purge > self.window:
+            self._last_purge = now
+            conn.execute("DELETE FROM seen_messages WHERE seen_at <= ?", (now - self.window,))
+        return cursor.rowcount == 0
+
+    def forget(self, bot: str, message_id: Any) -> None:
+        self._connect().execute(
+            "DELETE FROM seen_messages WHERE bot = ? AND message_id = ?", (bot, str(message_id))
+        )
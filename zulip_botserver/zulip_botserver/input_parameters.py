@@ -1,4 +1,5 @@
 import argparse
+import os
 
 
 def parse_args() -> argparse.Namespace:
@@ -49,4 +50,138 @@ def parse_args() -> argparse.Namespace:
         type=int,
         help="Port on which you want to run the Botserver. (default: %(default)d)",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--slow-threshold",
+        action="store",
+        type=float,
+        help="Log messages that take a bot longer than this many seconds, with a stack sample.",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        action="store",
+        help="Profile the bots, writing profiles here. Send the Botserver SIGUSR1 to start "
+        "and stop profiling.",
+    )
+    parser.add_argument(
+        "--inline-replies",
+        action="store_true",
+        help="Return a bot's reply to the triggering message in the webhook response, "
+        "instead of sending it through the Zulip API. The bot then doesn't get the "
+        "reply's message id.",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        action="store",
+        default=1,
+        type=int,
+        help="Number of worker processes serving the bots, each loading every bot once. "
+        "Send the Botserver SIGHUP to replace them gracefully. (default: %(default)d)",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        action="store",
+        default=30.0,
+        type=float,
+        help="How long a worker being replaced or stopped gets to finish the requests "
+        "it is handling, in seconds. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--background",
+        action="store_true",
+        help="Acknowledge webhooks right away, and handle the messages on a pool of "
+        "threads, so that slow bots don't make Zulip's webhooks time out. Messages in a "
+        "conversation are still handled in order.",
+    )
+    parser.add_argument(
+        "--handler-threads",
+        action="store",
+        default=8,
+        type=int,
+        help="Number of threads handling messages with --background. (default: %(default)d)",
+    )
+    parser.add_argument(
+        "--queue-size",
+        action="store",
+        default=1000,
+        type=int,
+        help="How many messages can wait to be handled with --background; webhooks "
+        "beyond that get a 503 response. (default: %(default)d)",
+    )
+    parser.add_argument(
+        "--bot-concurrency",
+        action="store",
+        default=1,
+        type=int,
+        help="How many messages each bot handles at once with --background, in "
+        "different conversations. (default: %(default)d)",
+    )
+    parser.add_argument(
+        "--init-threads",
+        action="store",
+        default=8,
+        type=int,
+        help="Number of bots initialized at once, when the Botserver starts. "
+        "(default: %(default)d)",
+    )
+    parser.add_argument(
+        "--lazy-init",
+        action="store_true",
+        help="Only initialize a bot when its first webhook comes in.",
+    )
+    parser.add_argument(
+        "--isolate",
+        action="append",
+        default=[],
+        metavar="BOT",
+        help="Run BOT in a process of its own, so that it can't slow down or crash the "
+        "other bots. Can be given several times.",
+    )
+    parser.add_argument(
+        "--isolated-concurrency",
+        action="store",
+        default=1,
+        type=int,
+        help="How many messages each isolated bot's process handles at once. "
+        "(default: %(default)d)",
+    )
+    parser.add_argument(
+        "--isolated-memory-limit",
+        action="store",
+        type=int,
+        metavar="MB",
+        help="Replace an isolated bot's process once it has used more than this much memory.",
+    )
+    parser.add_argument(
+        "--dedupe-window",
+        action="store",
+        type=float,
+        help="Skip the webhooks for a message a bot already got in the last this many "
+        "seconds, which Zulip sends again when a webhook times out. 0 disables this. "
+        "(default: 300, or 0 with --inline-replies)",
+    )
+    parser.add_argument(
+        "--dedupe-db",
+        action="store",
+        metavar="PATH",
+        help="Keep track of the messages the bots got in this SQLite database, shared by "
+        "the workers, rather than in each worker's memory.",
+    )
+    args = parser.parse_args()
+    if args.background and args.inline_replies:
+        parser.error("--inline-replies can't be used with --background")
+    if args.dedupe_window is None:
+        # The reply to a webhook that timed out is lost, so with inline
+        # replies, the bot handles the message again instead.
+        args.dedupe_window = 0.0 if args.inline_replies else 300.0
+    elif args.inline_replies and args.dedupe_window > 0:
+        parser.error(
+            "--inline-replies can't be used with a positive --dedupe-window: the reply "
+            "to the webhook that timed out would be lost"
+        )
+    if args.dedupe_db is not None and args.dedupe_window <= 0:
+        parser.error("--dedupe-db needs a positive --dedupe-window")
+    # The workers are forked, and share their scheduled jobs through flock(2).
+    if args.workers > 1 and not hasattr(os, "fork"):
+        parser.error("--workers is only supported on POSIX systems, such as Linux and macOS")
+    return args
@@ -0,0 +1,289 @@
+import contextlib
+import itertools
+import json
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Optional
+
+# Called once in the bot's process, to load the bot; returns the function
+# handling its webhooks there.
+BotInit = Callable[[], Callable[[Any], Any]]
+
+# A fresh interpreter, rather than a fork of a process with threads running.
+context = multiprocessing.get_context("spawn")
+
+
+class BotProcessError(Exception):
+    pass
+
+
+class BotHandlerError(BotProcessError):
+    """The bot raised an exception handling the message; its process is fine."""
+
+
+def encode(data: Any) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def decode(data: bytes) -> Any:
+    return json.loads(data)
+
+
+def peak_memory() -> int:
+    """The most memory, in bytes, this process has used, or 0 on Windows."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, and kilobytes on Linux and the BSDs.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def serve(conn: Connection, init: BotInit, concurrency: int) -> None:
+    """Runs in the bot's process: handles the requests coming in on `conn`."""
+    # Only the Botserver handles ^C; it stops its bots' processes.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        handle = init()
+    except BaseException as e:
+        logging.exception("Bot failed to initialize")
+        conn.send_bytes(encode(["error", f"{type(e).__name__}: {e}"]))
+        return
+    conn.send_bytes(encode(["ready"]))
+    send_lock = threading.Lock()
+
+    def run(request_id: int, event: Any) -> None:
+        try:
+            response = [request_id, True, handle(event)]
+        except Exception as e:
+            logging.exception("Bot failed to handle a message")
+            response = [request_id, False, f"{type(e).__name__}: {e}"]
+        response.append(peak_memory())
+        with send_lock:
+            conn.send_bytes(encode(response))
+
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="bot-handler") as executor:
+        while True:
+            try:
+                request = decode(conn.recv_bytes())
+            except EOFError:
+                break
+            if request[0] == "stop":
+                break
+            executor.submit(run, request[1], request[2])
+    # Leaving the executor waits for the requests being handled.
+
+
+class Child:
+    def __init__(self, process: BaseProcess, conn: Connection) -> None:
+        self.process = process
+        self.conn = conn
+        self.pending: Dict[int, Future[Any]] = {}
+        self.send_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.closed = False
+        self.retired = False
+
+
+class BotProcess:
+    """
+    Runs a bot in a process of its own, so that a bot hogging the CPU or
+    memory doesn't slow down the Botserver's other bots, and a crashing
+    one doesn't take them down.  The Botserver still routes the bot's
+    webhooks, and forwards them to the process over a pipe, as compact
+    JSON; the process handles at most `concurrency` of them at once, on
+    as many threads, and the others wait their turn.
+
+    The process is restarted when it dies, failing the messages it was
+    handling, and when its peak memory use goes over `memory_limit`
+    bytes, once it has handled the messages it had; messages coming in
+    meanwhile go to its replacement.  A process that fails to start is
+    retried after `restart_delay` seconds, doubling up to a minute.
+    """
+
+    def __init__(
+        self,
+        bot: str,
+        init: BotInit,
+        concurrency: int = 1,
+        memory_limit: Optional[int] = None,
+        start_timeout: float = 60.0,
+        restart_delay: float = 1.0,
+    ) -> None:
+        self.bot = bot
+        self.init = init
+        self.concurrency = concurrency
+        self.memory_limit = memory_limit
+        self.start_timeout = start_timeout
+        self.restart_delay = restart_delay
+        self.restarts = 0
+        self._delay = restart_delay
+        self._child: Optional[Child] = None
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._child is None and not self._stopping:
+                self._child = self._spawn()
+
+    def ready(self) -> bool:
+        child = self._child
+        return child is not None and child.ready.is_set() and child.error is None
+
+    def failed(self) -> bool:
+        child = self._child
+        return child is not None and child.error is not None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the process to start; returns whether it did."""
+        child = self._child
+        if child is None:
+            return False
+        child.ready.wait(timeout if timeout is not None else self.start_timeout)
+        return self.ready()
+
+    def handle(self, event: Any) -> Any:
+        """Has the bot's process handle `event`, and returns what it returned."""
+        with self._slots:
+            with self._lock:
+                child = self._child
+            if child is None or self._stopping:
+                raise BotProcessError(f"The process of bot {self.bot} isn't running.")
+            if not child.ready.wait(self.start_timeout):
+                raise BotProcessError(f"The process of bot {self.bot} didn't start in time.")
+            request_id = next(self._ids)
+            future: Future[Any] = Future()
+            with self._lock:
+                if child.retired:
+                    # Replaced since; its replacement handles the message once it starts.
+                    child = self._child
+                if child is None or child.closed or child.error is not None:
+                    error = child.error if child is not None else None
+                    raise BotProcessError(
+                        f"The process of bot {self.bot} failed: {error or 'it exited'}"
+                    )
+                child.pending[request_id] = future
+            try:
+                with child.send_lock:
+                    child.conn.send_bytes(encode(["message", request_id, event]))
+            except OSError as e:
+                with self._lock:
+                    child.pending.pop(request_id, None)
+                raise BotProcessError(f"The process of bot {self.bot} exited.") from e
+            return future.result()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops the process once it has handled the messages it has."""
+        with self._lock:
+            self._stopping = True
+            child, self._child = self._child, None
+        if child is None:
+            return
+        with contextlib.suppress(OSError), child.send_lock:
+            child.conn.send_bytes(encode(["stop"]))
+        child.process.join(timeout)
+        if child.process.is_alive():
+            logging.warning("Killing the process of bot %s", self.bot)
+            child.process.kill()
+            child.process.join()
+
+    def stats(self) -> Dict[str, Any]:
+        child = self._child
+        return dict(
+            pid=child.process.pid if child is not None else None,
+            ready=self.ready(),
+            restarts=self.restarts,
+            pending=len(child.pending) if child is not None else 0,
+        )
+
+    def _spawn(self) -> Child:
+        conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=serve,
+            args=(child_conn, self.init, self.concurrency),
+            name=f"bot-{self.bot}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        child = Child(process, conn)
+        threading.Thread(
+            target=self._supervise, args=(child,), name=f"bot-{self.bot}-supervisor", daemon=True
+        ).start()
+        return child
+
+    def _supervise(self, child: Child) -> None:
+        with contextlib.suppress(EOFError, OSError):
+            self._read(child)
+        child.conn.close()
+        child.process.join()
+        with self._lock:
+            child.closed = True
+            pending: List[Future[Any]] = list(child.pending.values())
+            child.pending.clear()
+            restart = self._child is child and not self._stopping
+        child.ready.set()
+        for future in pending:
+            future.set_exception(
+                BotProcessError(f"The process of bot {self.bot} exited while handling the message.")
+            )
+        if not restart:
+            return
+        if child.error is not None:
+            # Don't retry a bot that can't start in a busy loop.
+            delay, self._delay = self._delay, min(self._delay * 2, 60.0)
+        else:
+            logging.warning(
+                "The process of bot %s exited with code %s; restarting it",
+                self.bot,
+                child.process.exitcode,
+            )
+            delay = self._delay = self.restart_delay
+        time.sleep(delay)
+        with self._lock:
+            if self._child is child and not self._stopping:
+                self._child = self._spawn()
+                self.restarts += 1
+
+    def _read(self, child: Child) -> None:
+        status = decode(child.conn.recv_bytes())
+        if status[0] == "error":
+            child.error = status[1]
+            logging.error("Bot %s failed to start in its process: %s", self.bot, status[1])
+            return
+        child.ready.set()
+        while not (child.retired and not child.pending):
+            request_id, ok, result, memory = decode(child.conn.recv_bytes())
+            with self._lock:
+                future = child.pending.pop(request_id)
+                if self.memory_limit is not None and memory > self.memory_limit:
+                    self._retire(child, memory)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(BotHandlerError(result))
+        # Closing the pipe stops the retired process.
+
+    def _retire(self, child: Child, memory: int) -> None:
+        if child.retired or self._child is not child or self._stopping:
+            return
+        logging.warning(
+            "The process of bot %s used %d MB, over its limit; replacing it",
+            self.bot,
+            memory // 2**20,
+        )
+        child.retired = True
+        self._child = self._spawn()
+        self.restarts += 1
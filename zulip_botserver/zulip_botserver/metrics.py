@@ -0,0 +1,157 @@
+import bisect
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds, in seconds, of the buckets of the latency histograms.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = buckets
+        # Per bucket, not cumulative; the last one is for +Inf.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class BotMetrics:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self.latency = Histogram(buckets)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metrics:
+    """
+    Counts the Botserver's webhooks and times its bots' message handling,
+    for `/metrics`, which `render` formats in Prometheus' text format.
+    Counts kept elsewhere, like the work queue's or the bots' outbound
+    API calls, are read when rendering.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.bots: Dict[str, BotMetrics] = {}
+        self._lock = threading.Lock()
+
+    def _bot(self, bot: str) -> BotMetrics:
+        metrics = self.bots.get(bot)
+        if metrics is None:
+            metrics = self.bots[bot] = BotMetrics(self.buckets)
+        return metrics
+
+    def count_request(self, bot: str, outcome: str) -> None:
+        """Counts a webhook for `bot`: handled, ignored, queued or rejected."""
+        with self._lock:
+            requests = self._bot(bot).requests
+            requests[outcome] = requests.get(outcome, 0) + 1
+
+    def observe_message(self, bot: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            metrics = self._bot(bot)
+            metrics.latency.observe(seconds)
+            metrics.errors += failed
+
+    def render(
+        self,
+        bot_handlers: Optional[Dict[str, Any]] = None,
+        work_queue_stats: Optional[Dict[str, int]] = None,
+    ) -> str:
+        lines: List[str] = []
+
+        def metric(
+            name: str, kind: str, description: str, samples: List[Tuple[str, Dict[str, str], float]]
+        ) -> None:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{format_labels(labels)} {value}")
+
+        with self._lock:
+            metric(
+                "botserver_webhooks_total",
+                "counter",
+                "Webhooks received, by bot and outcome.",
+                [
+                    ("", dict(bot=bot, outcome=outcome), count)
+                    for bot, metrics in self.bots.items()
+                    for outcome, count in sorted(metrics.requests.items())
+                ],
+            )
+            metric(
+                "botserver_message_errors_total",
+                "counter",
+                "Messages whose handling raised an exception, by bot.",
+                [("", dict(bot=bot), metrics.errors) for bot, metrics in self.bots.items()],
+            )
+            samples: List[Tuple[str, Dict[str, str], float]] = []
+            for bot, metrics in self.bots.items():
+                cumulative = 0
+                for bound, count in zip(
+                    [*(f"{bound:g}" for bound in self.buckets), "+Inf"], metrics.latency.counts
+                ):
+                    cumulative += count
+                    samples.append(("_bucket", dict(bot=bot, le=bound), cumulative))
+                samples.append(("_sum", dict(bot=bot), metrics.latency.sum))
+                samples.append(("_count", dict(bot=bot), metrics.latency.count))
+            metric(
+                "botserver_message_seconds",
+                "histogram",
+                "Time taken to handle a message, by bot.",
+                samples,
+            )
+
+        if bot_handlers is not None:
+            outbound = {bot: handler.outbound.stats() for bot, handler in bot_handlers.items()}
+            metric(
+                "botserver_outbound_calls_total",
+                "counter",
+                "Messages sent and edited through the Zulip API, by bot.",
+                [("", dict(bot=bot), stats["calls_sent"]) for bot, stats in outbound.items()],
+            )
+            metric(
+                "botserver_outbound_calls_delayed_total",
+                "counter",
+                "Outbound API calls delayed by the bot's rate limit, by bot.",
+                [("", dict(bot=bot), stats["calls_delayed"]) for bot, stats in outbound.items()],
+            )
+            metric(
+                "botserver_outbound_queue_depth",
+                "gauge",
+                "Outbound API calls waiting for the bot's rate limit, by bot.",
+                [("", dict(bot=bot), stats["queue_depth"]) for bot, stats in outbound.items()],
+            )
+
+        if work_queue_stats is not None:
+            metric(
+                "botserver_queue_messages",
+                "gauge",
+                "Messages in the work queue, waiting or being handled.",
+                [
+                    ("", dict(state="queued"), work_queue_stats["queued"]),
+                    ("", dict(state="running"), work_queue_stats["running"]),
+                ],
+            )
+            metric(
+                "botserver_queue_dropped_total",
+                "counter",
+                "Messages refused because the work queue was full.",
+                [("", {}, work_queue_stats["dropped"])],
+            )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,143 @@
+import contextlib
+import logging
+import os
+import re
+import threading
+import time
+from types import TracebackType
+from typing import Any, Callable, ContextManager, Dict, Iterator, Optional, Type
+
+from zulip_bots.scheduler import Scheduler
+
+
+class HandlerLock:
+    """
+    Keeps a bot's scheduled jobs from running while the Botserver
+    handles the bot's messages.  Any number of messages are handled at
+    once, each holding the lock `shared`; a job holds it on its own, by
+    using the lock as a context manager.  A job waiting for the lock
+    holds up the messages coming in after it, so that a busy bot still
+    gets to run its jobs.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._sharing = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    @contextlib.contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive and not self._waiting)
+            self._sharing += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._sharing -= 1
+                self._condition.notify_all()
+
+    def __enter__(self) -> None:
+        with self._condition:
+            self._waiting += 1
+            try:
+                self._condition.wait_for(lambda: not self._exclusive and not self._sharing)
+            finally:
+                self._waiting -= 1
+            self._exclusive = True
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        with self._condition:
+            self._exclusive = False
+            self._condition.notify_all()
+
+
+class SchedulerLeases:
+    """
+    Decides which of the processes serving a bot runs its saved scheduled
+    jobs, when there are several, as with `--workers`: the one holding a
+    lock on the bot's file in `directory`.  The others save the jobs their
+    copy of the bot schedules, for that one to run.  The processes that
+    don't hold a bot's lock try to take it every `interval` seconds, so
+    that another takes over when the one holding it exits.
+
+    The locks are taken with flock(2), so the processes must be on the
+    same host.
+    """
+
+    def __init__(self, directory: str, interval: float = 5.0) -> None:
+        self.directory = directory
+        self.interval = interval
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # The file descriptors holding the locks, by bot.
+        self._held: Dict[str, int] = {}
+        self._schedulers: Dict[str, Scheduler] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start_scheduler(
+        self,
+        bot: str,
+        scheduler: Scheduler,
+        dispatch: Callable[[str, Any], None],
+        lock: Optional[ContextManager[Any]] = None,
+    ) -> None:
+        with self._lock:
+            held = self._try_lock(bot)
+            scheduler.start(dispatch, lock, shared=True, run_saved_jobs=held)
+            self._schedulers[bot] = scheduler
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="scheduler-leases", daemon=True
+                )
+                self._thread.start()
+
+    def stop_scheduler(self, scheduler: Scheduler) -> None:
+        """Gives up the lock of the scheduler's bot, unless the bot was replaced."""
+        with self._lock:
+            for bot, bot_scheduler in list(self._schedulers.items()):
+                if bot_scheduler is scheduler:
+                    del self._schedulers[bot]
+                    fd = self._held.pop(bot, None)
+                    if fd is not None:
+                        os.close(fd)
+
+    def holds(self, bot: str) -> bool:
+        return bot in self._held
+
+    def _path(self, bot: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", bot) + ".lock")
+
+    def _try_lock(self, bot: str) -> bool:
+        # Only on POSIX systems, where --workers is supported.
+        import fcntl
+
+        if bot in self._held:
+            return True
+        fd = os.open(self._path(bot), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._held[bot] = fd
+        return True
+
+    def _loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                taken = [
+                    (bot, scheduler)
+                    for bot, scheduler in list(self._schedulers.items())
+                    if bot not in self._held and self._try_lock(bot)
+                ]
+            for bot, scheduler in taken:
+                logging.info("Running the scheduled jobs of bot %s in this process", bot)
+                scheduler.lead()
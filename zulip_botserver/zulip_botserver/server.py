@@ -1,23 +1,50 @@
 #!/usr/bin/env python3
 
+import argparse
+import atexit
 import configparser
+import contextlib
+import functools
+import hmac
 import json
 import logging
 import os
+import signal
 import sys
+import tempfile
+import threading
+import time
+import weakref
 from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from configparser import MissingSectionHeaderError, NoOptionError
 from importlib import import_module
 from types import ModuleType
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from flask import Flask, request
-from werkzeug.exceptions import BadRequest, Unauthorized
+from werkzeug.exceptions import (
+    BadRequest,
+    InternalServerError,
+    NotFound,
+    ServiceUnavailable,
+    Unauthorized,
+)
 
 from zulip import Client
 from zulip_bots import lib
+from zulip_bots.conversation_cache import conversation_key
 from zulip_bots.finder import import_module_from_source, import_module_from_zulip_bot_registry
+from zulip_bots.profiling import Profiler, make_profiler
+from zulip_botserver.dedupe import DedupeCache, SqliteDedupeCache
 from zulip_botserver.input_parameters import parse_args
+from zulip_botserver.isolation import BotHandlerError, BotProcess, BotProcessError
+from zulip_botserver.metrics import Metrics
+from zulip_botserver.scheduling import HandlerLock, SchedulerLeases
+from zulip_botserver.work_queue import WorkQueue
+from zulip_botserver.workers import WorkerPool
+
+CONFIG_KEYS = ["email", "key", "site", "token"]
 
 
 def read_config_section(parser: configparser.ConfigParser, section: str) -> Dict[str, str]:
@@ -139,25 +166,40 @@ def load_bot_handlers(
     bot_lib_modules: Dict[str, ModuleType],
     bots_config: Dict[str, Dict[str, str]],
     third_party_bot_conf: Optional[configparser.ConfigParser] = None,
+    profiler: Optional[Profiler] = None,
 ) -> Dict[str, lib.ExternalBotHandler]:
     bot_handlers = {}
     for bot in available_bots:
-        client = Client(
-            email=bots_config[bot]["email"],
-            api_key=bots_config[bot]["key"],
-            site=bots_config[bot]["site"],
-        )
-        bot_file = bot_lib_modules[bot].__file__
-        assert bot_file is not None
-        bot_dir = os.path.dirname(os.path.abspath(bot_file))
-        bot_handler = lib.ExternalBotHandler(
-            client, bot_dir, bot_details={}, bot_config_parser=third_party_bot_conf
+        bot_handlers[bot] = load_bot_handler(
+            bot_lib_modules[bot], bots_config[bot], third_party_bot_conf, profiler
         )
-
-        bot_handlers[bot] = bot_handler
     return bot_handlers
 
 
+def load_bot_handler(
+    bot_lib_module: ModuleType,
+    bot_config: Dict[str, str],
+    third_party_bot_conf: Optional[configparser.ConfigParser] = None,
+    profiler: Optional[Profiler] = None,
+    pools: Optional[lib.SharedConnectionPools] = None,
+) -> lib.ExternalBotHandler:
+    client = Client(
+        email=bot_config["email"],
+        api_key=bot_config["key"],
+        site=bot_config["site"],
+    )
+    if pools is not None:
+        pools.share(client)
+    if profiler is not None:
+        profiler.instrument_client(client)
+    bot_file = bot_lib_module.__file__
+    assert bot_file is not None
+    bot_dir = os.path.dirname(os.path.abspath(bot_file))
+    return lib.ExternalBotHandler(
+        client, bot_dir, bot_details={}, bot_config_parser=third_party_bot_conf
+    )
+
+
 def init_message_handlers(
     available_bots: List[str],
     bots_lib_modules: Dict[str, Any],
@@ -165,69 +207,474 @@ def init_message_handlers(
 ) -> Dict[str, Any]:
     message_handlers = {}
     for bot in available_bots:
-        bot_lib_module = bots_lib_modules[bot]
-        bot_handler = bot_handlers[bot]
-        message_handler = lib.prepare_message_handler(bot, bot_handler, bot_lib_module)
-        message_handlers[bot] = message_handler
+        message_handlers[bot] = init_message_handler(bot, bots_lib_modules[bot], bot_handlers[bot])
     return message_handlers
 
 
+def init_message_handler(bot: str, bot_lib_module: Any, bot_handler: lib.ExternalBotHandler) -> Any:
+    message_handler = lib.prepare_message_handler(bot, bot_handler, bot_lib_module)
+    dispatch = scheduled_job_runner(message_handler, bot_handler)
+    lock = handler_locks[bot_handler] = HandlerLock()
+    leases: Optional[SchedulerLeases] = app.config.get("SCHEDULER_LEASES")
+    if leases is not None:
+        leases.start_scheduler(bot, bot_handler.scheduler, dispatch, lock)
+    else:
+        bot_handler.scheduler.start(dispatch, lock)
+    return message_handler
+
+
+def message_pipeline(bot_handler: lib.ExternalBotHandler) -> lib.MessagePipeline:
+    # Not deduplicating: a message the Botserver turns away with a 503 is
+    # sent again, and must get through then.  The Botserver's own
+    # DedupeCache skips the webhooks sent again for messages it took.
+    return lib.MessagePipeline.for_bot_handler(bot_handler, dedupe_window=0)
+
+
+def init_isolated_bot(
+    bot: str,
+    bot_config: Dict[str, str],
+    bot_config_file: Optional[str] = None,
+    inline_replies: bool = False,
+    scheduler_leases: Optional[str] = None,
+) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Loads `bot` in a process of its own; returns the function handling
+    the events its `BotProcess` forwards, which decides whether the bot
+    handles the message there, and returns its inline reply, if any.
+    """
+    if scheduler_leases is not None:
+        app.config["SCHEDULER_LEASES"] = SchedulerLeases(scheduler_leases)
+    bot_lib_module = load_lib_modules([bot])[bot]
+    third_party_bot_conf = (
+        parse_config_file(bot_config_file) if bot_config_file is not None else None
+    )
+    bot_handler = load_bot_handler(bot_lib_module, bot_config, third_party_bot_conf)
+    message_handler = init_message_handler(bot, bot_lib_module, bot_handler)
+    pipeline = message_pipeline(bot_handler)
+    app.config["INLINE_REPLIES"] = inline_replies
+
+    def handle_event(event: Dict[str, Any]) -> Dict[str, Any]:
+        message = event["message"]
+        if not pipeline.prepare(message, event["is_mentioned"], event["is_direct_message"]):
+            return dict(handled=False)
+        response = handle_message(bot, bot_handler, message_handler, message)
+        return dict(handled=True, response=response)
+
+    return handle_event
+
+
+def make_bot_processes(
+    options: argparse.Namespace, bots_config: Dict[str, Dict[str, str]], bots: List[str]
+) -> Dict[str, BotProcess]:
+    memory_limit = options.isolated_memory_limit
+    return {
+        bot: BotProcess(
+            bot,
+            functools.partial(
+                init_isolated_bot,
+                bot,
+                bots_config[bot],
+                options.bot_config_file,
+                options.inline_replies,
+                scheduler_leases_directory(options),
+            ),
+            concurrency=options.isolated_concurrency,
+            memory_limit=memory_limit * 2**20 if memory_limit is not None else None,
+        )
+        for bot in bots
+    }
+
+
+class BotRoutes:
+    """
+    Finds the bot a webhook is for, by the bot's email or by the name in
+    the webhook's URL, in constant time, however many bots there are.
+    """
+
+    def __init__(self, bots_config: Dict[str, Dict[str, str]]) -> None:
+        self.bots_config = bots_config
+        self.by_email = {config["email"]: bot for bot, config in bots_config.items()}
+        self.tokens = {bot: config["token"].encode() for bot, config in bots_config.items()}
+
+    def find(self, bot_email: str) -> Optional[str]:
+        return self.by_email.get(bot_email)
+
+    def check_token(self, bot: str, token: str) -> bool:
+        # In constant time, so that the time taken doesn't leak the token.
+        return hmac.compare_digest(self.tokens[bot], token.encode())
+
+
+class BotLoader:
+    """
+    Initializes the Botserver's bots: connects each to its Zulip site,
+    and runs its handler's `initialize`.  This takes a few round trips
+    per bot, so bots are initialized in parallel, on `threads` threads,
+    while the Botserver already serves the bots that are ready; a webhook
+    for a bot that isn't ready yet waits for it.  With `lazy`, a bot is
+    only initialized when its first webhook comes in.
+
+    Bots on the same site share a pool of HTTP connections.  A bot that
+    fails to initialize, say because its site is unreachable, is retried
+    on its next webhook; `timings` has how long each bot took.
+
+    The bots in `processes` run in processes of their own instead, which
+    the loader starts.
+    """
+
+    def __init__(
+        self,
+        bots_lib_modules: Dict[str, ModuleType],
+        bots_config: Dict[str, Dict[str, str]],
+        third_party_bot_conf: Optional[configparser.ConfigParser] = None,
+        profiler: Optional[Profiler] = None,
+        threads: int = 8,
+        lazy: bool = False,
+        pools: Optional[lib.SharedConnectionPools] = None,
+        processes: Optional[Dict[str, BotProcess]] = None,
+    ) -> None:
+        self.bots_lib_modules = bots_lib_modules
+        self.bots_config = bots_config
+        self.third_party_bot_conf = third_party_bot_conf
+        self.profiler = profiler
+        self.threads = threads
+        self.lazy = lazy
+        if pools is None:
+            pools = lib.SharedConnectionPools(pool_maxsize=max(10, len(bots_config)))
+        self.pools = pools
+        self.routes = BotRoutes(bots_config)
+        self.processes = processes if processes is not None else {}
+        self.bot_handlers: Dict[str, lib.ExternalBotHandler] = {}
+        self.message_handlers: Dict[str, Any] = {}
+        self.pipelines: Dict[str, lib.MessagePipeline] = {}
+        self.timings: Dict[str, float] = {}
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="bot-init")
+        self._futures: Dict[str, Future[None]] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        for process in self.processes.values():
+            process.start()
+        if not self.lazy:
+            for bot in self.bots_config:
+                if bot not in self.message_handlers and bot not in self.processes:
+                    self._submit(bot)
+
+    def adopt(self, bot: str, loader: "BotLoader") -> None:
+        """Takes over `bot`, as initialized by another loader, if it was."""
+        if bot in loader.processes:
+            self.processes[bot] = loader.processes[bot]
+            return
+        if bot not in loader.message_handlers:
+            return
+        self.bot_handlers[bot] = loader.bot_handlers[bot]
+        self.pipelines[bot] = loader.pipelines[bot]
+        self.timings[bot] = loader.timings[bot]
+        self.message_handlers[bot] = loader.message_handlers[bot]
+
+    def failed(self) -> List[str]:
+        """The bots that failed to initialize, and weren't retried since."""
+        with self._lock:
+            failed = [
+                bot
+                for bot, future in self._futures.items()
+                if future.done() and future.exception() is not None
+            ]
+        return failed + [bot for bot, process in self.processes.items() if process.failed()]
+
+    def ready(self) -> int:
+        """How many bots are ready to handle messages."""
+        return len(self.message_handlers) + sum(
+            process.ready() for process in self.processes.values()
+        )
+
+    def load(self, bot: str) -> None:
+        """Waits for `bot` to be initialized, initializing it now if needed."""
+        if bot in self.message_handlers:
+            return
+        self._submit(bot).result()
+
+    def wait(self) -> None:
+        """Waits for the bots being initialized; for tests and benchmarks."""
+        for future in list(self._futures.values()):
+            with contextlib.suppress(BaseException):
+                future.result()
+        for process in self.processes.values():
+            process.wait()
+
+    def _submit(self, bot: str) -> Future[None]:
+        with self._lock:
+            future = self._futures.get(bot)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._executor.submit(self._init_bot, bot)
+                self._futures[bot] = future
+            return future
+
+    def _init_bot(self, bot: str) -> None:
+        start = time.monotonic()
+        try:
+            bot_handler = load_bot_handler(
+                self.bots_lib_modules[bot],
+                self.bots_config[bot],
+                self.third_party_bot_conf,
+                self.profiler,
+                self.pools,
+            )
+            message_handler = init_message_handler(bot, self.bots_lib_modules[bot], bot_handler)
+        except BaseException:
+            logging.exception("Bot %s failed to initialize", bot)
+            raise
+        self.timings[bot] = time.monotonic() - start
+        self.pipelines[bot] = message_pipeline(bot_handler)
+        self.bot_handlers[bot] = bot_handler
+        # Set last: a bot is ready once it has a message handler.
+        self.message_handlers[bot] = message_handler
+        logging.info("Bot %s initialized in %.2fs", bot, self.timings[bot])
+        if len(self.timings) == len(self.bots_config):
+            slowest = max(self.timings, key=self.timings.__getitem__)
+            logging.info(
+                "All %d bots initialized; the slowest, %s, took %.2fs",
+                len(self.timings),
+                slowest,
+                self.timings[slowest],
+            )
+
+
+# Held by the bots' messages and scheduled jobs; see HandlerLock.
+handler_locks: "weakref.WeakKeyDictionary[lib.ExternalBotHandler, HandlerLock]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def scheduler_leases_directory(options: argparse.Namespace) -> Optional[str]:
+    """Where the workers of a Botserver with `--workers` take the locks of SchedulerLeases."""
+    if options.workers <= 1:
+        return None
+    return os.path.join(tempfile.gettempdir(), f"zulip-botserver-{options.port}-schedulers")
+
+
+def scheduled_job_runner(
+    message_handler: Any, bot_handler: lib.ExternalBotHandler
+) -> Callable[[str, Any], None]:
+    def run_scheduled_job(method_name: str, data: Any) -> None:
+        getattr(message_handler, method_name)(data, bot_handler)
+
+    return run_scheduled_job
+
+
 app = Flask(__name__)
+app.config["PROFILER"] = None
+app.config["METRICS"] = Metrics()
 bots_config: Dict[str, Dict[str, str]] = {}
+routes = BotRoutes(bots_config)
+
+
+def get_routes() -> BotRoutes:
+    global routes  # noqa: PLW0603
+    current_routes = routes
+    if current_routes.bots_config is not bots_config:
+        # The configuration was replaced; index it once.
+        current_routes = routes = BotRoutes(bots_config)
+    return current_routes
 
 
 @app.route("/", methods=["POST"])
-def handle_bot() -> str:
+@app.route("/bots/<bot_name>", methods=["POST"])
+def handle_bot(bot_name: Optional[str] = None) -> str:
     event = request.get_json(force=True)
     assert event is not None
-    for bot_name, config in bots_config.items():
-        if config["email"] == event["bot_email"]:
-            bot = bot_name
-            bot_config = config
-            break
+    # Read once: a configuration reload swaps the loader.
+    bot_loader: Optional[BotLoader] = app.config.get("BOT_LOADER")
+    current_routes = bot_loader.routes if bot_loader is not None else get_routes()
+    if bot_name is not None:
+        bot = bot_name if bot_name in current_routes.tokens else None
     else:
+        bot = current_routes.find(event["bot_email"])
+    if bot is None and bot_name is not None:
+        raise BadRequest(f"Cannot find a bot named {bot_name} in the Botserver configuration file.")
+    if bot is None:
         raise BadRequest(
             "Cannot find a bot with email {} in the Botserver "
             "configuration file. Do the emails in your botserverrc "
             "match the bot emails on the server?".format(event["bot_email"])
         )
-    if bot_config["token"] != event["token"]:
+    if not current_routes.check_token(bot, event["token"]):
         raise Unauthorized(
             "Request token does not match token found for bot {} in the "
             "Botserver configuration file. Do the outgoing webhooks in "
             "Zulip point to the right Botserver?".format(event["bot_email"])
         )
-    app.config.get("BOTS_LIB_MODULES", {})[bot]
-    bot_handler = app.config.get("BOT_HANDLERS", {})[bot]
-    message_handler = app.config.get("MESSAGE_HANDLERS", {})[bot]
     is_mentioned = event["trigger"] == "mention"
     # TODO/compatibility: Remove the support for "private_message" as a valid
     # trigger value once we no longer support pre-8.0 Zulip servers.
     is_direct_message = event["trigger"] in ["direct_message", "private_message"]
     message = event["message"]
-    message["full_content"] = message["content"]
-    # Strip at-mention botname from the message
-    if is_mentioned:
-        # message['content'] will be None when the bot's @-mention is not at the beginning.
-        # In that case, the message shall not be handled.
-        message["content"] = lib.extract_query_without_mention(message=message, client=bot_handler)
-        if message["content"] is None:
-            return json.dumps(dict(response_not_required=True))
-
-    if is_direct_message or is_mentioned:
-        message_handler.handle_message(message=message, bot_handler=bot_handler)
-    return json.dumps(dict(response_not_required=True))
+    metrics: Metrics = app.config["METRICS"]
+    dedupe: Optional[Union[DedupeCache, SqliteDedupeCache]] = app.config.get("DEDUPE")
+    if dedupe is None or "id" not in message:
+        return handle_bot_message(bot, bot_loader, message, is_mentioned, is_direct_message)
+    if dedupe.seen(bot, message["id"]):
+        # Zulip sent it again, after the first webhook timed out.
+        metrics.count_request(bot, "duplicate")
+        return json.dumps(dict(response_not_required=True))
+    try:
+        return handle_bot_message(bot, bot_loader, message, is_mentioned, is_direct_message)
+    except BaseException:
+        # An error response, e.g. a 503 while the bot initializes or the
+        # queue is full, makes Zulip send the webhook again; let it in.
+        dedupe.forget(bot, message["id"])
+        raise
+
+
+def handle_bot_message(
+    bot: str,
+    bot_loader: Optional[BotLoader],
+    message: Dict[str, Any],
+    is_mentioned: bool,
+    is_direct_message: bool,
+) -> str:
+    metrics: Metrics = app.config["METRICS"]
+    if bot_loader is not None and bot in bot_loader.processes:
+        return handle_in_process(
+            bot,
+            bot_loader.processes[bot],
+            dict(message=message, is_mentioned=is_mentioned, is_direct_message=is_direct_message),
+        )
+    if bot_loader is not None:
+        try:
+            bot_loader.load(bot)
+        except BaseException as e:
+            raise ServiceUnavailable(
+                f"Bot {bot} failed to initialize; see the Botserver's log.", retry_after=10
+            ) from e
+        bot_handler = bot_loader.bot_handlers[bot]
+        message_handler = bot_loader.message_handlers[bot]
+        pipelines = bot_loader.pipelines
+    else:
+        bot_handler = app.config.get("BOT_HANDLERS", {})[bot]
+        message_handler = app.config.get("MESSAGE_HANDLERS", {})[bot]
+        pipelines = app.config.setdefault("MESSAGE_PIPELINES", {})
+    if bot not in pipelines:
+        pipelines[bot] = message_pipeline(bot_handler)
+    if not pipelines[bot].prepare(message, is_mentioned, is_direct_message):
+        metrics.count_request(bot, "ignored")
+        return json.dumps(dict(response_not_required=True))
+    work_queue: Optional[WorkQueue] = app.config.get("WORK_QUEUE")
+    if work_queue is not None:
+        conversation = conversation_key(message) if "type" in message else ""
+        if not work_queue.submit(
+            bot,
+            conversation,
+            lambda: handle_message(bot, bot_handler, message_handler, message),
+        ):
+            metrics.count_request(bot, "rejected")
+            raise ServiceUnavailable(
+                "The Botserver has too many messages waiting to be handled.", retry_after=1
+            )
+        metrics.count_request(bot, "queued")
+        return json.dumps(dict(response_not_required=True))
+    metrics.count_request(bot, "handled")
+    response = handle_message(bot, bot_handler, message_handler, message)
+    return json.dumps(response if response is not None else dict(response_not_required=True))
+
+
+def handle_in_process(bot: str, process: BotProcess, event: Dict[str, Any]) -> str:
+    """Has an isolated bot handle a message in its process."""
+    metrics: Metrics = app.config["METRICS"]
+    work_queue: Optional[WorkQueue] = app.config.get("WORK_QUEUE")
+    if work_queue is not None:
+        message = event["message"]
+        conversation = conversation_key(message) if "type" in message else ""
+        if not work_queue.submit(bot, conversation, lambda: process.handle(event)):
+            metrics.count_request(bot, "rejected")
+            raise ServiceUnavailable(
+                "The Botserver has too many messages waiting to be handled.", retry_after=1
+            )
+        metrics.count_request(bot, "queued")
+        return json.dumps(dict(response_not_required=True))
+    start = time.perf_counter()
+    try:
+        result = process.handle(event)
+    except BotHandlerError as e:
+        metrics.count_request(bot, "handled")
+        metrics.observe_message(bot, time.perf_counter() - start, failed=True)
+        raise InternalServerError(f"Bot {bot} failed to handle the message: {e}") from e
+    except BotProcessError as e:
+        metrics.count_request(bot, "rejected")
+        raise ServiceUnavailable(str(e), retry_after=10) from e
+    if not result["handled"]:
+        metrics.count_request(bot, "ignored")
+        return json.dumps(dict(response_not_required=True))
+    metrics.count_request(bot, "handled")
+    metrics.observe_message(bot, time.perf_counter() - start, failed=False)
+    response = result["response"]
+    return json.dumps(response if response is not None else dict(response_not_required=True))
+
+
+def handle_message(
+    bot: str, bot_handler: lib.ExternalBotHandler, message_handler: Any, message: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """Runs a bot on a message; returns its reply, if it is to be returned inline."""
+    start = time.perf_counter()
+    failed = True
+    # Keeps the bot's scheduled jobs from running meanwhile.
+    lock = handler_locks.get(bot_handler)
+    shared = lock.shared() if lock is not None else contextlib.nullcontext()
+    try:
+        bot_handler.outbound.begin_message(message.get("sender_id") == bot_handler.user_id)
+        profiler = app.config["PROFILER"]
+        profiling = (
+            profiler.message(bot, message) if profiler is not None else contextlib.nullcontext()
+        )
+        with shared, profiling:
+            # The edits held back are sent even if the bot raises.
+            if app.config.get("INLINE_REPLIES", False):
+                try:
+                    with bot_handler.capture_reply(message) as inline_reply:
+                        message_handler.handle_message(message=message, bot_handler=bot_handler)
+                finally:
+                    bot_handler.outbound.flush()
+                failed = False
+                if inline_reply.captured:
+                    return inline_reply.response()
+            else:
+                try:
+                    message_handler.handle_message(message=message, bot_handler=bot_handler)
+                finally:
+                    bot_handler.outbound.flush()
+                failed = False
+        return None
+    finally:
+        app.config["METRICS"].observe_message(bot, time.perf_counter() - start, failed)
 
 
 def main() -> None:
     options = parse_args()
-    global bots_config  # noqa: PLW0603
+    if options.workers > 1:
+        pool = WorkerPool(
+            app,
+            options.hostname,
+            options.port,
+            options.workers,
+            init_worker=lambda: init_app(options),
+            graceful_timeout=options.graceful_timeout,
+            stop_worker=lambda: stop_app(options),
+        )
+        pool.run()
+    else:
+        init_app(options)
+        atexit.register(stop_app, options)
+        # Windows has no SIGHUP; the configuration is reloaded through /admin/reload there.
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: reload_in_background(options))
+        app.run(host=options.hostname, port=int(options.port))
 
+
+def read_bots_config(options: argparse.Namespace) -> Dict[str, Dict[str, str]]:
     if options.use_env_vars:
-        bots_config = read_config_from_env_vars(options.bot_name)
-    elif options.config_file:
+        return read_config_from_env_vars(options.bot_name)
+    else:
         try:
-            bots_config = read_config_file(options.config_file, options.bot_name)
+            return read_config_file(options.config_file, options.bot_name)
         except MissingSectionHeaderError:
             sys.exit(
                 "Error: Your Botserver config file `{0}` contains an empty section header!\n"
@@ -242,19 +689,264 @@ def main() -> None:
                 )
             )
 
+
+def init_app(options: argparse.Namespace) -> None:
+    """Loads the bots, once per process serving them."""
+    global bots_config  # noqa: PLW0603
+    bots_config = read_bots_config(options)
     available_bots = list(bots_config.keys())
     bots_lib_modules = load_lib_modules(available_bots)
     third_party_bot_conf = (
         parse_config_file(options.bot_config_file) if options.bot_config_file is not None else None
     )
-    bot_handlers = load_bot_handlers(
-        available_bots, bots_lib_modules, bots_config, third_party_bot_conf
+    profiler = make_profiler(options.slow_threshold, options.profile_dir)
+    unknown_bots = [bot for bot in options.isolate if bot not in bots_config]
+    if unknown_bots:
+        sys.exit(
+            f"Error: Cannot isolate bots {', '.join(unknown_bots)}: they aren't in the "
+            "Botserver configuration."
+        )
+    bot_loader = BotLoader(
+        bots_lib_modules,
+        bots_config,
+        third_party_bot_conf,
+        profiler,
+        threads=options.init_threads,
+        lazy=options.lazy_init,
+        processes=make_bot_processes(options, bots_config, options.isolate),
     )
-    message_handlers = init_message_handlers(available_bots, bots_lib_modules, bot_handlers)
+    if profiler is not None:
+        profiler.install_signal_handler()
+    app.config["PROFILER"] = profiler
     app.config["BOTS_LIB_MODULES"] = bots_lib_modules
-    app.config["BOT_HANDLERS"] = bot_handlers
-    app.config["MESSAGE_HANDLERS"] = message_handlers
-    app.run(host=options.hostname, port=int(options.port))
+    # Filled in by the loader as the bots are ready.
+    app.config["BOT_LOADER"] = bot_loader
+    app.config["BOT_HANDLERS"] = bot_loader.bot_handlers
+    app.config["MESSAGE_HANDLERS"] = bot_loader.message_handlers
+    app.config["MESSAGE_PIPELINES"] = bot_loader.pipelines
+    app.config["INLINE_REPLIES"] = options.inline_replies
+    app.config["ADMIN_TOKEN"] = os.environ.get("ZULIP_BOTSERVER_ADMIN_TOKEN")
+    leases_directory = scheduler_leases_directory(options)
+    if leases_directory is not None:
+        # Only one worker runs each bot's saved scheduled jobs.
+        app.config["SCHEDULER_LEASES"] = SchedulerLeases(leases_directory)
+    if options.workers > 1:
+        app.config["RELOAD"] = reload_workers
+    else:
+        app.config["RELOAD"] = lambda new_config: reload_bots(options, new_config)
+    if options.dedupe_db is not None:
+        app.config["DEDUPE"] = SqliteDedupeCache(options.dedupe_db, options.dedupe_window)
+    elif options.dedupe_window > 0:
+        app.config["DEDUPE"] = DedupeCache(options.dedupe_window)
+    if options.background:
+        work_queue = WorkQueue(options.handler_threads, options.queue_size, options.bot_concurrency)
+        work_queue.start()
+        app.config["WORK_QUEUE"] = work_queue
+    bot_loader.start()
+
+
+class ReloadError(Exception):
+    pass
+
+
+reload_lock = threading.Lock()
+
+
+def reload_bots(
+    options: argparse.Namespace, new_config: Optional[Dict[str, Dict[str, str]]] = None
+) -> Dict[str, List[str]]:
+    """
+    Reloads the Botserver's configuration, or switches to `new_config`.
+    Only the bots that were added, or whose email, key or site changed,
+    are initialized; the others keep running as they are.  The new
+    configuration only takes effect once those bots are ready, all at
+    once; if any fails to initialize, the reload is abandoned.
+    """
+    global bots_config  # noqa: PLW0603
+    with reload_lock:
+        old_loader: BotLoader = app.config["BOT_LOADER"]
+        try:
+            if new_config is None:
+                new_config = read_bots_config(options)
+            check_bots_config(new_config)
+            old_config = old_loader.bots_config
+            added = [bot for bot in new_config if bot not in old_config]
+            removed = [bot for bot in old_config if bot not in new_config]
+            changed = [
+                bot
+                for bot in new_config
+                if bot in old_config
+                and any(
+                    new_config[bot][key] != old_config[bot][key] for key in ["email", "key", "site"]
+                )
+            ]
+            new_lib_modules = {
+                bot: module
+                for bot, module in old_loader.bots_lib_modules.items()
+                if bot in new_config
+            }
+            new_lib_modules.update(load_lib_modules(added))
+        except (SystemExit, Exception) as e:
+            raise ReloadError(f"Could not reload the Botserver's configuration: {e}") from e
+
+        new_loader = BotLoader(
+            new_lib_modules,
+            new_config,
+            old_loader.third_party_bot_conf,
+            old_loader.profiler,
+            threads=old_loader.threads,
+            lazy=old_loader.lazy,
+            pools=old_loader.pools,
+            processes=make_bot_processes(
+                options,
+                new_config,
+                [bot for bot in options.isolate if bot in added or bot in changed],
+            ),
+        )
+        for bot in new_config:
+            if bot not in added and bot not in changed:
+                new_loader.adopt(bot, old_loader)
+        new_loader.start()
+        new_loader.wait()
+        failed = new_loader.failed()
+        if failed:
+            for bot in new_loader.bot_handlers:
+                if bot in added or bot in changed:
+                    stop_bot(new_loader.bot_handlers[bot])
+            for bot, process in new_loader.processes.items():
+                if bot in added or bot in changed:
+                    process.stop()
+            raise ReloadError(
+                "Could not reload the Botserver's configuration: bots {} failed to "
+                "initialize".format(", ".join(failed))
+            )
+
+        app.config["BOT_LOADER"] = new_loader
+        app.config["BOTS_LIB_MODULES"] = new_loader.bots_lib_modules
+        app.config["BOT_HANDLERS"] = new_loader.bot_handlers
+        app.config["MESSAGE_HANDLERS"] = new_loader.message_handlers
+        app.config["MESSAGE_PIPELINES"] = new_loader.pipelines
+        bots_config = new_config
+        for bot in removed + changed:
+            if bot in old_loader.bot_handlers:
+                stop_bot(old_loader.bot_handlers[bot])
+            if bot in old_loader.processes:
+                old_loader.processes[bot].stop(options.graceful_timeout)
+        logging.info(
+            "Reloaded the configuration: %d bots added, %d removed, %d changed",
+            len(added),
+            len(removed),
+            len(changed),
+        )
+        return dict(added=added, removed=removed, changed=changed)
+
+
+def reload_workers(new_config: Optional[Dict[str, Dict[str, str]]]) -> None:
+    if new_config is not None:
+        raise ReloadError(
+            "A Botserver with several workers can't take a new configuration this way; "
+            "change its config file instead."
+        )
+    # The main process replaces the workers, which read the configuration again.
+    os.kill(os.getppid(), signal.SIGHUP)
+
+
+def check_bots_config(new_config: Any) -> None:
+    if not isinstance(new_config, dict) or not all(
+        isinstance(config, dict) and all(isinstance(config.get(key), str) for key in CONFIG_KEYS)
+        for config in new_config.values()
+    ):
+        raise ReloadError(
+            "The configuration should map bot names to their {}.".format(", ".join(CONFIG_KEYS))
+        )
+
+
+def stop_bot(bot_handler: lib.ExternalBotHandler) -> None:
+    # Saves the bot's jobs before another worker can take them over.
+    bot_handler.scheduler.stop()
+    leases: Optional[SchedulerLeases] = app.config.get("SCHEDULER_LEASES")
+    if leases is not None:
+        leases.stop_scheduler(bot_handler.scheduler)
+    bot_handler.http.close()
+
+
+def reload_in_background(options: argparse.Namespace) -> None:
+    def reload() -> None:
+        try:
+            reload_bots(options)
+        except ReloadError as e:
+            logging.error("%s", e)
+
+    # Don't hold up the server's thread, which the signal interrupted.
+    threading.Thread(target=reload, name="botserver-reload").start()
+
+
+def check_admin_token() -> None:
+    admin_token = app.config.get("ADMIN_TOKEN")
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {admin_token}".encode()):
+        raise Unauthorized("Wrong admin token.")
+
+
+@app.route("/admin/reload", methods=["POST"])
+def handle_reload() -> Tuple[str, int]:
+    if not app.config.get("ADMIN_TOKEN"):
+        raise NotFound
+    check_admin_token()
+    new_config = request.get_json(silent=True)
+    try:
+        changes = app.config["RELOAD"](new_config)
+    except ReloadError as e:
+        raise BadRequest(str(e)) from e
+    if changes is None:
+        return json.dumps(dict(result="success", msg="Reloading the workers.")), 202
+    return json.dumps(dict(result="success", **changes)), 200
+
+
+@app.route("/healthz", methods=["GET"])
+def handle_healthz() -> Tuple[str, int]:
+    bot_loader: Optional[BotLoader] = app.config.get("BOT_LOADER")
+    health: Dict[str, Any] = dict(status="ok")
+    if bot_loader is not None:
+        health.update(
+            bots=len(bot_loader.bots_config),
+            bots_ready=bot_loader.ready(),
+            bots_failed=bot_loader.failed(),
+        )
+        # With --lazy-init, no bot is ready before its first webhook.
+        if health["bots_failed"] or (not health["bots_ready"] and not bot_loader.lazy):
+            health["status"] = "degraded"
+            return json.dumps(health), 503
+    return json.dumps(health), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def handle_metrics() -> Tuple[str, int, Dict[str, str]]:
+    if app.config.get("ADMIN_TOKEN"):
+        check_admin_token()
+    bot_loader: Optional[BotLoader] = app.config.get("BOT_LOADER")
+    bot_handlers = (
+        bot_loader.bot_handlers if bot_loader is not None else app.config.get("BOT_HANDLERS", {})
+    )
+    work_queue: Optional[WorkQueue] = app.config.get("WORK_QUEUE")
+    metrics: Metrics = app.config["METRICS"]
+    text = metrics.render(
+        dict(bot_handlers), work_queue.stats() if work_queue is not None else None
+    )
+    return text, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+def stop_app(options: argparse.Namespace) -> None:
+    work_queue: Optional[WorkQueue] = app.config.pop("WORK_QUEUE", None)
+    if work_queue is not None:
+        # Handle the messages already acknowledged.
+        work_queue.stop(options.graceful_timeout)
+    bot_loader: Optional[BotLoader] = app.config.get("BOT_LOADER")
+    if bot_loader is not None:
+        for process in bot_loader.processes.values():
+            process.stop(options.graceful_timeout)
+        for bot_handler in bot_loader.bot_handlers.values():
+            stop_bot(bot_handler)
 
 
 if __name__ == "__main__":
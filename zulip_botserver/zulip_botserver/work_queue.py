@@ -0,0 +1,161 @@
+import logging
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+Task = Callable[[], object]
+# A conversation is identified by its bot, and its key within the bot.
+ConversationId = Tuple[str, str]
+
+
+class WorkQueue:
+    """
+    Runs bots' message handling on a pool of threads, so that the
+    Botserver can acknowledge Zulip's outgoing webhooks before a slow bot
+    makes them time out.
+
+    The messages of a conversation are handled one at a time, in the
+    order they came in, and each bot handles at most `bot_concurrency`
+    messages at once; bots take turns for the free threads.  At most
+    `max_queued` messages wait to be handled; `submit` refuses more, so
+    that the Botserver can answer with a 503 rather than fall further
+    and further behind.
+    """
+
+    def __init__(self, threads: int = 8, max_queued: int = 1000, bot_concurrency: int = 1) -> None:
+        self.threads = threads
+        self.max_queued = max_queued
+        self.bot_concurrency = bot_concurrency
+        self._condition = threading.Condition()
+        # The messages waiting in each conversation; a conversation is
+        # only in here while it has messages waiting or being handled.
+        self._conversations: Dict[ConversationId, Deque[Task]] = {}
+        # Conversations with messages waiting and none being handled.
+        self._ready: Dict[str, Deque[ConversationId]] = {}
+        # Bots with ready conversations and a free slot, in turn order.
+        self._runnable: Deque[str] = deque()
+        self._runnable_set: Set[str] = set()
+        self._running: Dict[str, int] = {}
+        self._workers: List[threading.Thread] = []
+        self._stopping = False
+        self._full = False
+        self.queued = 0
+        self.dropped = 0
+        self.handled = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        with self._condition:
+            self._stopping = False
+            while len(self._workers) < self.threads:
+                worker = threading.Thread(
+                    target=self._work, name=f"botserver-worker-{len(self._workers)}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops the threads once they have handled the messages already queued."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.join(timeout)
+
+    def submit(self, bot: str, conversation: str, task: Task) -> bool:
+        """Queues `task`; returns False, and drops it, if the queue is full."""
+        with self._condition:
+            if self.queued >= self.max_queued:
+                if not self._full:
+                    logging.warning(
+                        "Work queue full, with %d messages waiting; dropping messages",
+                        self.queued,
+                    )
+                self._full = True
+                self.dropped += 1
+                return False
+            if self._full:
+                logging.warning("Work queue no longer full; %d messages dropped", self.dropped)
+            self._full = False
+            self.queued += 1
+            conversation_id = (bot, conversation)
+            tasks = self._conversations.get(conversation_id)
+            if tasks is None:
+                tasks = self._conversations[conversation_id] = deque()
+                self._ready.setdefault(bot, deque()).append(conversation_id)
+                self._make_runnable(bot)
+            tasks.append(task)
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return dict(
+                queued=self.queued,
+                running=sum(self._running.values()),
+                dropped=self.dropped,
+                handled=self.handled,
+                failed=self.failed,
+            )
+
+    def _make_runnable(self, bot: str) -> None:
+        if (
+            bot not in self._runnable_set
+            and self._ready.get(bot)
+            and self._running.get(bot, 0) < self.bot_concurrency
+        ):
+            self._runnable.append(bot)
+            self._runnable_set.add(bot)
+            self._condition.notify()
+
+    def _next_task(self) -> Optional[Tuple[ConversationId, Task]]:
+        with self._condition:
+            while not self._runnable:
+                if self._stopping and self.queued == 0:
+                    return None
+                self._condition.wait()
+            bot = self._runnable.popleft()
+            self._runnable_set.discard(bot)
+            ready = self._ready[bot]
+            conversation_id = ready.popleft()
+            if not ready:
+                del self._ready[bot]
+            task = self._conversations[conversation_id].popleft()
+            self.queued -= 1
+            self._running[bot] = self._running.get(bot, 0) + 1
+            # Let the bot's other conversations have another thread.
+            self._make_runnable(bot)
+            return conversation_id, task
+
+    def _finish(self, conversation_id: ConversationId, failed: bool) -> None:
+        bot = conversation_id[0]
+        with self._condition:
+            if failed:
+                self.failed += 1
+            else:
+                self.handled += 1
+            self._running[bot] -= 1
+            if self._running[bot] == 0:
+                del self._running[bot]
+            if self._conversations[conversation_id]:
+                self._ready.setdefault(bot, deque()).append(conversation_id)
+            else:
+                del self._conversations[conversation_id]
+            self._make_runnable(bot)
+            if self._stopping and self.queued == 0:
+                self._condition.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            next_task = self._next_task()
+            if next_task is None:
+                return
+            conversation_id, task = next_task
+            failed = False
+            try:
+                task()
+            except Exception:
+                failed = True
+                logging.exception("Bot %s failed to handle a message", conversation_id[0])
+            finally:
+                self._finish(conversation_id, failed)
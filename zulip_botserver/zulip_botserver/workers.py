@@ -0,0 +1,229 @@
+import contextlib
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from types import FrameType
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from werkzeug.serving import make_server
+
+WSGIApp = Callable[[Dict[str, Any], Callable[..., Any]], Iterable[bytes]]
+
+
+class InFlightRequests:
+    """WSGI middleware counting the requests being handled, so that a worker can drain them."""
+
+    def __init__(self, app: WSGIApp) -> None:
+        self.app = app
+        self.count = 0
+        self._condition = threading.Condition()
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]) -> List[bytes]:
+        with self._condition:
+            self.count += 1
+        try:
+            # Flask bodies are small; reading them here means the request
+            # is done once this returns.
+            return list(self.app(environ, start_response))
+        finally:
+            with self._condition:
+                self.count -= 1
+                self._condition.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: self.count == 0, timeout)
+
+
+class Worker:
+    def __init__(self, pid: int, ready_fd: int) -> None:
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.ready = False
+
+
+class WorkerPool:
+    """
+    Serves a WSGI app from several processes sharing one listening socket,
+    like a pre-fork WSGI server, so that one slow bot doesn't hold up every
+    other bot on the Botserver.  Each worker handles requests on its own
+    threads.
+
+    The master process only binds the socket and supervises the workers;
+    each worker calls `init_worker` once, after it is forked, to load the
+    bots, and `stop_worker` once it has stopped serving requests, and is
+    restarted if it dies.  On SIGHUP, a new set of workers is
+    started, and once they are ready, the old ones stop accepting requests
+    and finish the ones they are handling, within `graceful_timeout`
+    seconds; if the new workers fail to start, the old ones are kept.
+    SIGTERM and SIGINT stop the workers the same way, then the master.
+    """
+
+    def __init__(
+        self,
+        app: WSGIApp,
+        host: str,
+        port: int,
+        workers: int,
+        init_worker: Callable[[], None],
+        graceful_timeout: float = 30.0,
+        stop_worker: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.app = app
+        self.host = host
+        self.port = port
+        self.size = workers
+        self.init_worker = init_worker
+        self.graceful_timeout = graceful_timeout
+        self.stop_worker = stop_worker
+        self.socket: Optional[socket.socket] = None
+        self.workers: Dict[int, Worker] = {}
+        self._reload_requested = False
+        self._stopping = False
+
+    def bind(self) -> int:
+        """Binds the listening socket, and returns its port."""
+        if self.socket is None:
+            family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+            self.socket = socket.socket(family, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
+            self.socket.listen(128)
+            self.socket.set_inheritable(True)
+        return self.socket.getsockname()[1]
+
+    def run(self) -> None:
+        port = self.bind()
+        signal.signal(signal.SIGHUP, self._request_reload)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        logging.info("Botserver listening on %s:%d with %d workers", self.host, port, self.size)
+
+        if not self._start_workers(self.size):
+            self._stop_workers(list(self.workers.values()))
+            raise SystemExit("Error: The Botserver workers failed to start.")
+        while not self._stopping:
+            if self._reload_requested:
+                self._reload_requested = False
+                self._reload()
+            self._reap()
+            missing = self.size - len(self.workers)
+            if missing > 0 and not self._stopping:
+                logging.warning("Restarting %d Botserver worker(s)", missing)
+                if not self._start_workers(missing):
+                    # Don't restart a worker that can't start in a busy loop.
+                    time.sleep(1)
+            time.sleep(0.1)
+        self._stop_workers(list(self.workers.values()))
+
+    def _request_reload(self, signum: int, frame: Optional[FrameType]) -> None:
+        self._reload_requested = True
+
+    def _request_stop(self, signum: int, frame: Optional[FrameType]) -> None:
+        self._stopping = True
+
+    def _reload(self) -> None:
+        logging.info("Reloading the Botserver workers")
+        old_workers = list(self.workers.values())
+        if self._start_workers(self.size):
+            self._stop_workers(old_workers)
+        else:
+            logging.error("New Botserver workers failed to start; keeping the old ones")
+
+    def _start_workers(self, count: int) -> bool:
+        """Forks `count` workers, and returns whether they all started."""
+        new_workers = [self._spawn() for _ in range(count)]
+        deadline = time.monotonic() + self.graceful_timeout
+        waiting = {worker.ready_fd: worker for worker in new_workers}
+        while waiting:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            readable, _, _ = select.select(list(waiting), [], [], timeout)
+            for fd in readable:
+                worker = waiting.pop(fd)
+                # An empty read means the worker exited before it was ready.
+                worker.ready = os.read(fd, 1) == b"1"
+                os.close(fd)
+        for fd in waiting:
+            os.close(fd)
+        if all(worker.ready for worker in new_workers):
+            return True
+        self._stop_workers(new_workers)
+        return False
+
+    def _spawn(self) -> Worker:
+        assert self.socket is not None
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self._run_worker(write_fd)
+        os.close(write_fd)
+        worker = Worker(pid, read_fd)
+        self.workers[pid] = worker
+        return worker
+
+    def _run_worker(self, ready_fd: int) -> None:
+        # Only the master handles ^C and reloads; it passes them on.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        assert self.socket is not None
+        exit_code = 1
+        try:
+            self.init_worker()
+            app = InFlightRequests(self.app)
+            server = make_server(self.host, self.port, app, threaded=True, fd=self.socket.fileno())
+
+            def shutdown(signum: int, frame: Optional[FrameType]) -> None:
+                # shutdown() waits for serve_forever() to return, so it can't
+                # be called from the thread running it.
+                threading.Thread(target=server.shutdown).start()
+
+            signal.signal(signal.SIGTERM, shutdown)
+            os.write(ready_fd, b"1")
+            os.close(ready_fd)
+            server.serve_forever()
+            if not app.wait_idle(self.graceful_timeout):
+                logging.warning("Botserver worker %d stopped with requests in flight", os.getpid())
+            if self.stop_worker is not None:
+                self.stop_worker()
+            exit_code = 0
+        except BaseException:
+            logging.exception("Botserver worker %d failed", os.getpid())
+        finally:
+            logging.shutdown()
+            # Never return into the master's code.
+            os._exit(exit_code)
+
+    def _stop_workers(self, workers: List[Worker]) -> None:
+        for worker in workers:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(worker.pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 1
+        for worker in workers:
+            while worker.pid in self.workers and time.monotonic() < deadline:
+                self._reap()
+                time.sleep(0.05)
+            if worker.pid in self.workers:
+                logging.warning("Killing Botserver worker %d", worker.pid)
+                os.kill(worker.pid, signal.SIGKILL)
+                os.waitpid(worker.pid, 0)
+                del self.workers[worker.pid]
+
+    def _reap(self) -> None:
+        for pid in list(self.workers):
+            try:
+                reaped, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                reaped, status = pid, 0
+            if reaped == 0:
+                continue
+            del self.workers[pid]
+            if status != 0:
+                logging.warning("Botserver worker %d exited with status %d", pid, status)